@@ -0,0 +1,82 @@
+"""
+Обновление сессии посреди долгого прогона. Когда http_utils видит истёкшую
+сессию (419, 401, редирект на /login, CSRF token mismatch), он вызывает
+SessionRefresher профиля: тот один раз перелогинивается через
+update_profile_cookies (остальные потоки этого профиля ждут), переносит новые
+cookies и CSRF во все сессии профиля и сохраняет профиль; исходный запрос
+повторяется.
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from mangabuff.auth.login import update_profile_cookies
+from mangabuff.config import SESSION_REFRESH_MIN_INTERVAL
+from mangabuff.http.http_utils import apply_profile_to_sessions, set_session_refresher
+
+
+class SessionRefresher:
+    def __init__(
+        self,
+        profile_data: Dict,
+        email: str,
+        password: str,
+        on_refresh: Optional[Callable[[], None]] = None,
+        debug: bool = False,
+        min_interval: float = SESSION_REFRESH_MIN_INTERVAL,
+    ) -> None:
+        self.profile_data = profile_data
+        self.email = email
+        self.password = password
+        self.on_refresh = on_refresh
+        self.debug = debug
+        self.min_interval = min_interval
+        self.generation = 0
+        self.last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._owner: Optional[int] = None
+
+    def install(self) -> "SessionRefresher":
+        set_session_refresher(self.profile_data, self)
+        return self
+
+    def uninstall(self) -> None:
+        set_session_refresher(self.profile_data, None)
+
+    def wait_idle(self) -> None:
+        """Запросы профиля ждут, пока идёт перелогин (кроме запросов самого перелогина)."""
+        if self._owner != threading.get_ident():
+            self._idle.wait()
+
+    def refresh(self, seen_generation: int) -> bool:
+        """
+        True — сессия обновлена (этим или другим потоком после seen_generation),
+        запрос можно повторить. Перелогин не чаще min_interval, чтобы не зациклиться
+        на 419 по другим причинам.
+        """
+        with self._lock:
+            if self.generation != seen_generation:
+                return True
+            if time.monotonic() - self.last_attempt < self.min_interval:
+                return False
+            self._owner = threading.get_ident()
+            self._idle.clear()
+            try:
+                self.last_attempt = time.monotonic()
+                if self.debug:
+                    print("[SESSION] session expired, logging in again")
+                ok, info = update_profile_cookies(self.profile_data, self.email, self.password, debug=self.debug)
+                if not ok:
+                    print(f"❌ Не удалось обновить сессию: {info.get('message', 'auth error')}")
+                    return False
+                self.generation += 1
+                apply_profile_to_sessions(self.profile_data)
+                if self.on_refresh:
+                    self.on_refresh()
+                print("ℹ️ Сессия истекла — авторизация обновлена")
+                return True
+            finally:
+                self._owner = None
+                self._idle.set()
@@ -0,0 +1,58 @@
+"""
+Синтетические фикстуры для бенчмарков: фрагменты инвентаря (HTML и JSON
+availableCardsLoad) и страницы владельцев с пагинацией. Разметка повторяет
+то, что ищут парсеры (data-id/data-card-id, ссылки /cards/, маркеры онлайна
+и замка), данные детерминированы по seed.
+"""
+import json
+from typing import Any, Dict, List
+
+SCALES = (60, 1000, 10000, 30000)
+RANKS = "ABCDES"
+
+
+def inventory_html(cards: int, seed: int = 0) -> bytes:
+    items = []
+    for i in range(cards):
+        inst = seed * 1_000_000 + i + 1
+        cid = 1000 + (i * 7 + seed) % 50000
+        items.append(
+            f'<div class="trade__main-item card" data-id="{inst}" data-card-id="{cid}" data-rank="{RANKS[i % 6]}">'
+            f'<a class="card-link" href="/cards/{cid}"><img src="/img/cards/{cid}.jpg" alt="Карта {cid}"></a>'
+            f'<div class="card__title">Карта номер {cid}</div></div>'
+        )
+    return ("<html><body><div class=\"trade__main-items\">" + "".join(items) + "</div></body></html>").encode("utf-8")
+
+
+def inventory_entries(cards: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Карты в форме JSON-ответа availableCardsLoad (вложенный card, instance_id)."""
+    out = []
+    for i in range(cards):
+        cid = 1000 + (i * 7 + seed) % 50000
+        out.append({
+            "instance_id": seed * 1_000_000 + i + 1,
+            "card": {"id": cid, "name": f"Карта номер {cid}", "rank": RANKS[i % 6], "image": f"/img/cards/{cid}.jpg"},
+            "grade": RANKS[i % 6],
+        })
+    return out
+
+
+def inventory_json(cards: int, seed: int = 0) -> bytes:
+    return json.dumps({"cards": inventory_entries(cards, seed)}, ensure_ascii=False).encode("utf-8")
+
+
+def owners_html(owners: int, seed: int = 0, last_page: int = 50) -> bytes:
+    items = []
+    for i in range(owners):
+        uid = seed * 100_000 + i + 1
+        online = " card-show__owner--online" if i % 3 else ""
+        lock = '<span class="card-show__owner-icon--trade-lock"></span>' if i % 5 == 0 else ""
+        items.append(
+            f'<div class="card-show__owner-item"><div class="card-show__owner-wrap"><div class="card-show__owner-body">'
+            f'<a class="card-show__owner{online}" href="/users/{uid}"><span>user{uid}</span>{lock}</a></div></div></div>'
+        )
+    pages = "".join(f'<li><a href="?page={p}">{p}</a></li>' for p in (1, 2, 3, last_page))
+    return (
+        "<html><body><div class=\"card-show__owners\">" + "".join(items) + "</div>"
+        f"<ul class=\"pagination\">{pages}</ul></body></html>"
+    ).encode("utf-8")
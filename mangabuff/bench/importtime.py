@@ -0,0 +1,85 @@
+"""
+Бюджет времени старта CLI.
+
+    python -m mangabuff.bench.importtime [--budget_ms 30] [--run_budget_ms 150]
+
+Замеряет `python -X importtime -c "import mangabuff.cli"` в чистом процессе,
+проверяет, что тяжёлые зависимости (requests, bs4) не грузятся при импорте,
+и что офлайн-команда --analyze_har укладывается в бюджет по wall-clock.
+Код возврата 1 — бюджет превышен.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+HEAVY_MODULES = ("requests", "bs4", "urllib3")
+OFFLINE_MODULES = ("mangabuff.cli", "mangabuff.services.har")
+
+
+def measure_import(module: str) -> Tuple[int, Dict[str, int]]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            cum_us = int(parts[1].strip())
+        except ValueError:
+            continue
+        cumulative[parts[2].strip()] = cum_us
+    return cumulative.get(module, 0), cumulative
+
+
+def measure_har_run() -> float:
+    with tempfile.NamedTemporaryFile("w", suffix=".har", delete=False, encoding="utf-8") as f:
+        json.dump({"log": {"entries": []}}, f)
+        har_path = f.name
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "mangabuff.cli", "--analyze_har", har_path], capture_output=True, check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import-time budget for mangabuff CLI")
+    parser.add_argument("--budget_ms", type=float, default=30.0, help="Бюджет импорта модуля, мс")
+    parser.add_argument("--run_budget_ms", type=float, default=150.0, help="Бюджет полного запуска --analyze_har, мс")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов (берётся минимум)")
+    args = parser.parse_args()
+
+    failures: List[str] = []
+    for module in OFFLINE_MODULES:
+        best_us = None
+        loaded: Dict[str, int] = {}
+        for _ in range(max(1, args.repeat)):
+            cum_us, loaded = measure_import(module)
+            best_us = cum_us if best_us is None else min(best_us, cum_us)
+        heavy = [m for m in HEAVY_MODULES if m in loaded]
+        ms = (best_us or 0) / 1000
+        print(f"{module}: {ms:.1f} ms (budget {args.budget_ms:.0f} ms)" + (f", heavy: {', '.join(heavy)}" if heavy else ""))
+        if ms > args.budget_ms:
+            failures.append(f"{module} import {ms:.1f} ms > {args.budget_ms:.0f} ms")
+        if heavy:
+            failures.append(f"{module} pulls in {', '.join(heavy)}")
+
+    run_ms = min(measure_har_run() for _ in range(max(1, args.repeat)))
+    print(f"cli --analyze_har: {run_ms:.1f} ms (budget {args.run_budget_ms:.0f} ms)")
+    if run_ms > args.run_budget_ms:
+        failures.append(f"--analyze_har run {run_ms:.1f} ms > {args.run_budget_ms:.0f} ms")
+
+    for msg in failures:
+        print(f"❌ {msg}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Пропускная способность парсинга в зависимости от числа процессов пула.
+
+    python -m mangabuff.bench.parse_pool [--pages 40] [--cards 2000] [--owners 60] [--workers 0,1,2,4] [--latency_ms 0]
+
+Генерирует синтетические страницы инвентаря (~cards карт) и владельцев,
+парсит их через ParseExecutor с разным числом воркеров и печатает страниц/с и МБ/с.
+С --latency_ms основной поток перед каждой отправкой «качает» страницу (sleep),
+что показывает, насколько парсинг перекрывается с сетевым ожиданием.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List, Tuple
+
+from mangabuff.bench.fixtures import inventory_html, owners_html
+from mangabuff.parsing.pool import ParseExecutor
+from mangabuff.services.owners import parse_online_unlocked_owners
+
+
+def run(executor: ParseExecutor, bodies: List[Tuple[str, bytes]], latency: float) -> float:
+    started = time.perf_counter()
+    futures = []
+    for kind, body in bodies:
+        if latency:
+            time.sleep(latency)
+        if kind == "cards":
+            futures.append(executor.submit_card_rows(body, "utf-8"))
+        else:
+            futures.append(executor.submit_user_page(parse_online_unlocked_owners, body, "utf-8"))
+    for fut in futures:
+        fut.result()
+    return time.perf_counter() - started
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ParseExecutor throughput vs worker count")
+    parser.add_argument("--pages", type=int, default=40, help="Страниц каждого вида")
+    parser.add_argument("--cards", type=int, default=2000, help="Карт на странице инвентаря")
+    parser.add_argument("--owners", type=int, default=60, help="Владельцев на странице")
+    parser.add_argument("--workers", type=str, default="", help="Список числа воркеров через запятую (по умолчанию 0,1,2,..,cpu)")
+    parser.add_argument("--latency_ms", type=float, default=0.0, help="Имитация сетевой задержки перед каждой страницей")
+    args = parser.parse_args()
+
+    cpu = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(x) for x in args.workers.split(",") if x.strip()]
+    else:
+        counts = sorted({0, 1, min(2, cpu), min(4, cpu), cpu})
+
+    bodies: List[Tuple[str, bytes]] = []
+    for i in range(args.pages):
+        bodies.append(("cards", inventory_html(args.cards, seed=i)))
+        bodies.append(("owners", owners_html(args.owners, seed=i)))
+    total_mb = sum(len(b) for _k, b in bodies) / 1e6
+    print(f"{len(bodies)} pages, {total_mb:.1f} MB, cpu={cpu}, latency={args.latency_ms:.0f} ms")
+
+    for workers in counts:
+        with ParseExecutor(workers=workers, min_bytes=0) as executor:
+            # прогрев: старт процессов и импорт bs4 не входят в замер
+            for fut in [executor.submit_card_rows(bodies[0][1], "utf-8") for _ in range(workers)]:
+                fut.result()
+            elapsed = run(executor, bodies, args.latency_ms / 1000)
+        print(f"workers={workers}: {elapsed:.2f}s, {len(bodies) / elapsed:.1f} pages/s, {total_mb / elapsed:.2f} MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Микробенчмарки горячих CPU-путей на синтетических фикстурах 60/1k/10k/30k.
+
+    python -m mangabuff.bench.parsers [--scales 60,1000,10000] [--only parse_trade_cards_html]
+                                      [--save base.json] [--compare base.json --tolerance 1.3]
+
+Для каждого случая: время на вызов (лучшее и медиана по повторам) и аллокации
+на вызов (пик tracemalloc и число выделенных блоков, отдельным прогоном —
+tracemalloc искажает время). --compare печатает регрессии относительно
+сохранённого базового прогона; код возврата 1 — есть регрессия.
+
+parse_online_unlocked_owners квадратичен по размеру страницы (select_one по
+предкам ссылки захватывает весь список), поэтому страницы владельцев больше
+--owners_max (по умолчанию 1000) пропускаются — реальные страницы намного меньше.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from bs4 import BeautifulSoup
+
+from mangabuff.bench.fixtures import SCALES, inventory_entries, inventory_html, inventory_json, owners_html
+from mangabuff.http.http_utils import decode_body_and_maybe_json
+from mangabuff.parsing.cards import entry_card_id, entry_instance_id, normalize_card_entry, parse_trade_cards_html
+from mangabuff.services.owners import parse_online_unlocked_owners
+from mangabuff.utils.html import extract_last_page_number
+
+JSON_HEADERS = {"Content-Type": "application/json; charset=utf-8"}
+
+
+def _cases(n: int, owners_max: int) -> List[Tuple[str, Callable[[], Any]]]:
+    html = inventory_html(n)
+    entries = inventory_entries(n)
+    normalized = [normalize_card_entry(c) for c in entries]
+    body = inventory_json(n)
+    cases: List[Tuple[str, Callable[[], Any]]] = []
+    if n <= owners_max:
+        owners = owners_html(n).decode("utf-8")
+        owners_soup = BeautifulSoup(owners, "html.parser")
+        cases += [
+            ("parse_online_unlocked_owners", lambda: parse_online_unlocked_owners(owners)),
+            ("extract_last_page_number", lambda: extract_last_page_number(owners_soup)),
+        ]
+    return [("parse_trade_cards_html", lambda: parse_trade_cards_html(html, "utf-8"))] + cases + [
+        ("normalize_card_entry", lambda: [normalize_card_entry(c) for c in entries]),
+        ("entry_card_id", lambda: [entry_card_id(c) for c in normalized]),
+        ("entry_instance_id", lambda: [entry_instance_id(c) for c in normalized]),
+        ("decode_body_and_maybe_json", lambda: decode_body_and_maybe_json(body, JSON_HEADERS)),
+        ("decode_body_and_maybe_json[bytes]", lambda: decode_body_and_maybe_json(body, JSON_HEADERS, want_text=False)),
+    ]
+
+
+def time_call(fn: Callable[[], Any], min_time: float, max_repeat: int) -> Tuple[float, float, int]:
+    samples: List[float] = []
+    total = 0.0
+    while not samples or (total < min_time and len(samples) < max_repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        samples.append(elapsed)
+        total += elapsed
+    return min(samples), statistics.median(samples), len(samples)
+
+
+def alloc_call(fn: Callable[[], Any]) -> Tuple[int, int]:
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        base, _ = tracemalloc.get_traced_memory()
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        del result
+    finally:
+        tracemalloc.stop()
+    blocks = sum(max(0, s.count_diff) for s in after.compare_to(before, "filename"))
+    return peak - base, blocks
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Parser micro-benchmarks on synthetic fixtures")
+    parser.add_argument("--scales", type=str, default=",".join(str(s) for s in SCALES), help="Размеры фикстур через запятую")
+    parser.add_argument("--only", type=str, default="", help="Только случаи с этой подстрокой в имени")
+    parser.add_argument("--owners_max", type=int, default=1000, help="Максимальный размер страницы владельцев")
+    parser.add_argument("--min_time", type=float, default=0.3, help="Минимум суммарного времени на случай, с")
+    parser.add_argument("--max_repeat", type=int, default=50, help="Максимум повторов на случай")
+    parser.add_argument("--save", type=str, default="", help="Сохранить результаты в JSON")
+    parser.add_argument("--compare", type=str, default="", help="Сравнить с сохранённым JSON")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="Допустимый рост времени/пика памяти при --compare")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'case':<36}{'n':>7}{'best ms':>11}{'median ms':>11}{'runs':>6}{'peak KiB':>11}{'blocks':>10}")
+    for n in [int(x) for x in args.scales.split(",") if x.strip()]:
+        for name, fn in _cases(n, args.owners_max):
+            if args.only and args.only not in name:
+                continue
+            best, median, runs = time_call(fn, args.min_time, args.max_repeat)
+            peak, blocks = alloc_call(fn)
+            key = f"{name}@{n}"
+            results[key] = {"best_ms": best * 1000, "median_ms": median * 1000, "peak_bytes": peak, "blocks": blocks}
+            print(f"{name:<36}{n:>7}{best * 1000:>11.2f}{median * 1000:>11.2f}{runs:>6}{peak / 1024:>11.0f}{blocks:>10}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if not args.compare:
+        return 0
+    with open(args.compare, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in ("best_ms", "peak_bytes"):
+            if base.get(metric) and cur[metric] > base[metric] * args.tolerance:
+                regressions.append(f"{key} {metric}: {base[metric]:.1f} -> {cur[metric]:.1f}")
+    for msg in regressions:
+        print(f"❌ {msg}")
+    if not regressions:
+        print(f"✅ Нет регрессий относительно {args.compare} (допуск x{args.tolerance})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
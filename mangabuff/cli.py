@@ -1,20 +1,16 @@
 import argparse
 import json
+import os
 import pathlib
 from typing import Optional, Dict, Any, List
 
-from mangabuff.config import BASE_URL
-from mangabuff.profiles.store import ProfileStore
-from mangabuff.auth.login import update_profile_cookies
-from mangabuff.services.club import find_boost_card_info, owners_and_wanters_counts
-from mangabuff.services.inventory import ensure_own_inventory
-from mangabuff.services.owners import iter_online_owners_by_pages
-from mangabuff.services.trade import send_trades_to_online_owners
-from mangabuff.services.har import analyze_har
+from mangabuff.config import WATCH_INTERVAL, TRADE_BUNDLE_MAX, PARSE_WORKERS
+
+# Сервисные модули (requests, bs4) импортируются лениво внутри команд:
+# офлайн-команды вроде --analyze_har не должны платить за них при старте.
 
 def load_target_card_from_file(profiles_dir: pathlib.Path, card_file: Optional[str] = None, debug: bool=False) -> Optional[Dict[str, Any]]:
     import random
-    from mangabuff.utils.text import extract_card_id_from_href
     path: Optional[pathlib.Path] = None
     if card_file:
         p = pathlib.Path(card_file)
@@ -30,6 +26,16 @@ def load_target_card_from_file(profiles_dir: pathlib.Path, card_file: Optional[s
             return None
         path = files[0]
 
+    if path.suffix == ".ndjson":
+        # инвентарь в NDJSON: случайная карта по индексу, без разбора всего файла
+        from mangabuff.services.cardfile import CardFile
+        try:
+            with CardFile(path) as cf:
+                chosen = cf.random()
+        except (OSError, ValueError):
+            return None
+        return target_from_entry(chosen, path) if chosen else None
+
     try:
         with path.open("r", encoding="utf-8") as f:
             data = json.load(f)
@@ -37,32 +43,40 @@ def load_target_card_from_file(profiles_dir: pathlib.Path, card_file: Optional[s
         return None
 
     chosen = None
-    if isinstance(data, dict):
-        if any(k in data for k in ("card_id", "card", "id", "name", "rank")) and not any(isinstance(v, list) for v in data.values()):
-            chosen = data
-        else:
-            candidates = []
-            if "cards" in data and isinstance(data["cards"], list):
-                candidates = data["cards"]
-            else:
-                for v in data.values():
-                    if isinstance(v, list):
-                        candidates = v
-                        break
-            if candidates:
-                chosen = random.choice(candidates)
-    elif isinstance(data, list):
-        if not data:
-            return None
-        chosen = random.choice(data)
+    if _is_single_card(data):
+        chosen = data
+    else:
+        candidates = _target_candidates(data)
+        if candidates:
+            chosen = random.choice(candidates)
 
     if chosen is None:
         return None
+    return target_from_entry(chosen, path)
 
-    card_block = chosen.get("card") if isinstance(chosen, dict) else None
+def _is_single_card(data: Any) -> bool:
+    return isinstance(data, dict) and any(k in data for k in ("card_id", "card", "id", "name", "rank")) and not any(isinstance(v, list) for v in data.values())
+
+def _target_candidates(data: Any) -> List[Dict[str, Any]]:
+    if isinstance(data, dict):
+        if "cards" in data and isinstance(data["cards"], list):
+            return data["cards"]
+        for v in data.values():
+            if isinstance(v, list):
+                return v
+        return []
+    if isinstance(data, list):
+        return data
+    return []
+
+def target_from_entry(chosen: Dict[str, Any], path: pathlib.Path) -> Optional[Dict[str, Any]]:
+    from mangabuff.utils.text import extract_card_id_from_href
+    if not isinstance(chosen, dict):
+        return None
+    card_block = chosen.get("card") if isinstance(chosen.get("card"), dict) else None
     card_id = None
     for key in ("card_id", "cardId", "id"):
-        if key in (chosen or {}):
+        if key in chosen:
             card_id = chosen.get(key)
             break
     if card_id is None and card_block:
@@ -83,12 +97,59 @@ def load_target_card_from_file(profiles_dir: pathlib.Path, card_file: Optional[s
 
     return {"card_id": int(card_id), "name": name or "", "rank": rank or "", "file": str(path)}
 
-def main():
+def load_targets_from_file(path: pathlib.Path) -> List[Dict[str, Any]]:
+    if path.suffix == ".ndjson":
+        from mangabuff.services.cardfile import load_cards
+        try:
+            entries = load_cards(path)
+        except (OSError, ValueError):
+            return []
+    else:
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return []
+        entries = [data] if _is_single_card(data) else _target_candidates(data)
+    targets: List[Dict[str, Any]] = []
+    seen = set()
+    for entry in entries:
+        t = target_from_entry(entry, path)
+        if t and t["card_id"] not in seen:
+            seen.add(t["card_id"])
+            targets.append(t)
+    return targets
+
+def load_my_cards(profile_path: pathlib.Path, profile: Dict, debug: bool=False, incremental: bool=True) -> Optional[List[Dict[str, Any]]]:
+    from mangabuff.services.inventory import ensure_own_inventory
+    try:
+        inv_path = ensure_own_inventory(profile_path, profile, debug=debug, incremental=incremental)
+    except Exception as e:
+        print(f"❌ Нет инвентаря: {e}")
+        return None
+    from mangabuff.services.cardfile import load_cards
+    try:
+        return load_cards(inv_path)
+    except Exception as e:
+        print(f"❌ Ошибка чтения инвентаря {inv_path}: {e}")
+        return None
+
+def open_checkpoint(profile_path: pathlib.Path, profile: Dict, name: str, key: str, resume: bool):
+    from mangabuff.services.checkpoint import CampaignCheckpoint
+    my_id = profile.get("id") or profile.get("ID") or profile.get("user_id") or "me"
+    checkpoint = CampaignCheckpoint.open(profile_path.parent, f"{my_id}_{name}", key, resume=resume)
+    if checkpoint.resumed:
+        print(f"ℹ️ Продолжаем рассылку: обработано страниц {checkpoint.page}, предложений {len(checkpoint.offered) + len(checkpoint.done)}")
+    elif resume:
+        print("ℹ️ Чекпоинт не найден — рассылка с начала.")
+    return checkpoint
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="MangaBuff helper (modular)")
     parser.add_argument("--dir", type=str, default=".", help="Рабочая папка")
-    parser.add_argument("--name", required=True, help="Имя профиля")
-    parser.add_argument("--email", required=True, help="Email")
-    parser.add_argument("--password", required=True, help="Password")
+    parser.add_argument("--name", help="Имя профиля")
+    parser.add_argument("--email", help="Email")
+    parser.add_argument("--password", help="Password")
     parser.add_argument("--club_name", help="Название клуба")
     parser.add_argument("--id", type=int, help="user id")
     parser.add_argument("--boost_url", help="boost url")
@@ -100,12 +161,65 @@ def main():
     parser.add_argument("--trade_pages", type=int, default=0, help="Сколько страниц онлайн пользователей обрабатывать (0 = все)")
     parser.add_argument("--trade_send_online", action="store_true", help="Рассылка обменов онлайн владельцам карты")
     parser.add_argument("--trade_dry_run", type=int, default=1, help="1 = dry-run, 0 = реально отправлять")
-    parser.add_argument("--trade_card_file", type=str, default="", help="Путь к card_*_from_*.json")
+    parser.add_argument("--trade_card_file", type=str, default="", help="Путь к card_*_from_*.json или инвентарю .ndjson")
     parser.add_argument("--use_api", type=int, default=1, help="1 = использовать API /trades/create, 0 = форму")
     parser.add_argument("--analyze_har", type=str, default="", help="Путь к HAR-файлу для анализа")
+    parser.add_argument("--trade_targets_file", type=str, default="", help="JSON со списком целевых карт для мультикампании")
+    parser.add_argument("--trade_bundle_max", type=int, default=0, help="Максимум карт в одном предложении мультикампании (0 = MANGABUFF_TRADE_BUNDLE_MAX)")
+    parser.add_argument("--shard_workers", type=int, default=0, help="Процессов-воркеров для одной рассылки (очередь в SQLite)")
+    parser.add_argument("--shard_profiles", type=str, default="", help="Профили (через запятую) для воркеров шардированной рассылки")
+    parser.add_argument("--shard_join", action="store_true", help="Подключиться воркером к уже созданной очереди рассылки")
+    parser.add_argument("--shard_queue", type=str, default="", help="Путь к файлу очереди (по умолчанию campaign_<card_id>.queue.sqlite)")
+    parser.add_argument("--resume", action="store_true", help="Продолжить прерванную рассылку с чекпоинта")
+    parser.add_argument("--reciprocal", action="store_true", help="Сначала владельцы, которые хотят наши дубликаты")
+    parser.add_argument("--inventory_full_sync", action="store_true", help="Полностью перечитать свой инвентарь (без дельты)")
+    parser.add_argument("--watch", action="store_true", help="Режим демона: опрашивать владельцев и boost-страницу по интервалу")
+    parser.add_argument("--watch_interval", type=int, default=0, help="Интервал опроса в секундах (0 = MANGABUFF_WATCH_INTERVAL)")
+    parser.add_argument("--watch_cycles", type=int, default=0, help="Сколько циклов выполнить (0 = бесконечно)")
+    parser.add_argument("--hedge", action="store_true", help="Дублировать медленные чтения карт партнёров и подбирать таймауты по латентности эндпоинта")
+    parser.add_argument("--parse_workers", type=int, default=-1, help="Процессов для парсинга HTML (0 = в основном процессе, по умолчанию MANGABUFF_PARSE_WORKERS)")
+    parser.add_argument("--profile", action="store_true", help="Профилировать фазы (cProfile + tracemalloc)")
+    parser.add_argument("--profile_dir", type=str, default="", help="Куда писать отчёт профилировщика (по умолчанию --dir)")
+    parser.add_argument("--profile_stacks", action="store_true", help="Дополнительно писать collapsed stacks для flamegraph")
+    return parser
 
+def main():
+    parser = build_parser()
     args = parser.parse_args()
 
+    if not args.profile:
+        run(args, parser)
+        return
+
+    from mangabuff.utils.profiling import PhaseProfiler
+    prof = PhaseProfiler(pathlib.Path(args.profile_dir or args.dir), stacks=args.profile_stacks)
+    try:
+        run(args, parser, prof)
+    finally:
+        print(f"Профиль: {prof.report()}")
+
+def run(args: argparse.Namespace, parser: argparse.ArgumentParser, prof: Any = None) -> None:
+    if prof is None:
+        from mangabuff.utils.profiling import NullProfiler
+        prof = NullProfiler()
+
+    # HAR-аналитика: офлайн, без профиля и сети
+    if args.analyze_har:
+        from mangabuff.services.har import analyze_har
+        with prof.phase("har"):
+            top = analyze_har(args.analyze_har, debug=args.debug)
+        print("Топ путей из HAR:")
+        for k, v in top.items():
+            print(f"{k} -> {v}")
+        if not (args.boost_url or args.trade_send_online or args.watch):
+            return
+
+    if not (args.name and args.email and args.password):
+        parser.error("--name, --email и --password обязательны для сетевых команд")
+
+    from mangabuff.profiles.store import ProfileStore
+    from mangabuff.auth.login import update_profile_cookies
+
     store = ProfileStore(args.dir)
     profile_path = store.path_for(args.name)
 
@@ -114,7 +228,8 @@ def main():
     store.write_by_path(profile_path, profile)
 
     # Авторизация/обновление cookies
-    ok, info = update_profile_cookies(profile, args.email, args.password, debug=args.debug, skip_check=args.skip_check)
+    with prof.phase("login"):
+        ok, info = update_profile_cookies(profile, args.email, args.password, debug=args.debug, skip_check=args.skip_check)
     if not ok:
         msg = info.get("message", "auth error")
         print(f"❌ Ошибка авторизации: {msg}")
@@ -124,61 +239,203 @@ def main():
     store.write_by_path(profile_path, profile)
     print(f"{args.name}: ✅ Авторизация ок")
 
+    # Истёкшая посреди прогона сессия обновляется автоматически, запрос повторяется
+    from mangabuff.auth.refresh import SessionRefresher
+    SessionRefresher(
+        profile, args.email, args.password,
+        on_refresh=lambda: store.write_by_path(profile_path, profile),
+        debug=args.debug,
+    ).install()
+
+    # Локальный справочник карт: пополняется из всех распарсенных ответов
+    import atexit
+    from mangabuff.services.catalog import CardCatalog, set_active_catalog
+    catalog = CardCatalog.open(profile_path.parent)
+    set_active_catalog(catalog)
+    atexit.register(catalog.save)
+
+    # Кто какие карты держит (по всем скачанным инвентарям) — между запусками
+    from mangabuff.services.holdings import HoldingsIndex, set_active_holdings
+    holdings = HoldingsIndex.open(profile_path.parent)
+    set_active_holdings(holdings)
+    atexit.register(holdings.close)
+
+    # Подобранные размеры страниц availableCardsLoad и т.п. — между запусками
+    from mangabuff.http.pagesize import PageSizeTuner, set_active_page_tuner
+    page_sizes = PageSizeTuner.open(profile_path.parent)
+    set_active_page_tuner(page_sizes)
+    atexit.register(page_sizes.save)
+
+    # Дубли медленных чтений и таймауты по латентности эндпоинта (опционально)
+    if args.hedge:
+        from mangabuff.http.hedge import set_hedging
+        set_hedging(True)
+
+    # Пул процессов для парсинга больших HTML-страниц (опционально)
+    parse_workers = args.parse_workers if args.parse_workers >= 0 else PARSE_WORKERS
+    if parse_workers > 0:
+        from mangabuff.parsing.pool import ParseExecutor, set_active_parse_executor
+        executor = ParseExecutor(workers=parse_workers)
+        set_active_parse_executor(executor)
+        atexit.register(executor.close)
+
     # Boost-карта (опционально)
     if args.boost_url:
-        res = find_boost_card_info(profile, profile_path.parent, args.boost_url, debug=args.debug)
+        from mangabuff.services.club import find_boost_card_info, owners_and_wanters_counts
+        with prof.phase("boost"):
+            res = find_boost_card_info(profile, profile_path.parent, args.boost_url, debug=args.debug)
+            counts = owners_and_wanters_counts(profile, res[0], debug=args.debug) if res else None
         if res:
             card_id, out_path = res
-            owners_cnt, wanters_cnt = owners_and_wanters_counts(profile, card_id, debug=args.debug)
+            owners_cnt, wanters_cnt = counts
             print(f"✅ Клубная карта {card_id} сохранена в {out_path}")
             print(f"Владельцев: {owners_cnt}, желающих: {wanters_cnt}")
         else:
             print("❌ Не удалось получить информацию о клубной карте")
 
-    # HAR-аналитика (опционально)
-    if args.analyze_har:
-        top = analyze_har(args.analyze_har, debug=args.debug)
-        print("Топ путей из HAR:")
-        for k, v in top.items():
-            print(f"{k} -> {v}")
-
     # Определение целевой карты для рассылки обменов
     target_card: Optional[Dict[str, Any]] = None
+    if not args.trade_card_id and args.trade_card_name:
+        resolved = catalog.resolve_one(args.trade_card_name, rank=args.trade_rank or None)
+        if resolved is None:
+            # неуверенное совпадение не должно молча запускать рассылку по чужой карте
+            hits = catalog.resolve(args.trade_card_name, rank=args.trade_rank or None, limit=5)
+            print(f"❌ Карта '{args.trade_card_name}' не определена однозначно — укажите --trade_card_id")
+            for cid, score in hits:
+                print(f"  {cid}: {catalog.name_for(cid)} [{catalog.rank_for(cid) or '?'}] ({score:.2f})")
+            return
+        args.trade_card_id = resolved
+        args.trade_rank = args.trade_rank or catalog.rank_for(resolved)
+        if args.debug:
+            print(f"[CATALOG] '{args.trade_card_name}' -> {args.trade_card_id} ({catalog.name_for(args.trade_card_id)})")
     if args.trade_card_id and args.trade_rank:
         target_card = {"card_id": int(args.trade_card_id), "name": args.trade_card_name or "", "rank": args.trade_rank}
     else:
         target_card = load_target_card_from_file(profile_path.parent, args.trade_card_file or None, debug=args.debug)
 
+    # Демон: одна сессия, опрос по интервалу, обмены только новым онлайн-владельцам
+    if args.watch:
+        if not target_card and not args.boost_url:
+            print("ℹ️ Для --watch нужна целевая карта или --boost_url.")
+            return
+        from mangabuff.services.watcher import run_watcher
+        with prof.phase("inventory"):
+            watch_cards = load_my_cards(profile_path, profile, debug=args.debug, incremental=not args.inventory_full_sync)
+        if watch_cards is None:
+            return
+        with prof.phase("watch"):
+            stats = run_watcher(
+                profile_data=profile,
+                profiles_dir=profile_path.parent,
+                my_cards=watch_cards,
+                target_card=target_card,
+                boost_url=args.boost_url,
+                target_loader=lambda path: load_target_card_from_file(profile_path.parent, str(path), debug=args.debug),
+                interval=args.watch_interval or WATCH_INTERVAL,
+                max_pages=args.trade_pages or 0,
+                max_cycles=args.watch_cycles or 0,
+                dry_run=bool(args.trade_dry_run),
+                use_api=bool(args.use_api),
+                debug=args.debug,
+            )
+        print("Результат демона:", stats)
+        return
+
+    # Мультикампания: несколько целевых карт, один обход владельцев и одна проверка на партнёра
+    if args.trade_targets_file and args.trade_send_online:
+        from mangabuff.services.campaign import send_multi_target_trades
+        targets = load_targets_from_file(pathlib.Path(args.trade_targets_file))
+        if not targets:
+            print(f"❌ Нет целевых карт в {args.trade_targets_file}")
+            return
+        with prof.phase("inventory"):
+            my_cards = load_my_cards(profile_path, profile, debug=args.debug, incremental=not args.inventory_full_sync)
+        if my_cards is None:
+            return
+        ids = ",".join(str(i) for i in sorted(int(t["card_id"]) for t in targets))
+        checkpoint = open_checkpoint(profile_path, profile, "multi", f"multi:{ids}:dry={int(bool(args.trade_dry_run))}", args.resume)
+        with prof.phase("campaign"):
+            stats = send_multi_target_trades(
+                profile_data=profile,
+                targets=targets,
+                my_cards=my_cards,
+                max_pages=args.trade_pages or 0,
+                dry_run=bool(args.trade_dry_run),
+                use_api=bool(args.use_api),
+                debug=args.debug,
+                bundle_max=args.trade_bundle_max or TRADE_BUNDLE_MAX,
+                checkpoint=checkpoint,
+            )
+        print("Результат мультикампании:", stats)
+        return
+
     if not target_card:
         print("ℹ️ Целевая карта не задана. Рассылка обменов пропущена.")
         return
 
     if args.trade_send_online:
         # инвентарь текущего пользователя
-        try:
-            inv_path = ensure_own_inventory(profile_path, profile, debug=args.debug)
-        except Exception as e:
-            print(f"❌ Нет инвентаря: {e}")
+        with prof.phase("inventory"):
+            my_cards = load_my_cards(profile_path, profile, debug=args.debug, incremental=not args.inventory_full_sync)
+        if my_cards is None:
             return
-        try:
-            with inv_path.open("r", encoding="utf-8") as f:
-                my_cards: List[Dict[str, Any]] = json.load(f)
-        except Exception as e:
-            print(f"❌ Ошибка чтения инвентаря {inv_path}: {e}")
+
+        card_id = int(target_card["card_id"])
+        # Шардирование: очередь задач в SQLite, несколько процессов и/или аккаунтов
+        if args.shard_workers or args.shard_profiles or args.shard_join:
+            from mangabuff.services.shard import queue_path_for, run_sharded_campaign, run_worker
+            queue_path = pathlib.Path(args.shard_queue) if args.shard_queue else queue_path_for(profile_path.parent, card_id)
+            with prof.phase("trades"):
+                if args.shard_join:
+                    stats = run_worker(
+                        str(queue_path),
+                        str(profile_path),
+                        target_card,
+                        worker=f"{args.name}-{os.getpid()}",
+                        dry_run=bool(args.trade_dry_run),
+                        use_api=bool(args.use_api),
+                        debug=args.debug,
+                        credentials=(args.email, args.password),
+                    )
+                else:
+                    names = [n.strip() for n in (args.shard_profiles or "").split(",") if n.strip()]
+                    stats = run_sharded_campaign(
+                        profile_data=profile,
+                        profile_paths=[store.path_for(n) for n in names] or [profile_path],
+                        target_card=target_card,
+                        queue_path=queue_path,
+                        workers=args.shard_workers or 0,
+                        max_pages=args.trade_pages or 0,
+                        dry_run=bool(args.trade_dry_run),
+                        use_api=bool(args.use_api),
+                        debug=args.debug,
+                        credentials={str(profile_path): (args.email, args.password)},
+                    )
+            print("Результат шардированной рассылки:", stats)
             return
 
         from mangabuff.services.owners import iter_online_owners_by_pages
-        card_id = int(target_card["card_id"])
-        owners_iter = iter_online_owners_by_pages(profile, card_id, max_pages=args.trade_pages or 0, debug=args.debug)
-        stats = send_trades_to_online_owners(
-            profile_data=profile,
-            target_card=target_card,
-            owners_iter=owners_iter,
-            my_cards=my_cards,
-            dry_run=bool(args.trade_dry_run),
-            use_api=bool(args.use_api),
-            debug=args.debug,
-        )
+        from mangabuff.services.trade import send_trades_to_online_owners
+        rank = (target_card.get("rank") or "").strip()
+        checkpoint = open_checkpoint(profile_path, profile, str(card_id), f"single:{card_id}:{rank}:dry={int(bool(args.trade_dry_run))}", args.resume)
+        if args.reciprocal:
+            # желающие наших дубликатов собираются заново; владельцы — с первой необработанной страницы
+            from mangabuff.services.reciprocal import iter_reciprocal_first
+            owners_iter = iter_reciprocal_first(profile, card_id, my_cards, max_pages=args.trade_pages or 0, debug=args.debug, start_page=checkpoint.page + 1, strict=True)
+        else:
+            owners_iter = iter_online_owners_by_pages(profile, card_id, max_pages=args.trade_pages or 0, debug=args.debug, start_page=checkpoint.page + 1, strict=True)
+        owners_iter = prof.wrap_iter("owners", owners_iter)
+        with prof.phase("trades"):
+            stats = send_trades_to_online_owners(
+                profile_data=profile,
+                target_card=target_card,
+                owners_iter=owners_iter,
+                my_cards=my_cards,
+                dry_run=bool(args.trade_dry_run),
+                use_api=bool(args.use_api),
+                debug=args.debug,
+                checkpoint=checkpoint,
+            )
         print("Результат рассылки:", stats)
     else:
         print("ℹ️ --trade_send_online не указан — рассылка не выполнена.")
@@ -0,0 +1,273 @@
+"""
+Встраиваемый клиент: один объект на аккаунт живёт весь процесс и держит сессию
+(тёплые соединения), профиль, состояние партнёров и отправку обменов.
+Справочник карт, подобранные размеры страниц и индекс владельцев — общие
+для процесса: первый клиент их открывает, остальные пользуются теми же.
+Лимит запросов rate_limit — свой у каждого клиента (поверх общего
+MANGABUFF_RATE_LIMIT_RPS). AsyncMangaBuffClient — те же операции через
+asyncio.to_thread для оркестраторов на asyncio.
+"""
+import asyncio
+import atexit
+import pathlib
+import threading
+from typing import Any, AsyncGenerator, Dict, Generator, List, Optional, Tuple
+
+import requests
+
+from mangabuff.auth.login import update_profile_cookies
+from mangabuff.auth.refresh import SessionRefresher
+from mangabuff.http.http_utils import apply_profile_to_sessions, build_session_from_profile
+from mangabuff.http.pagesize import PageSizeTuner, active_page_tuner, page_tuner, set_active_page_tuner
+from mangabuff.http.ratelimit import RateLimiter, set_session_rate_limiter
+from mangabuff.profiles.store import ProfileStore
+from mangabuff.services.cardfile import load_cards
+from mangabuff.services.catalog import CardCatalog, active_catalog, set_active_catalog
+from mangabuff.services.checkpoint import CampaignCheckpoint
+from mangabuff.services.holdings import HoldingsIndex, active_holdings, set_active_holdings
+from mangabuff.services.inventory import fetch_all_cards_by_id
+from mangabuff.services.owners import iter_online_owners_by_pages, iter_wanters_by_pages
+from mangabuff.services.trade import PartnerState, TradeSubmitter, find_partner_card_instances, send_bundle, send_trades_to_online_owners
+
+_shared_lock = threading.Lock()
+
+
+def _install_shared(profiles_dir: pathlib.Path) -> None:
+    """Открывает общие кэши процесса, если их ещё никто не открыл; живут до выхода."""
+    with _shared_lock:
+        if active_catalog() is None:
+            catalog = CardCatalog.open(profiles_dir)
+            set_active_catalog(catalog)
+            atexit.register(catalog.save)
+        if active_page_tuner() is None:
+            page_sizes = PageSizeTuner.open(profiles_dir)
+            set_active_page_tuner(page_sizes)
+            atexit.register(page_sizes.save)
+        if active_holdings() is None:
+            holdings = HoldingsIndex.open(profiles_dir)
+            set_active_holdings(holdings)
+            atexit.register(holdings.close)
+
+
+class MangaBuffClient:
+    """
+    Клиент одного аккаунта. Профиль читается из profiles_dir/<name>.json (или
+    передаётся готовым), login() обновляет cookies и включает автоматический
+    перелогин при истечении сессии. Все операции идут через одну сессию.
+    rate_limit > 0 — лимит запросов в секунду для этого клиента.
+    """
+    def __init__(
+        self,
+        profiles_dir: str = ".",
+        name: Optional[str] = None,
+        email: Optional[str] = None,
+        password: Optional[str] = None,
+        profile: Optional[Dict] = None,
+        rate_limit: float = 0,
+        use_api: bool = True,
+        debug: bool = False,
+    ) -> None:
+        self.store = ProfileStore(profiles_dir)
+        self.profiles_dir = self.store.root
+        self.profile_path: Optional[pathlib.Path] = self.store.path_for(name) if name else None
+        if profile is None:
+            profile = (self.store.read_by_path(self.profile_path) if self.profile_path else None) or self.store.default_profile()
+        self.profile = profile
+        self.email = email
+        self.password = password
+        self.use_api = use_api
+        self.debug = debug
+        self._limiter: Optional[RateLimiter] = RateLimiter(rate_limit) if rate_limit > 0 else None
+        _install_shared(self.profiles_dir)
+        self._session: Optional[requests.Session] = None
+        self._submitter: Optional[TradeSubmitter] = None
+        self._refresher: Optional[SessionRefresher] = None
+        self._send_lock = threading.Lock()
+        self.partners = PartnerState()
+
+    def __enter__(self) -> "MangaBuffClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session = build_session_from_profile(self.profile)
+            set_session_rate_limiter(self._session, self._limiter)
+        return self._session
+
+    @property
+    def user_id(self) -> str:
+        return str(self.profile.get("id") or self.profile.get("ID") or self.profile.get("user_id") or "")
+
+    def _save_profile(self) -> None:
+        if self.profile_path:
+            self.store.write_by_path(self.profile_path, self.profile)
+
+    def login(self, skip_check: bool = False) -> None:
+        """Авторизация по email/password; ошибка — RuntimeError с сообщением сервера."""
+        if not (self.email and self.password):
+            raise RuntimeError("login requires email and password")
+        ok, info = update_profile_cookies(self.profile, self.email, self.password, debug=self.debug, skip_check=skip_check)
+        if not ok:
+            raise RuntimeError(info.get("message", "auth error"))
+        self._save_profile()
+        # уже созданная сессия получает новые cookies, а не пересоздаётся
+        apply_profile_to_sessions(self.profile)
+        if self._refresher is not None:
+            self._refresher.uninstall()
+        self._refresher = SessionRefresher(self.profile, self.email, self.password, on_refresh=self._save_profile, debug=self.debug).install()
+
+    def inventory_path(self, user_id: Optional[str] = None, incremental: bool = True, max_pages: int = 500) -> pathlib.Path:
+        """Инвентарь пользователя (по умолчанию свой) в NDJSON; свой — дельтой к прошлому снимку."""
+        uid = str(user_id or self.user_id)
+        if not uid:
+            raise RuntimeError("no user id in profile")
+        cards_path, _got = fetch_all_cards_by_id(self.profile, self.profiles_dir, uid, max_pages=max_pages, debug=self.debug, incremental=incremental, session=self.session)
+        return cards_path
+
+    def inventory(self, user_id: Optional[str] = None, incremental: bool = True, max_pages: int = 500) -> List[Dict[str, Any]]:
+        return load_cards(self.inventory_path(user_id, incremental=incremental, max_pages=max_pages))
+
+    def iter_owners(self, card_id: int, max_pages: int = 0, start_page: int = 1, strict: bool = False) -> Generator[Tuple[int, List[int]], None, None]:
+        """Страницы владельцев карты: (страница, онлайн-владельцы без замка)."""
+        return iter_online_owners_by_pages(self.profile, int(card_id), max_pages=max_pages, debug=self.debug, session=self.session, start_page=start_page, strict=strict)
+
+    def iter_wanters(self, card_id: int, max_pages: int = 0) -> Generator[Tuple[int, List[int]], None, None]:
+        return iter_wanters_by_pages(self.profile, int(card_id), max_pages=max_pages, debug=self.debug, session=self.session)
+
+    def resolve_card(self, name: str, rank: Optional[str] = None, limit: int = 5) -> List[Tuple[int, float]]:
+        """Локальный резолв имени карты по справочнику."""
+        catalog = active_catalog()
+        return catalog.resolve(name, rank=rank, limit=limit) if catalog is not None else []
+
+    def find_partner_cards(self, partner_id: int, targets: List[Dict[str, Any]], side: str = "receiver") -> Dict[int, int]:
+        """card_id -> instance_id для целевых карт, найденных у партнёра."""
+        return find_partner_card_instances(self.session, int(partner_id), side, targets, debug=self.debug, partner_state=self.partners)
+
+    def find_partner_card(self, partner_id: int, card_id: int, rank: str = "", name: str = "", side: str = "receiver") -> Optional[int]:
+        target = {"card_id": int(card_id), "rank": rank, "name": name}
+        return self.find_partner_cards(partner_id, [target], side=side).get(int(card_id))
+
+    def send_offer(self, partner_id: int, my_ids: List[int], his_ids: List[int], dry_run: bool = True) -> bool:
+        """Одно предложение обмена; способ отправки и шаблон формы запоминаются на всё время клиента."""
+        with self._send_lock:
+            if self._submitter is None:
+                self._submitter = TradeSubmitter(self.session, use_api=self.use_api, debug=self.debug)
+            return send_bundle(self.session, int(partner_id), my_ids, his_ids, dry_run=dry_run, use_api=self.use_api, debug=self.debug, submitter=self._submitter)
+
+    def send_trades(
+        self,
+        target_card: Dict[str, Any],
+        my_cards: Optional[List[Dict[str, Any]]] = None,
+        max_pages: int = 0,
+        dry_run: bool = True,
+        checkpoint: Optional[CampaignCheckpoint] = None,
+    ) -> Dict[str, int]:
+        """Рассылка онлайн-владельцам карты, как --trade_send_online."""
+        my_cards = my_cards if my_cards is not None else self.inventory()
+        checkpoint = checkpoint or CampaignCheckpoint()
+        owners = self.iter_owners(int(target_card["card_id"]), max_pages=max_pages, start_page=checkpoint.page + 1, strict=True)
+        return send_trades_to_online_owners(
+            self.profile, target_card, owners, my_cards,
+            dry_run=dry_run, use_api=self.use_api, debug=self.debug, session=self.session, checkpoint=checkpoint,
+        )
+
+    def close(self) -> None:
+        """
+        Закрывает сессию клиента и снимает его перелогин (иначе профиль и пароль
+        живут до конца процесса); общие кэши сохраняются и остаются открытыми.
+        """
+        if self._refresher is not None:
+            self._refresher.uninstall()
+            self._refresher = None
+        catalog = active_catalog()
+        if catalog is not None:
+            catalog.save()
+        page_tuner().save()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class AsyncMangaBuffClient:
+    """
+    Асинхронная обёртка: блокирующие операции MangaBuffClient выполняются в
+    пуле потоков asyncio.to_thread, сессия и кэши — те же.
+    """
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.sync = MangaBuffClient(*args, **kwargs)
+
+    async def __aenter__(self) -> "AsyncMangaBuffClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    @property
+    def profile(self) -> Dict:
+        return self.sync.profile
+
+    async def login(self, skip_check: bool = False) -> None:
+        await asyncio.to_thread(self.sync.login, skip_check)
+
+    async def inventory_path(self, user_id: Optional[str] = None, incremental: bool = True, max_pages: int = 500) -> pathlib.Path:
+        return await asyncio.to_thread(self.sync.inventory_path, user_id, incremental, max_pages)
+
+    async def inventory(self, user_id: Optional[str] = None, incremental: bool = True, max_pages: int = 500) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.sync.inventory, user_id, incremental, max_pages)
+
+    async def _aiter(self, it: Generator[Any, None, None]) -> AsyncGenerator[Any, None]:
+        end = object()
+        lock = threading.Lock()
+
+        def step() -> Any:
+            with lock:
+                return next(it, end)
+
+        def close() -> None:
+            with lock:
+                it.close()
+
+        try:
+            while True:
+                item = await asyncio.to_thread(step)
+                if item is end:
+                    return
+                yield item
+        finally:
+            # после отмены next ещё может идти в потоке — закрываем там же, когда он вернётся
+            await asyncio.to_thread(close)
+
+    def iter_owners(self, card_id: int, max_pages: int = 0, start_page: int = 1) -> AsyncGenerator[Tuple[int, List[int]], None]:
+        return self._aiter(self.sync.iter_owners(card_id, max_pages=max_pages, start_page=start_page))
+
+    def iter_wanters(self, card_id: int, max_pages: int = 0) -> AsyncGenerator[Tuple[int, List[int]], None]:
+        return self._aiter(self.sync.iter_wanters(card_id, max_pages=max_pages))
+
+    async def resolve_card(self, name: str, rank: Optional[str] = None, limit: int = 5) -> List[Tuple[int, float]]:
+        return self.sync.resolve_card(name, rank=rank, limit=limit)
+
+    async def find_partner_cards(self, partner_id: int, targets: List[Dict[str, Any]], side: str = "receiver") -> Dict[int, int]:
+        return await asyncio.to_thread(self.sync.find_partner_cards, partner_id, targets, side)
+
+    async def find_partner_card(self, partner_id: int, card_id: int, rank: str = "", name: str = "", side: str = "receiver") -> Optional[int]:
+        return await asyncio.to_thread(self.sync.find_partner_card, partner_id, card_id, rank, name, side)
+
+    async def send_offer(self, partner_id: int, my_ids: List[int], his_ids: List[int], dry_run: bool = True) -> bool:
+        return await asyncio.to_thread(self.sync.send_offer, partner_id, my_ids, his_ids, dry_run)
+
+    async def send_trades(
+        self,
+        target_card: Dict[str, Any],
+        my_cards: Optional[List[Dict[str, Any]]] = None,
+        max_pages: int = 0,
+        dry_run: bool = True,
+        checkpoint: Optional[CampaignCheckpoint] = None,
+    ) -> Dict[str, int]:
+        return await asyncio.to_thread(self.sync.send_trades, target_card, my_cards, max_pages, dry_run, checkpoint)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.sync.close)
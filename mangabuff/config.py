@@ -15,4 +15,57 @@ READ_TIMEOUT = int(os.getenv("MANGABUFF_READ_TIMEOUT", "8"))
 
 HUGE_LIST_THRESHOLD = int(os.getenv("MANGABUFF_HUGE_LIST_THRESHOLD", "5000"))
 MAX_CONTENT_BYTES = int(os.getenv("MANGABUFF_MAX_CONTENT_BYTES", "2000000"))
-PARTNER_TIMEOUT_LIMIT = int(os.getenv("MANGABUFF_PARTNER_TIMEOUT_LIMIT", "2"))
\ No newline at end of file
+PARTNER_TIMEOUT_LIMIT = int(os.getenv("MANGABUFF_PARTNER_TIMEOUT_LIMIT", "2"))
+
+WATCH_INTERVAL = int(os.getenv("MANGABUFF_WATCH_INTERVAL", "120"))
+WATCH_BOOST_BACKOFF_MAX = int(os.getenv("MANGABUFF_WATCH_BOOST_BACKOFF_MAX", "1800"))
+
+INVENTORY_KNOWN_RUN = int(os.getenv("MANGABUFF_INVENTORY_KNOWN_RUN", "30"))
+INVENTORY_FULL_SYNC_MAX_AGE = int(os.getenv("MANGABUFF_INVENTORY_FULL_SYNC_MAX_AGE", "86400"))
+
+MATCH_BATCH = int(os.getenv("MANGABUFF_MATCH_BATCH", "25"))
+TRADE_BUNDLE_MAX = int(os.getenv("MANGABUFF_TRADE_BUNDLE_MAX", "5"))
+TRADE_KEEP_COPIES = int(os.getenv("MANGABUFF_TRADE_KEEP_COPIES", "0"))
+
+CATALOG_MIN_SCORE = float(os.getenv("MANGABUFF_CATALOG_MIN_SCORE", "0.5"))
+CATALOG_MIN_MARGIN = float(os.getenv("MANGABUFF_CATALOG_MIN_MARGIN", "0.15"))
+
+RECIPROCAL_MAX_CARDS = int(os.getenv("MANGABUFF_RECIPROCAL_MAX_CARDS", "20"))
+RECIPROCAL_WANTER_PAGES = int(os.getenv("MANGABUFF_RECIPROCAL_WANTER_PAGES", "3"))
+RECIPROCAL_LOOKAHEAD = int(os.getenv("MANGABUFF_RECIPROCAL_LOOKAHEAD", "5"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("MANGABUFF_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RECOVERY_TIMEOUT = int(os.getenv("MANGABUFF_BREAKER_RECOVERY_TIMEOUT", "30"))
+BREAKER_MAX_WAIT = int(os.getenv("MANGABUFF_BREAKER_MAX_WAIT", "300"))
+
+PARSE_WORKERS = int(os.getenv("MANGABUFF_PARSE_WORKERS", "0"))
+PARSE_OFFLOAD_MIN_BYTES = int(os.getenv("MANGABUFF_PARSE_OFFLOAD_MIN_BYTES", "65536"))
+
+PAGE_SIZE_DEFAULT = int(os.getenv("MANGABUFF_PAGE_SIZE_DEFAULT", "60"))
+PAGE_SIZE_MAX = int(os.getenv("MANGABUFF_PAGE_SIZE_MAX", "2000"))
+
+CHECKPOINT_EVERY = int(os.getenv("MANGABUFF_CHECKPOINT_EVERY", "1"))
+
+SHARD_LEASE_SECONDS = int(os.getenv("MANGABUFF_SHARD_LEASE_SECONDS", "120"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("MANGABUFF_SHARD_MAX_ATTEMPTS", "3"))
+SHARD_POLL_INTERVAL = float(os.getenv("MANGABUFF_SHARD_POLL_INTERVAL", "1.0"))
+
+HEDGE_ENABLED = int(os.getenv("MANGABUFF_HEDGE_ENABLED", "0"))
+HEDGE_BUDGET = float(os.getenv("MANGABUFF_HEDGE_BUDGET", "0.1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("MANGABUFF_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_TIMEOUT_FACTOR = float(os.getenv("MANGABUFF_HEDGE_TIMEOUT_FACTOR", "3.0"))
+HEDGE_MIN_READ_TIMEOUT = float(os.getenv("MANGABUFF_HEDGE_MIN_READ_TIMEOUT", "2.0"))
+HEDGE_THREADS = int(os.getenv("MANGABUFF_HEDGE_THREADS", "8"))
+
+SESSION_REFRESH_MIN_INTERVAL = float(os.getenv("MANGABUFF_SESSION_REFRESH_MIN_INTERVAL", "60"))
+
+RATE_LIMIT_RPS = float(os.getenv("MANGABUFF_RATE_LIMIT_RPS", "6"))
+RATE_LIMIT_BURST = float(os.getenv("MANGABUFF_RATE_LIMIT_BURST", "6"))
+INVENTORY_FETCH_WINDOW = int(os.getenv("MANGABUFF_INVENTORY_FETCH_WINDOW", "4"))
+
+SINGLE_FLIGHT_TTL = float(os.getenv("MANGABUFF_SINGLE_FLIGHT_TTL", "3"))
+SINGLE_FLIGHT_MAX = int(os.getenv("MANGABUFF_SINGLE_FLIGHT_MAX", "512"))
+
+HOLDINGS_MAX_AGE = int(os.getenv("MANGABUFF_HOLDINGS_MAX_AGE", "86400"))
+HOLDINGS_FLUSH_ROWS = int(os.getenv("MANGABUFF_HOLDINGS_FLUSH_ROWS", "2000"))
+HOLDINGS_FLUSH_SECONDS = float(os.getenv("MANGABUFF_HOLDINGS_FLUSH_SECONDS", "10"))
@@ -0,0 +1,127 @@
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from mangabuff.config import BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIMEOUT
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.RequestException):
+    def __init__(self, endpoint: str, retry_in: float) -> None:
+        super().__init__(f"circuit open for {endpoint}, retry in {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def endpoint_key(method: str, url: str) -> str:
+    path = re.sub(r"/\d+(?=/|$)", "/{id}", urlsplit(url).path or "/")
+    return f"{method.upper()} {path}"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class CircuitBreaker:
+    """
+    closed -> open после threshold подряд неудач (таймауты, 5xx) или сразу на 429;
+    open -> half_open по истечении recovery/Retry-After, пропускается один пробный запрос;
+    его успех закрывает цепь, неудача снова открывает.
+    """
+    def __init__(self, endpoint: str, threshold: int = BREAKER_FAILURE_THRESHOLD, recovery: float = BREAKER_RECOVERY_TIMEOUT) -> None:
+        self.endpoint = endpoint
+        self.threshold = max(1, threshold)
+        self.recovery = recovery
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        return max(0.0, self.open_until - time.monotonic())
+
+    def before_request(self) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.open_until:
+                    raise CircuitOpenError(self.endpoint, self.retry_in())
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.endpoint, 0.0)
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def cancel_probe(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self, retry_after: Optional[float] = None, force_open: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if force_open or self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+                self.open_until = time.monotonic() + max(self.recovery if retry_after is None else retry_after, 0.0)
+
+    def wait(self, max_wait: Optional[float] = None) -> bool:
+        """Ждёт, пока цепь не станет пригодной для запроса. False — если не дождались за max_wait."""
+        with self._lock:
+            if self.state != OPEN:
+                return True
+            delay = self.retry_in()
+        if max_wait is not None and delay > max_wait:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def breaker_for(method: str, url: str) -> CircuitBreaker:
+    key = endpoint_key(method, url)
+    with _registry_lock:
+        br = _breakers.get(key)
+        if br is None:
+            br = _breakers[key] = CircuitBreaker(key)
+        return br
+
+
+def observe_response(breaker: CircuitBreaker, resp: requests.Response) -> None:
+    if resp.status_code == 429:
+        breaker.record_failure(parse_retry_after(resp.headers.get("Retry-After")), force_open=True)
+    elif resp.status_code >= 500:
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        breaker.record_failure(retry_after, force_open=retry_after is not None)
+    else:
+        breaker.record_success()
+
+
+def wait_for_endpoint(method: str, url: str, max_wait: Optional[float] = None) -> bool:
+    return breaker_for(method, url).wait(max_wait)
@@ -0,0 +1,179 @@
+import concurrent.futures
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import requests
+
+from mangabuff.config import (
+    CONNECT_TIMEOUT, READ_TIMEOUT,
+    HEDGE_ENABLED, HEDGE_BUDGET, HEDGE_MIN_SAMPLES, HEDGE_TIMEOUT_FACTOR, HEDGE_MIN_READ_TIMEOUT, HEDGE_THREADS,
+)
+
+
+class LatencyTracker:
+    """Скользящее окно латентностей одного эндпоинта (время до ответа сервера)."""
+    def __init__(self, window: int = 200) -> None:
+        self.samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[idx]
+
+    def p95(self) -> Optional[float]:
+        return self.quantile(0.95)
+
+    def timeouts(self) -> Tuple[float, float]:
+        """(connect, read): read — p99 * HEDGE_TIMEOUT_FACTOR, но не больше глобального READ_TIMEOUT."""
+        p99 = self.quantile(0.99)
+        if p99 is None:
+            return CONNECT_TIMEOUT, READ_TIMEOUT
+        read = min(float(READ_TIMEOUT), max(float(HEDGE_MIN_READ_TIMEOUT), p99 * HEDGE_TIMEOUT_FACTOR))
+        connect = min(float(CONNECT_TIMEOUT), max(1.0, p99 * HEDGE_TIMEOUT_FACTOR))
+        return connect, read
+
+
+class HedgeBudget:
+    """Дубли не больше budget от числа запросов (плюс небольшой запас на старте)."""
+    def __init__(self, budget: float = HEDGE_BUDGET, burst: int = 3) -> None:
+        self.budget = max(0.0, budget)
+        self.burst = burst
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def note_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.hedges >= self.requests * self.budget + self.burst:
+                return False
+            self.hedges += 1
+            return True
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+_budget = HedgeBudget()
+_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_enabled = bool(HEDGE_ENABLED)
+
+
+def set_hedging(enabled: bool) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def hedging_enabled() -> bool:
+    return _enabled
+
+
+def tracker_for(key: str) -> LatencyTracker:
+    with _trackers_lock:
+        tr = _trackers.get(key)
+        if tr is None:
+            tr = _trackers[key] = LatencyTracker()
+        return tr
+
+
+def _executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _pool
+    with _trackers_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="mangabuff-hedge")
+        return _pool
+
+
+def _close_late(fut: concurrent.futures.Future) -> None:
+    # проигравший дубль: ответ никому не нужен, соединение возвращаем в пул
+    try:
+        fut.result().close()
+    except Exception:
+        pass
+
+
+def _timed(send: Callable[..., requests.Response], tracker: LatencyTracker, url: str, kwargs: Dict[str, Any]) -> requests.Response:
+    started = time.monotonic()
+    try:
+        return send(url, **kwargs)
+    finally:
+        tracker.observe(time.monotonic() - started)
+
+
+def _good(fut: concurrent.futures.Future) -> bool:
+    """Ответ годится в победители: без исключения и не 5xx/429 (их ждёт вторая копия)."""
+    if fut.exception() is not None:
+        return False
+    status = fut.result().status_code
+    return status < 500 and status != 429
+
+
+def send_with_hedge(key: str, send: Callable[..., requests.Response], url: str, hedge: bool, acquire: Optional[Callable[[], None]] = None, **kwargs: Any) -> requests.Response:
+    """
+    Отправка с таймаутами по наблюдаемой латентности эндпоинта. Для идемпотентного
+    чтения (hedge=True) при превышении p95 уходит дубль, побеждает первый успешный
+    ответ (5xx/429 и ошибка — только если обе копии не удались); число дублей
+    ограничено HedgeBudget. Запись (hedge=False) идёт с глобальными таймаутами:
+    укороченный read timeout для неидемпотентного POST опаснее медленного ответа.
+    Без set_hedging(True) — обычный запрос с глобальными таймаутами.
+    acquire — токен лимита запросов для дубля (первая копия его уже получила).
+    """
+    if not _enabled:
+        return send(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+
+    tracker = tracker_for(key)
+    if not hedge:
+        kwargs["timeout"] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        return _timed(send, tracker, url, kwargs)
+    kwargs["timeout"] = tracker.timeouts()
+    _budget.note_request()
+    delay = tracker.p95()
+    if delay is None:
+        return _timed(send, tracker, url, kwargs)
+
+    pool = _executor()
+    primary = pool.submit(_timed, send, tracker, url, kwargs)
+    try:
+        return primary.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+    if not _budget.try_spend():
+        return primary.result()
+    if acquire is not None:
+        acquire()
+        # пока ждали токен, первая копия могла успеть
+        if primary.done() and _good(primary):
+            return primary.result()
+
+    backup = pool.submit(_timed, send, tracker, url, kwargs)
+    pending = {primary, backup}
+    failed: Optional[concurrent.futures.Future] = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for fut in done:
+            if _good(fut):
+                for other in pending:
+                    other.add_done_callback(_close_late)
+                for other in (done - {fut}) | ({failed} if failed else set()):
+                    if other.exception() is None:
+                        _close_late(other)
+                return fut.result()
+            # ответ сервера с ошибкой полезнее исключения — его и вернём, если вторая тоже не удастся
+            if failed is None or (failed.exception() is not None and fut.exception() is None):
+                failed = fut
+            elif fut.exception() is None:
+                _close_late(fut)
+    return failed.result()
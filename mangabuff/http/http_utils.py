@@ -1,25 +1,76 @@
-from typing import Dict, Optional, Tuple, Any, List
+import concurrent.futures
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple, Any, List, Union
+from urllib.parse import urlsplit
 import requests
 
-from mangabuff.config import DEFAULT_HEADERS, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_CONTENT_BYTES
+from mangabuff.config import DEFAULT_HEADERS, MAX_CONTENT_BYTES, SINGLE_FLIGHT_TTL, SINGLE_FLIGHT_MAX
 from mangabuff.utils.text import parse_charset_from_content_type
+from mangabuff.http.breaker import CircuitOpenError, breaker_for, endpoint_key, observe_response, wait_for_endpoint
+from mangabuff.http.hedge import send_with_hedge
+from mangabuff.http.ratelimit import throttle
 from mangabuff.config import UA
 
+# сессия -> профиль, из которого она собрана (для обновления авторизации на лету)
+_session_profiles: "weakref.WeakKeyDictionary[requests.Session, Dict]" = weakref.WeakKeyDictionary()
+_refreshers: Dict[int, Any] = {}
+
 def build_session_from_profile(profile_data: Dict) -> requests.Session:
     s = requests.Session()
     s.headers.update(DEFAULT_HEADERS.copy())
     client_headers = profile_data.get("client_headers", {}) or {}
-    for k in ("x-csrf-token", "x-requested-with", "User-Agent", "Accept", "Accept-Language", "Accept-Encoding"):
+    for k in ("x-requested-with", "User-Agent", "Accept", "Accept-Language", "Accept-Encoding"):
         if client_headers.get(k):
             s.headers[k] = client_headers[k]
-            if k.lower() == "x-csrf-token":
-                s.headers["X-CSRF-TOKEN"] = client_headers[k]
-    cookies = profile_data.get("cookie", {}) or {}
-    s.cookies.update({k: v for k, v in cookies.items() if v})
+    apply_profile_auth(s, profile_data)
     if "X-Requested-With" not in s.headers:
         s.headers["X-Requested-With"] = "XMLHttpRequest"
+    _session_profiles[s] = profile_data
     return s
 
+def profile_csrf(profile_data: Dict) -> str:
+    return (profile_data.get("client_headers", {}) or {}).get("x-csrf-token") or ""
+
+def apply_profile_auth(session: requests.Session, profile_data: Dict) -> None:
+    """Cookies и CSRF-токен профиля -> сессия."""
+    csrf = profile_csrf(profile_data)
+    if csrf:
+        session.headers["x-csrf-token"] = csrf
+        session.headers["X-CSRF-TOKEN"] = csrf
+    cookies = {k: v for k, v in (profile_data.get("cookie", {}) or {}).items() if v}
+    # старые cookies с тем же именем (в т.ч. выставленные сервером на домен) убираем,
+    # иначе в запрос уйдут обе копии — и старая сессия, и новая
+    for c in [c for c in session.cookies if c.name in cookies]:
+        session.cookies.clear(c.domain, c.path, c.name)
+    session.cookies.update(cookies)
+
+def apply_profile_to_sessions(profile_data: Dict) -> None:
+    for s, p in list(_session_profiles.items()):
+        if p is profile_data:
+            apply_profile_auth(s, p)
+    # разобранные до перелогина страницы (формы с CSRF и т.п.) больше не годятся
+    _flights.clear()
+
+def set_session_refresher(profile_data: Dict, refresher: Optional[Any]) -> None:
+    """
+    refresher: wait_idle(), generation, refresh(seen_generation) -> bool (см. auth/refresh.py).
+    None — снять: refresher держит профиль и пароль, пока зарегистрирован.
+    """
+    if refresher is None:
+        _refreshers.pop(id(profile_data), None)
+    else:
+        _refreshers[id(profile_data)] = refresher
+
+def session_refresher_for(session: requests.Session) -> Optional[Any]:
+    if not _refreshers:
+        return None
+    profile = _session_profiles.get(session)
+    return _refreshers.get(id(profile)) if profile is not None else None
+
 def extract_cookies(jar: requests.cookies.RequestsCookieJar) -> Dict[str, str]:
     allowed_prefixes = ("remember_web",)
     wanted = ("XSRF-TOKEN", "mangabuff_session", "__ddg9_", "theme")
@@ -31,62 +82,232 @@ def extract_cookies(jar: requests.cookies.RequestsCookieJar) -> Dict[str, str]:
         data["theme"] = "light"
     return data
 
-def read_capped(resp: requests.Response) -> Tuple[Optional[bytes], bool]:
+READ_CHUNK = 65536
+
+def _close_quietly(resp: requests.Response) -> None:
+    try:
+        resp.close()
+    except Exception:
+        pass
+
+def read_capped(resp: requests.Response) -> Tuple[Optional[bytearray], bool]:
+    """
+    Читает тело ответа (stream=True) не больше MAX_CONTENT_BYTES. Буфер выделяется
+    один раз по Content-Length (если тело не сжато) и заполняется через readinto,
+    без списка чанков и итогового join. Возвращает (тело, слишком_большое).
+    """
     c_len = resp.headers.get("Content-Length")
+    expected = 0
     if c_len:
         try:
-            if int(c_len) > MAX_CONTENT_BYTES:
-                try:
-                    resp.close()
-                except Exception:
-                    pass
+            expected = int(c_len)
+            if expected > MAX_CONTENT_BYTES:
+                _close_quietly(resp)
                 return None, True
         except Exception:
-            pass
+            expected = 0
+    if resp.headers.get("Content-Encoding", "identity").lower() not in ("", "identity"):
+        # Content-Length у сжатого тела — размер до распаковки
+        expected = 0
+
+    raw = getattr(resp, "raw", None)
+    if raw is None or not hasattr(raw, "readinto") or getattr(resp, "_content_consumed", False):
+        content = resp.content or b""
+        _close_quietly(resp)
+        if len(content) > MAX_CONTENT_BYTES:
+            return None, True
+        return bytearray(content), False
 
+    raw.decode_content = True
+    buf = bytearray(min(expected, MAX_CONTENT_BYTES) if expected else READ_CHUNK)
     total = 0
-    chunks: List[bytes] = []
     try:
-        for chunk in resp.iter_content(chunk_size=65536):
-            if not chunk:
-                continue
-            chunks.append(chunk)
-            total += len(chunk)
+        while True:
+            if total == len(buf):
+                # ровно по Content-Length — дальше ждём только EOF, растём на один чанк
+                grow = READ_CHUNK if total == expected else len(buf)
+                buf.extend(bytes(min(grow, MAX_CONTENT_BYTES + 1 - total)))
+            with memoryview(buf) as view:
+                n = raw.readinto(view[total:total + READ_CHUNK])
+            if not n:
+                break
+            total += n
             if total > MAX_CONTENT_BYTES:
                 return None, True
     finally:
+        _close_quietly(resp)
+    del buf[total:]
+    return buf, False
+
+def _is_utf8(enc: str) -> bool:
+    return enc.lower().replace("-", "").replace("_", "") in ("utf8", "")
+
+def body_charset(headers: Dict[str, str]) -> str:
+    return parse_charset_from_content_type((headers.get("Content-Type") or "").lower()) or "utf-8"
+
+def decode_body_and_maybe_json(content: Union[bytes, bytearray], headers: Dict[str, str], want_text: bool = True) -> Tuple[str, Optional[Any]]:
+    """
+    JSON разбирается прямо из байтов (для UTF-8), без промежуточной строки.
+    want_text=False — тело в str не декодируется вовсе (вернётся ""):
+    HTML-парсерам отдаются сами байты с кодировкой из body_charset.
+    """
+    ctype = (headers.get("Content-Type") or "").lower()
+    enc = body_charset(headers)
+
+    j = None
+    head = bytes(content[:1024]).lstrip()
+    try_json = "json" in ctype or head.startswith(b"{") or head.startswith(b"[")
+    if try_json:
         try:
-            resp.close()
+            j = json.loads(content if _is_utf8(enc) else _decode_text(content, enc))
         except Exception:
-            pass
-    return b"".join(chunks), False
+            j = None
+    if not want_text:
+        return "", j
+    return _decode_text(content, enc), j
 
-def decode_body_and_maybe_json(content: bytes, headers: Dict[str, str]) -> Tuple[str, Optional[Any]]:
-    import json
-    ctype = (headers.get("Content-Type") or "").lower()
-    enc = parse_charset_from_content_type(ctype) or "utf-8"
+def _decode_text(content: Union[bytes, bytearray], enc: str) -> str:
     try:
-        text = content.decode(enc, errors="replace")
+        return content.decode(enc, errors="replace")
     except Exception:
         try:
-            text = content.decode("utf-8", errors="replace")
+            return content.decode("utf-8", errors="replace")
         except Exception:
-            text = content.decode("latin-1", errors="replace")
+            return content.decode("latin-1", errors="replace")
 
-    j = None
-    try_json = "json" in ctype or (text.lstrip().startswith("{") or text.lstrip().startswith("["))
-    if try_json:
+def session_expired(resp: requests.Response, url: str, streamed: bool = False) -> bool:
+    """419/401, редирект на /login или CSRF token mismatch (тело смотрим только у нестримовых ответов)."""
+    if urlsplit(url).path.rstrip("/") == "/login":
+        return False
+    if resp.status_code in (401, 419):
+        return True
+    if resp.status_code in (301, 302, 303) and urlsplit(resp.headers.get("Location", "")).path.rstrip("/") == "/login":
+        return True
+    if resp.history and urlsplit(resp.url).path.rstrip("/") == "/login":
+        return True
+    if resp.status_code in (403, 422) and not streamed:
+        return "csrf token mismatch" in (resp.text or "")[:4000].lower()
+    return False
+
+def _request_csrf(kwargs: Dict[str, Any]) -> Optional[str]:
+    for k, v in (kwargs.get("headers") or {}).items():
+        if k.lower() == "x-csrf-token":
+            return v
+    for key in ("data", "json"):
+        body = kwargs.get(key)
+        if isinstance(body, dict) and body.get("_token"):
+            return body["_token"]
+    return None
+
+def _with_csrf(kwargs: Dict[str, Any], token: str) -> Dict[str, Any]:
+    """Копия kwargs, где явно переданный CSRF (заголовок, _token формы/JSON) заменён на token."""
+    out = dict(kwargs)
+    if out.get("headers"):
+        out["headers"] = {k: (token if k.lower() == "x-csrf-token" else v) for k, v in out["headers"].items()}
+    for key in ("data", "json"):
+        body = out.get(key)
+        if isinstance(body, dict) and "_token" in body:
+            out[key] = {**body, "_token": token}
+        elif isinstance(body, list):
+            out[key] = [(k, token) if k == "_token" else (k, v) for k, v in body]
+    return out
+
+def _guarded(method: str, session: requests.Session, send, url: str, hedge: bool = False, **kwargs) -> requests.Response:
+    refresher = session_refresher_for(session)
+    if refresher is None:
+        return _send_guarded(method, session, send, url, hedge, kwargs)
+    refresher.wait_idle()
+    generation = refresher.generation
+    resp = _send_guarded(method, session, send, url, hedge, kwargs)
+    if not session_expired(resp, url, streamed=bool(kwargs.get("stream"))):
+        return resp
+    profile = _session_profiles.get(session) or {}
+    carried = _request_csrf(kwargs)
+    if not (carried and carried != profile_csrf(profile)) and not refresher.refresh(generation):
+        return resp
+    # запрос ушёл со старым токеном или сессия только что обновлена — один повтор
+    _close_quietly(resp)
+    return _send_guarded(method, session, send, url, hedge, _with_csrf(kwargs, profile_csrf(profile)))
+
+def _send_guarded(method: str, session: requests.Session, send, url: str, hedge: bool, kwargs: Dict[str, Any]) -> requests.Response:
+    throttle(session)
+    breaker = breaker_for(method, url)
+    breaker.before_request()
+    try:
+        resp = send_with_hedge(endpoint_key(method, url), send, url, hedge, acquire=lambda: throttle(session), **kwargs)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        breaker.record_failure()
+        raise
+    except Exception:
+        breaker.cancel_probe()
+        raise
+    observe_response(breaker, resp)
+    return resp
+
+class SingleFlight:
+    """
+    Одинаковые одновременные чтения выполняются один раз: остальные вызывающие
+    ждут Future первого и получают тот же (разобранный) результат. Непустой
+    результат ещё ttl секунд отдаётся из памяти. Результат общий — не изменять.
+    """
+    def __init__(self, ttl: float = SINGLE_FLIGHT_TTL, max_entries: int = SINGLE_FLIGHT_MAX) -> None:
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._inflight: Dict[Hashable, concurrent.futures.Future] = {}
+        self._memo: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], fresh: bool = False) -> Any:
+        with self._lock:
+            hit = self._memo.pop(key, None)
+            if hit is not None and not fresh and hit[0] > time.monotonic():
+                self._memo[key] = hit
+                return hit[1]
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = concurrent.futures.Future()
+        if not leader:
+            return fut.result()
         try:
-            j = json.loads(text)
-        except Exception:
-            j = None
-    return text, j
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            if value and self.ttl > 0:
+                self._memo[key] = (time.monotonic() + self.ttl, value)
+                while len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+        fut.set_result(value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memo.clear()
+
+
+_flights = SingleFlight()
+
+def coalesce(session: requests.Session, method: str, url: str, payload: Any, fn: Callable[[], Any], fresh: bool = False) -> Any:
+    """
+    Идемпотентное чтение через single-flight: ключ — метод, URL, payload и профиль
+    сессии (сессии одного профиля делят результаты, разных аккаунтов — нет).
+    fresh=True — не брать результат из памяти.
+    """
+    scope = id(_session_profiles.get(session, session))
+    key = (method, url, json.dumps(payload, sort_keys=True, default=str), scope)
+    return _flights.do(key, fn, fresh=fresh)
 
-def get(session: requests.Session, url: str, **kwargs) -> requests.Response:
-    return session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+def get(session: requests.Session, url: str, hedge: bool = False, **kwargs) -> requests.Response:
+    return _guarded("GET", session, session.get, url, hedge=hedge, **kwargs)
 
-def post(session: requests.Session, url: str, **kwargs) -> requests.Response:
-    return session.post(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+def post(session: requests.Session, url: str, hedge: bool = False, **kwargs) -> requests.Response:
+    """hedge=True — только для идемпотентного чтения (availableCardsLoad и т.п.), не для создания обменов."""
+    return _guarded("POST", session, session.post, url, hedge=hedge, **kwargs)
 
 def default_client_headers() -> Dict[str, str]:
     return {
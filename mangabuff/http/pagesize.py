@@ -0,0 +1,172 @@
+import json
+import pathlib
+import threading
+from typing import Any, Dict, Optional
+
+from mangabuff.config import HUGE_LIST_THRESHOLD, MAX_CONTENT_BYTES, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from mangabuff.http.breaker import endpoint_key
+
+PAGE_SIZES_FILE = "page_sizes.json"
+
+# страница не должна подбираться к лимиту read_capped вплотную
+BYTES_HEADROOM = 0.8
+
+
+class PageSizeTuner:
+    """
+    Подбор limit для постраничных эндпоинтов (availableCardsLoad и т.п.).
+    Пока сервер отдаёт полную страницу, limit удваивается; упёрлись в потолок
+    сервера (короткая страница, за которой есть продолжение), в MAX_CONTENT_BYTES
+    или HUGE_LIST_THRESHOLD — limit фиксируется. Результат хранится по endpoint_key
+    (плюс kind — например, запросы с фильтром rank/search отдельно от полного
+    обхода) в page_sizes.json и используется в следующих запусках.
+    """
+    def __init__(self, path: Optional[pathlib.Path] = None, default: int = PAGE_SIZE_DEFAULT, max_limit: int = PAGE_SIZE_MAX) -> None:
+        self.path = path
+        self.default = max(1, default)
+        self.max_limit = max(self.default, min(max_limit, HUGE_LIST_THRESHOLD))
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self._suspect: Dict[str, int] = {}
+        self._failures: Dict[str, Dict[int, int]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    @classmethod
+    def open(cls, profiles_dir: pathlib.Path) -> "PageSizeTuner":
+        return cls(profiles_dir / PAGE_SIZES_FILE)
+
+    def _load(self) -> None:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        if isinstance(data, dict):
+            self.state = {k: v for k, v in data.items() if isinstance(v, dict)}
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            snapshot = json.dumps(self.state, ensure_ascii=False, indent=2)
+            self._dirty = False
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(snapshot, encoding="utf-8")
+        tmp.replace(self.path)
+
+    @staticmethod
+    def _key(method: str, url: str, kind: str = "") -> str:
+        key = endpoint_key(method, url)
+        return f"{key}#{kind}" if kind else key
+
+    def _entry(self, key: str) -> Dict[str, Any]:
+        st = self.state.get(key)
+        if st is None:
+            st = self.state[key] = {"limit": 0, "cap": self.max_limit, "settled": False}
+        return st
+
+    def next_limit(self, method: str, url: str, kind: str = "") -> int:
+        key = self._key(method, url, kind)
+        with self._lock:
+            st = self._entry(key)
+            honoured = int(st.get("limit") or 0)
+            cap = int(st.get("cap") or self.max_limit)
+            if not honoured:
+                return min(self.default, cap)
+            if st.get("settled"):
+                return min(honoured, cap)
+            return max(1, min(honoured * 2, cap))
+
+    def settled_limit(self, method: str, url: str, kind: str = "") -> int:
+        """Зафиксированный limit эндпоинта или 0, пока он ещё подбирается."""
+        key = self._key(method, url, kind)
+        with self._lock:
+            st = self.state.get(key)
+            if not st or not st.get("settled") or key in self._suspect:
+                return 0
+            return min(int(st.get("limit") or 0), int(st.get("cap") or self.max_limit))
+
+    def record(self, method: str, url: str, requested: int, got: int, nbytes: int = 0, kind: str = "") -> bool:
+        """
+        Учитывает ответ на запрос с limit=requested. Возвращает True, если
+        за этой страницей, вероятно, есть продолжение.
+        """
+        key = self._key(method, url, kind)
+        with self._lock:
+            self._failures.pop(key, None)
+            st = self._entry(key)
+            honoured = int(st.get("limit") or 0)
+
+            suspect = self._suspect.pop(key, None)
+            if suspect is not None and got > 0:
+                # короткая страница оказалась не последней — это потолок сервера
+                self._set(st, limit=suspect, settled=True)
+                honoured = suspect
+
+            if got and nbytes:
+                per_card = nbytes / got
+                by_bytes = max(1, int(MAX_CONTENT_BYTES * BYTES_HEADROOM / per_card))
+                if by_bytes < int(st.get("cap") or self.max_limit):
+                    self._set(st, cap=by_bytes)
+
+            if got >= requested:
+                if got > honoured:
+                    self._set(st, limit=got)
+                if got >= int(st.get("cap") or self.max_limit):
+                    self._set(st, settled=True)
+                return True
+            if honoured and got >= min(honoured, requested) and not st.get("settled"):
+                self._suspect[key] = got
+                return True
+            return bool(honoured) and got >= min(honoured, requested)
+
+    def failed(self, method: str, url: str, requested: int, kind: str = "") -> bool:
+        """
+        Ошибка без явной причины (5xx и т.п.) на limit=requested. True — это уже
+        повторная ошибка на том же limit, и виноват, видимо, размер страницы.
+        """
+        key = self._key(method, url, kind)
+        with self._lock:
+            counts = self._failures.setdefault(key, {})
+            counts[requested] = counts.get(requested, 0) + 1
+            return counts[requested] >= 2
+
+    def shrink(self, method: str, url: str, requested: int, kind: str = "") -> int:
+        """
+        Страница limit=requested точно не прошла по размеру (413, too big, повторная
+        ошибка) — потолок снижается вдвое. Не фиксирует limit: ниже потолка подбор
+        продолжается. Возвращает новый limit.
+        """
+        key = self._key(method, url, kind)
+        with self._lock:
+            self._failures.pop(key, None)
+            st = self._entry(key)
+            new_cap = max(self.default, requested // 2)
+            honoured = min(int(st.get("limit") or 0) or self.default, new_cap)
+            self._set(st, limit=honoured, cap=new_cap)
+            return honoured
+
+    def _set(self, st: Dict[str, Any], **kwargs: Any) -> None:
+        for k, v in kwargs.items():
+            if st.get(k) != v:
+                st[k] = v
+                self._dirty = True
+
+
+_active: Optional[PageSizeTuner] = None
+_fallback = PageSizeTuner()
+
+
+def set_active_page_tuner(tuner: Optional[PageSizeTuner]) -> None:
+    global _active
+    _active = tuner
+
+
+def active_page_tuner() -> Optional[PageSizeTuner]:
+    return _active
+
+
+def page_tuner() -> PageSizeTuner:
+    return _active if _active is not None else _fallback
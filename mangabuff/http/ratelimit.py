@@ -0,0 +1,62 @@
+import threading
+import time
+import weakref
+from typing import Optional
+
+import requests
+
+from mangabuff.config import RATE_LIMIT_RPS, RATE_LIMIT_BURST
+
+
+class RateLimiter:
+    """Токен-бакет: в среднем не больше rate запросов в секунду, всплеск до burst."""
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst if burst is not None else rate))
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            # токен резервируется сразу: ждущие потоки встают в очередь, а не гонятся
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiter: Optional[RateLimiter] = RateLimiter(RATE_LIMIT_RPS, RATE_LIMIT_BURST) if RATE_LIMIT_RPS > 0 else None
+# лимиты отдельных сессий (встраиваемый клиент) — поверх общего
+_session_limiters: "weakref.WeakKeyDictionary[requests.Session, RateLimiter]" = weakref.WeakKeyDictionary()
+
+
+def set_rate_limiter(limiter: Optional[RateLimiter]) -> None:
+    global _limiter
+    _limiter = limiter
+
+
+def rate_limiter() -> Optional[RateLimiter]:
+    return _limiter
+
+
+def set_session_rate_limiter(session: requests.Session, limiter: Optional[RateLimiter]) -> None:
+    if limiter is None:
+        _session_limiters.pop(session, None)
+    else:
+        _session_limiters[session] = limiter
+
+
+def throttle(session: Optional[requests.Session] = None) -> None:
+    """
+    Общий для процесса лимит запросов (MANGABUFF_RATE_LIMIT_RPS, 0 — без лимита)
+    и, если задан, лимит сессии.
+    """
+    if _limiter is not None:
+        _limiter.acquire()
+    limiter = _session_limiters.get(session) if session is not None else None
+    if limiter is not None:
+        limiter.acquire()
@@ -1,9 +1,13 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 from bs4 import BeautifulSoup
 from mangabuff.utils.text import safe_int, extract_card_id_from_href, norm_text
 
-def parse_trade_cards_html(html: str) -> List[Dict[str, Any]]:
-    soup = BeautifulSoup(html or "", "html.parser")
+def parse_trade_cards_html(html: Union[str, bytes, bytearray], encoding: Optional[str] = None) -> List[Dict[str, Any]]:
+    # байты отдаются парсеру как есть — без промежуточной str-копии тела
+    if isinstance(html, (bytes, bytearray)):
+        soup = BeautifulSoup(html, "html.parser", from_encoding=encoding)
+    else:
+        soup = BeautifulSoup(html or "", "html.parser")
     items: List[Dict[str, Any]] = []
     candidates = soup.select('[data-id], [data-card-id], .card, [class*="card"], img')
     seen = set()
@@ -0,0 +1,137 @@
+"""
+Вынос парсинга HTML (BeautifulSoup, чистый Python) в пул процессов.
+
+В воркер уходят сырые байты тела ответа, обратно — компактные результаты:
+кортежи CARD_FIELDS для карт, списки user_id для владельцев. Пока воркер
+парсит, основной поток не держит GIL и продолжает сетевой обмен.
+Мелкие страницы парсятся на месте: пересылка между процессами дороже.
+
+Выносится только то, что идёт внахлёст с сетью: страницы владельцев
+(_iter_user_pages_pooled) и окно инвентаря (_iter_window, разбор в потоке
+загрузки). Ответ, который нужен сразу (карты партнёра при проверке), —
+parse_cards на месте: ждать воркер без перекрытия дороже, чем разобрать самому.
+"""
+import concurrent.futures
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from mangabuff.config import PARSE_WORKERS, PARSE_OFFLOAD_MIN_BYTES
+
+CARD_FIELDS = ("id", "card_id", "rank", "title", "href")
+
+Body = Union[str, bytes, bytearray]
+
+
+def _decode(body: Body, encoding: Optional[str]) -> str:
+    if isinstance(body, str):
+        return body
+    return body.decode(encoding or "utf-8", errors="replace")
+
+
+def _warm_worker() -> None:
+    import bs4  # noqa: F401
+    import mangabuff.parsing.cards  # noqa: F401
+
+
+def _run_parser(parse: Callable[[str], Any], body: Body, encoding: Optional[str]) -> Any:
+    return parse(_decode(body, encoding))
+
+
+def _parse_card_rows(body: Body, encoding: Optional[str]) -> List[Tuple]:
+    from mangabuff.parsing.cards import parse_trade_cards_html
+    return [tuple(c.get(k) for k in CARD_FIELDS) for c in parse_trade_cards_html(body, encoding)]
+
+
+def _parse_user_page(parse: Callable[[str], List[int]], body: Body, encoding: Optional[str], with_last_page: bool) -> Tuple[List[int], Optional[int]]:
+    html = _decode(body, encoding)
+    last_page = None
+    if with_last_page:
+        from bs4 import BeautifulSoup
+        from mangabuff.utils.html import extract_last_page_number
+        last_page = extract_last_page_number(BeautifulSoup(html or "", "html.parser"))
+    return parse(html), last_page
+
+
+def cards_from_rows(rows: Iterable[Tuple]) -> List[Dict[str, Any]]:
+    return [dict(zip(CARD_FIELDS, row)) for row in rows]
+
+
+def _done(value: Any) -> concurrent.futures.Future:
+    fut: concurrent.futures.Future = concurrent.futures.Future()
+    fut.set_result(value)
+    return fut
+
+
+class ParseExecutor:
+    """
+    Пул процессов для парсинга. workers=0 — всё парсится в текущем процессе
+    (тот же интерфейс, Future уже завершён).
+    """
+    def __init__(self, workers: int = PARSE_WORKERS, min_bytes: int = PARSE_OFFLOAD_MIN_BYTES) -> None:
+        self.workers = max(0, workers)
+        self.min_bytes = max(0, min_bytes)
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ParseExecutor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _offload(self, body: Body) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+        if not self.workers or len(body) < self.min_bytes:
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+            return self._pool
+
+    def _submit(self, fn: Callable, body: Body, *args: Any) -> concurrent.futures.Future:
+        pool = self._offload(body)
+        if pool is None:
+            try:
+                return _done(fn(*args))
+            except Exception as e:
+                fut: concurrent.futures.Future = concurrent.futures.Future()
+                fut.set_exception(e)
+                return fut
+        return pool.submit(fn, *args)
+
+    def submit(self, parse: Callable[[str], Any], body: Body, encoding: Optional[str] = None) -> concurrent.futures.Future:
+        """parse должен быть функцией уровня модуля (передаётся в воркер по имени)."""
+        return self._submit(_run_parser, body, parse, body, encoding)
+
+    def submit_card_rows(self, body: Body, encoding: Optional[str] = None) -> concurrent.futures.Future:
+        return self._submit(_parse_card_rows, body, body, encoding)
+
+    def submit_user_page(self, parse: Callable[[str], List[int]], body: Body, encoding: Optional[str] = None, with_last_page: bool = False) -> concurrent.futures.Future:
+        return self._submit(_parse_user_page, body, parse, body, encoding, with_last_page)
+
+    def parse_cards(self, body: Body, encoding: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Блокирующий разбор в пуле — только из потока, который и так ждёт (загрузчик окна)."""
+        return cards_from_rows(self.submit_card_rows(body, encoding).result())
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+_active: Optional[ParseExecutor] = None
+
+
+def set_active_parse_executor(executor: Optional[ParseExecutor]) -> None:
+    global _active
+    _active = executor
+
+
+def active_parse_executor() -> Optional[ParseExecutor]:
+    return _active
+
+
+def parse_cards(body: Body, encoding: Optional[str] = None) -> List[Dict[str, Any]]:
+    """parse_trade_cards_html в текущем потоке (см. докстринг модуля)."""
+    from mangabuff.parsing.cards import parse_trade_cards_html
+    return parse_trade_cards_html(body, encoding)
@@ -2,8 +2,6 @@ import json
 import pathlib
 from typing import Optional, Dict
 
-from mangabuff.http.http_utils import default_client_headers
-
 class ProfileStore:
     def __init__(self, root_dir: str) -> None:
         self.root = pathlib.Path(root_dir)
@@ -35,6 +33,7 @@ class ProfileStore:
         self.write_by_path(self.path_for(name), data)
 
     def default_profile(self, user_id: Optional[str] = None, club_name: Optional[str] = None) -> Dict:
+        from mangabuff.http.http_utils import default_client_headers
         return {
             "cookie": {
                 "XSRF-TOKEN": "",
@@ -0,0 +1,136 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from mangabuff.config import MATCH_BATCH, TRADE_BUNDLE_MAX
+from mangabuff.http.http_utils import build_session_from_profile
+from mangabuff.services.owners import OwnersWalkIncomplete, iter_online_owners_by_pages
+from mangabuff.services.checkpoint import CampaignCheckpoint
+from mangabuff.services.matching import InstancePool, assign_offers
+from mangabuff.services.trade import TradeSubmitter, find_partner_card_instances, probe_when_available, send_bundle
+
+
+def collect_wanted_by_owner(
+    profile_data: Dict,
+    targets: List[Dict[str, Any]],
+    max_pages: int = 0,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+) -> Tuple[Dict[int, List[Dict[str, Any]]], bool]:
+    """
+    Обходит владельцев каждой целевой карты и сводит их в одну карту
+    owner_id -> [целевые карты, которые у него есть]. Второе значение — все
+    обходы дошли до последней страницы (False — какой-то оборвался на ошибке).
+    """
+    session = session or build_session_from_profile(profile_data)
+    wanted: Dict[int, List[Dict[str, Any]]] = {}
+    complete = True
+    for target in targets:
+        card_id = int(target["card_id"])
+        try:
+            for _page, owners in iter_online_owners_by_pages(profile_data, card_id, max_pages=max_pages, debug=debug, session=session, strict=True):
+                for uid in owners:
+                    cards = wanted.setdefault(uid, [])
+                    if all(int(t["card_id"]) != card_id for t in cards):
+                        cards.append(target)
+        except OwnersWalkIncomplete as e:
+            print(f"❌ Обход владельцев карты {card_id} прерван: {e}")
+            complete = False
+    return wanted, complete
+
+
+def send_multi_target_trades(
+    profile_data: Dict,
+    targets: List[Dict[str, Any]],
+    my_cards: List[Dict[str, Any]],
+    max_pages: int = 0,
+    dry_run: bool = True,
+    use_api: bool = True,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+    bundle_max: int = TRADE_BUNDLE_MAX,
+    checkpoint: Optional[CampaignCheckpoint] = None,
+) -> Dict[str, int]:
+    """
+    Кампания по нескольким картам: один обход владельцев на карту,
+    одна проверка инвентаря на партнёра сразу для всех его целевых карт
+    и одно предложение на партнёра, в которое собирается до bundle_max карт.
+    С чекпоинтом сводка владельцев и обработанные пачки переживают перезапуск.
+    """
+    session = session or build_session_from_profile(profile_data)
+    stats = {"targets": len(targets), "owners_total": 0, "owners_multi": 0, "partners_probed": 0, "trades_attempted": 0, "trades_succeeded": 0, "cards_offered": 0}
+    checkpoint = checkpoint or CampaignCheckpoint()
+    checkpoint.restore_stats(stats)
+
+    by_id = {int(t["card_id"]): t for t in targets}
+    if "wanted" in checkpoint.extra:
+        wanted = {int(uid): [by_id[cid] for cid in cids if cid in by_id] for uid, cids in checkpoint.extra["wanted"].items()}
+    else:
+        wanted, complete = collect_wanted_by_owner(profile_data, targets, max_pages=max_pages, debug=debug, session=session)
+        wanted = {uid: cards for uid, cards in wanted.items() if str(uid) != str(profile_data.get("id"))}
+        checkpoint.extra["wanted"] = {str(uid): [int(t["card_id"]) for t in cards] for uid, cards in wanted.items()}
+        checkpoint.extra["wanted_complete"] = complete
+        checkpoint.save()
+    stats["owners_total"] = len(wanted)
+    stats["owners_multi"] = sum(1 for cards in wanted.values() if len(cards) > 1)
+    if debug:
+        print(f"[CAMPAIGN] {len(wanted)} owners for {len(targets)} targets, {stats['owners_multi']} hold several")
+
+    pool = InstancePool(my_cards)
+    for inst in checkpoint.reserved():
+        pool.take(inst)
+    submitter = TradeSubmitter(session, use_api=use_api, debug=debug)
+    # владельцы нескольких целевых карт — первыми
+    ordered = sorted(wanted.items(), key=lambda kv: len(kv[1]), reverse=True)
+    for batch_num, start in enumerate(range(0, len(ordered), MATCH_BATCH), start=1):
+        if batch_num <= checkpoint.page:
+            continue
+        candidates: Dict[int, List[Dict[str, Any]]] = {}
+        for owner_id, owner_targets in ordered[start:start + MATCH_BATCH]:
+            if checkpoint.handled(int(owner_id)):
+                continue
+            known, probed = checkpoint.probe(int(owner_id))
+            if not known:
+                ok, found = probe_when_available(int(owner_id), lambda: find_partner_card_instances(session, int(owner_id), "receiver", owner_targets, debug=debug))
+                if not ok:
+                    print("❌ availableCardsLoad недоступен, кампания остановлена")
+                    stats["aborted_circuit_open"] = 1
+                    checkpoint.save()
+                    return stats
+                stats["partners_probed"] += 1
+                probed = {str(cid): inst for cid, inst in found.items()}
+                checkpoint.record_probe(int(owner_id), probed)
+            slots = []
+            for target in owner_targets:
+                his_inst = probed.get(str(int(target["card_id"])))
+                if his_inst:
+                    slots.append({"card_id": int(target["card_id"]), "rank": (target.get("rank") or "").strip(), "his_inst": his_inst})
+            if slots:
+                candidates[int(owner_id)] = slots
+
+        assigned = assign_offers(candidates, pool, per_partner=max(1, bundle_max))
+        for owner_id, pairs in assigned.items():
+            my_ids = [int(my_inst) for _slot, my_inst in pairs]
+            his_ids = [int(slot["his_inst"]) for slot, _my_inst in pairs]
+            stats["trades_attempted"] += 1
+            stats["cards_offered"] += len(pairs)
+            ok = send_bundle(session, owner_id, my_ids, his_ids, dry_run=dry_run, use_api=use_api, debug=debug, submitter=submitter)
+            if ok:
+                stats["trades_succeeded"] += 1
+            elif not dry_run:
+                for inst in my_ids:
+                    pool.release(inst)
+            checkpoint.record_offer(owner_id, my_ids if ok or dry_run else [], stats)
+        checkpoint.page_done(batch_num, stats)
+    if checkpoint.extra.get("wanted_complete", True):
+        checkpoint.finish()
+        return stats
+    # сводка владельцев была неполной: обработанные остаются в чекпоинте, а
+    # --resume соберёт владельцев заново и пройдёт пачки с начала
+    print("ℹ️ Обход владельцев был неполным — чекпоинт сохранён, продолжите с --resume")
+    stats["aborted_incomplete"] = 1
+    checkpoint.extra.pop("wanted", None)
+    checkpoint.extra.pop("wanted_complete", None)
+    checkpoint.page = 0
+    checkpoint.save()
+    return stats
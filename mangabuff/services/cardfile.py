@@ -0,0 +1,178 @@
+"""
+Инвентарь на диске: NDJSON (одна карта на строку, пишется по мере прихода
+страниц) и рядом бинарный индекс <file>.idx — смещение строки, card_id и
+instance_id для каждой карты. Случайная карта, поиск по card_id и сверка при
+дельта-синхронизации идут по индексу, а нужные строки читаются через mmap —
+файл целиком не разбирается.
+"""
+import array
+import json
+import mmap
+import os
+import pathlib
+import random
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from mangabuff.parsing.cards import entry_card_id, entry_instance_id
+
+INDEX_MAGIC = b"MBNDX1\0\0"
+
+Index = Tuple["array.array[int]", "array.array[int]", "array.array[int]"]
+
+
+def inventory_path(profiles_dir: pathlib.Path, user_id: str) -> pathlib.Path:
+    return profiles_dir / f"{user_id}.ndjson"
+
+
+def index_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + ".idx")
+
+
+def _write_index(path: pathlib.Path, offsets: "array.array[int]", card_ids: "array.array[int]", inst_ids: "array.array[int]") -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(INDEX_MAGIC)
+        array.array("q", [len(card_ids)]).tofile(f)
+        offsets.tofile(f)
+        card_ids.tofile(f)
+        inst_ids.tofile(f)
+    tmp.replace(path)
+
+
+def _read_index(path: pathlib.Path, data_size: int) -> Optional[Index]:
+    """Индекс годится, только если последнее смещение совпадает с размером файла."""
+    try:
+        raw = path.read_bytes()
+    except OSError:
+        return None
+    if raw[:8] != INDEX_MAGIC or len(raw) < 16:
+        return None
+    count = array.array("q", raw[8:16])[0]
+    if len(raw) != 16 + 8 * (3 * count + 1):
+        return None
+    body = array.array("q", raw[16:])
+    offsets, card_ids, inst_ids = body[:count + 1], body[count + 1:2 * count + 1], body[2 * count + 1:]
+    if offsets[-1] != data_size:
+        return None
+    return offsets, card_ids, inst_ids
+
+
+class CardFileWriter:
+    """
+    Пишет карты в <file>.part, сбрасывая буфер после каждой страницы: при падении
+    уже полученное остаётся на диске. finish() атомарно подменяет файл и индекс.
+    """
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.part = path.with_name(path.name + ".part")
+        self._f = self.part.open("wb")
+        self.offsets = array.array("q", [0])
+        self.card_ids = array.array("q")
+        self.inst_ids = array.array("q")
+
+    def __len__(self) -> int:
+        return len(self.card_ids)
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self.write_raw(line, entry_card_id(entry) or 0, entry_instance_id(entry) or 0)
+
+    def write_raw(self, line: bytes, card_id: int, inst_id: int) -> None:
+        self._f.write(line)
+        self.offsets.append(self.offsets[-1] + len(line))
+        self.card_ids.append(card_id)
+        self.inst_ids.append(inst_id)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def finish(self) -> pathlib.Path:
+        self._f.close()
+        self.part.replace(self.path)
+        _write_index(index_path(self.path), self.offsets, self.card_ids, self.inst_ids)
+        return self.path
+
+    def abort(self) -> None:
+        self._f.close()
+
+
+class CardFile:
+    """Только чтение: len, [i], итерация, random(), find_card(card_id). Без индекса он строится заново."""
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self._f = path.open("rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        index = _read_index(index_path(path), size)
+        if index is None:
+            index = self._rebuild_index()
+        self.offsets, self.card_ids, self.inst_ids = index
+
+    def __enter__(self) -> "CardFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def _rebuild_index(self) -> Index:
+        offsets = array.array("q", [0])
+        card_ids = array.array("q")
+        inst_ids = array.array("q")
+        mm = self._mm
+        pos = 0
+        end = len(mm) if mm is not None else 0
+        while pos < end:
+            nl = mm.find(b"\n", pos)
+            stop = end if nl < 0 else nl + 1
+            try:
+                entry = json.loads(mm[pos:stop])
+            except ValueError:
+                entry = None
+            if not isinstance(entry, dict):
+                # битая строка (например, оборванная запись) — дальше не читаем
+                break
+            offsets.append(stop)
+            card_ids.append(entry_card_id(entry) or 0)
+            inst_ids.append(entry_instance_id(entry) or 0)
+            pos = stop
+        if offsets[-1] == end:
+            try:
+                _write_index(index_path(self.path), offsets, card_ids, inst_ids)
+            except OSError:
+                pass
+        return offsets, card_ids, inst_ids
+
+    def __len__(self) -> int:
+        return len(self.card_ids)
+
+    def raw(self, i: int) -> bytes:
+        return self._mm[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return json.loads(self.raw(i))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def random(self) -> Optional[Dict[str, Any]]:
+        return self[random.randrange(len(self))] if len(self) else None
+
+    def find_card(self, card_id: int) -> List[Dict[str, Any]]:
+        return [self[i] for i, cid in enumerate(self.card_ids) if cid == card_id]
+
+
+def load_cards(path: pathlib.Path) -> List[Dict[str, Any]]:
+    """Все карты файла инвентаря: NDJSON с индексом или старый JSON-список."""
+    if path.suffix == ".ndjson":
+        with CardFile(path) as cf:
+            return list(cf)
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else []
@@ -0,0 +1,226 @@
+import json
+import pathlib
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from mangabuff.config import CATALOG_MIN_SCORE, CATALOG_MIN_MARGIN
+from mangabuff.parsing.cards import entry_card_id
+from mangabuff.utils.text import norm_text
+
+CATALOG_FILE = "card_catalog.json"
+
+
+def normalize_name(name: str) -> str:
+    s = (name or "").lower().replace("ё", "е")
+    s = re.sub(r"[^\w]+", " ", s)
+    return norm_text(s.replace("_", " "))
+
+
+def trigrams(s: str) -> Set[str]:
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _entry_name(c: Dict[str, Any]) -> str:
+    inner = c.get("card") if isinstance(c.get("card"), dict) else {}
+    return norm_text(str(c.get("title") or c.get("name") or c.get("card_name") or inner.get("name") or inner.get("title") or ""))
+
+
+def _entry_rank(c: Dict[str, Any]) -> str:
+    inner = c.get("card") if isinstance(c.get("card"), dict) else {}
+    return str(c.get("rank") or c.get("grade") or inner.get("rank") or "").strip()
+
+
+def _entry_image(c: Dict[str, Any]) -> str:
+    inner = c.get("card") if isinstance(c.get("card"), dict) else {}
+    return str(c.get("image") or c.get("img") or inner.get("image") or "")
+
+
+class CardCatalog:
+    """
+    Локальный справочник карт card_id -> {name, rank, image, seen_at}, пополняется
+    пассивно из всего, что уже распарсили (инвентари, availableCardsLoad, поиск).
+    Триграммный индекс по нормализованным именам даёт локальный резолв имени
+    и самый селективный поисковый запрос для карты.
+    """
+    def __init__(self, path: Optional[pathlib.Path] = None) -> None:
+        self.path = path
+        self.cards: Dict[int, Dict[str, Any]] = {}
+        self._norm: Dict[int, str] = {}
+        self._index: Dict[str, Set[int]] = {}
+        self._dirty = False
+        if path:
+            self._load()
+
+    @classmethod
+    def open(cls, profiles_dir: pathlib.Path) -> "CardCatalog":
+        return cls(profiles_dir / CATALOG_FILE)
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def _load(self) -> None:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        for k, v in data.items():
+            try:
+                cid = int(k)
+            except ValueError:
+                continue
+            if isinstance(v, dict):
+                self.cards[cid] = v
+                self._index_name(cid, v.get("name") or "")
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({str(k): v for k, v in self.cards.items()}, f, ensure_ascii=False)
+        tmp.replace(self.path)
+        self._dirty = False
+
+    def _index_name(self, cid: int, name: str) -> None:
+        old = self._norm.get(cid)
+        if old:
+            for tg in trigrams(old):
+                self._index.get(tg, set()).discard(cid)
+        norm = normalize_name(name)
+        if not norm:
+            self._norm.pop(cid, None)
+            return
+        self._norm[cid] = norm
+        for tg in trigrams(norm):
+            self._index.setdefault(tg, set()).add(cid)
+
+    def observe(self, entries: Iterable[Dict[str, Any]]) -> int:
+        changed = 0
+        now = int(time.time())
+        for c in entries:
+            if not isinstance(c, dict):
+                continue
+            cid = entry_card_id(c)
+            if not cid:
+                continue
+            name, rank, image = _entry_name(c), _entry_rank(c), _entry_image(c)
+            rec = self.cards.get(cid)
+            if rec is None:
+                rec = self.cards[cid] = {"name": "", "rank": ""}
+            updated = False
+            if name and rec.get("name") != name:
+                rec["name"] = name
+                self._index_name(cid, name)
+                updated = True
+            if rank and rec.get("rank") != rank:
+                rec["rank"] = rank
+                updated = True
+            if image and rec.get("image") != image:
+                rec["image"] = image
+                updated = True
+            rec["seen_at"] = now
+            if updated:
+                changed += 1
+        if changed:
+            self._dirty = True
+        return changed
+
+    def get(self, card_id: int) -> Optional[Dict[str, Any]]:
+        return self.cards.get(int(card_id))
+
+    def name_for(self, card_id: int) -> str:
+        return (self.cards.get(int(card_id)) or {}).get("name") or ""
+
+    def rank_for(self, card_id: int) -> str:
+        return (self.cards.get(int(card_id)) or {}).get("rank") or ""
+
+    def _containing(self, norm_query: str) -> Set[int]:
+        grams = trigrams(norm_query)
+        # внутренние триграммы: у подстроки нет пробелов-паддингов с краёв имени
+        inner = {g for g in grams if not g.startswith(" ") and not g.endswith(" ")} or grams
+        sets = sorted((self._index.get(g, set()) for g in inner), key=len)
+        if not sets or not sets[0]:
+            return set()
+        cand = set(sets[0])
+        for s in sets[1:]:
+            cand &= s
+            if not cand:
+                return cand
+        return {cid for cid in cand if norm_query in self._norm.get(cid, "")}
+
+    def resolve(self, name: str, rank: Optional[str] = None, limit: int = 5) -> List[Tuple[int, float]]:
+        norm = normalize_name(name)
+        if not norm:
+            return []
+        grams = trigrams(norm)
+        scores: Dict[int, int] = {}
+        for g in grams:
+            for cid in self._index.get(g, ()):
+                scores[cid] = scores.get(cid, 0) + 1
+        out: List[Tuple[int, float]] = []
+        for cid, common in scores.items():
+            if rank and self.rank_for(cid) and self.rank_for(cid) != rank:
+                continue
+            total = len(grams | trigrams(self._norm.get(cid, "")))
+            out.append((cid, common / total if total else 0.0))
+        out.sort(key=lambda x: x[1], reverse=True)
+        return out[:limit]
+
+    def resolve_one(self, name: str, rank: Optional[str] = None, min_score: float = CATALOG_MIN_SCORE, margin: float = CATALOG_MIN_MARGIN) -> Optional[int]:
+        """
+        card_id, только если лучшее совпадение уверенное: не ниже min_score
+        и с отрывом не меньше margin от второго. Иначе None.
+        """
+        hits = self.resolve(name, rank=rank, limit=2)
+        if not hits or hits[0][1] < min_score:
+            return None
+        if len(hits) > 1 and hits[0][1] - hits[1][1] < margin:
+            return None
+        return hits[0][0]
+
+    def search_query_for(self, card_id: int, name: str = "") -> str:
+        """
+        Самый селективный запрос для /search/cards: из полного имени и его слов
+        выбирается тот, что совпадает с наименьшим числом известных карт
+        (и всё ещё совпадает с нашей). Пустая строка — имени нет.
+        """
+        name = self.name_for(card_id) or name or ""
+        norm_full = normalize_name(name)
+        if not norm_full:
+            return norm_text(name)
+        options = [norm_text(name)] + [w for w in re.split(r"[^\w]+", name) if len(w) > 2]
+        best = norm_text(name)
+        best_cnt = None
+        for opt in options:
+            norm_opt = normalize_name(opt)
+            if len(norm_opt) <= 2:
+                continue
+            matches = self._containing(norm_opt)
+            if int(card_id) not in matches and int(card_id) in self._norm:
+                continue
+            cnt = len(matches)
+            if best_cnt is None or cnt < best_cnt or (cnt == best_cnt and len(opt) > len(best)):
+                best, best_cnt = opt, cnt
+        return best
+
+
+_active: Optional[CardCatalog] = None
+
+
+def set_active_catalog(catalog: Optional[CardCatalog]) -> None:
+    global _active
+    _active = catalog
+
+
+def active_catalog() -> Optional[CardCatalog]:
+    return _active
+
+
+def observe_cards(entries: Iterable[Dict[str, Any]]) -> None:
+    if _active is not None and entries:
+        _active.observe(entries)
@@ -0,0 +1,168 @@
+import json
+import pathlib
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mangabuff.config import CHECKPOINT_EVERY
+from mangabuff.utils.idset import IdSet
+
+
+class CampaignCheckpoint:
+    """
+    Состояние рассылки на диске: последняя полностью обработанная страница,
+    результаты проверок партнёров на текущей странице, кому уже ушло предложение
+    (с зарезервированными экземплярами), обработанные без резерва владельцы
+    (IdSet, в файле — base64 varint) и статистика. Каждая отправка сразу
+    дописывается строкой в журнал рядом (<файл>.journal), а сам файл целиком
+    переписывается только на page_done и прочих save() — журнал при этом
+    обнуляется. Проверки сохраняются раз в CHECKPOINT_EVERY партнёров.
+    path=None — чекпоинт только в памяти (рассылка без --resume-файла).
+    """
+    VERSION = 2
+
+    def __init__(self, path: Optional[pathlib.Path] = None, key: str = "") -> None:
+        self.path = path
+        self.key = key
+        self.page = 0
+        self.probes: Dict[int, Any] = {}
+        self.offered: Dict[int, List[int]] = {}
+        self.done = IdSet()
+        self.stats: Dict[str, int] = {}
+        self.extra: Dict[str, Any] = {}
+        self.resumed = False
+        self._unsaved = 0
+
+    @classmethod
+    def open(cls, profiles_dir: pathlib.Path, name: str, key: str, resume: bool = False) -> "CampaignCheckpoint":
+        cp = cls(profiles_dir / f"campaign_{name}.json", key=key)
+        if resume:
+            cp._load()
+        return cp
+
+    def _load(self) -> None:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        if not isinstance(data, dict) or data.get("version") not in (1, self.VERSION) or data.get("key") != self.key:
+            return
+        self.page = int(data.get("page") or 0)
+        self.probes = {int(k): v for k, v in (data.get("probes") or {}).items()}
+        self.done = IdSet.from_text(data.get("done") or "")
+        for k, v in (data.get("offered") or {}).items():
+            # версия 1 хранила и пустые предложения в offered
+            if v:
+                self.offered[int(k)] = [int(i) for i in v]
+            else:
+                self.done.add(int(k))
+        self.stats = {k: int(v) for k, v in (data.get("stats") or {}).items()}
+        self.extra = data.get("extra") or {}
+        self._replay_journal()
+        self.resumed = True
+
+    def _journal_path(self) -> pathlib.Path:
+        return self.path.with_suffix(self.path.suffix + ".journal")
+
+    def _replay_journal(self) -> None:
+        try:
+            with self._journal_path().open("r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # недописанная последняя строка (обрыв посреди записи)
+                break
+            owner = int(entry["owner"])
+            if entry.get("ids"):
+                self.offered[owner] = [int(i) for i in entry["ids"]]
+            else:
+                self.done.add(owner)
+            self.stats = {k: int(v) for k, v in (entry.get("stats") or {}).items()}
+        if lines:
+            # сразу сворачиваем в файл: новые строки не допишутся за оборванной
+            self.save()
+
+    def save(self, force: bool = True) -> None:
+        self._unsaved += 1
+        if not self.path or (not force and self._unsaved < CHECKPOINT_EVERY):
+            return
+        data = {
+            "version": self.VERSION,
+            "key": self.key,
+            "page": self.page,
+            "probes": {str(k): v for k, v in self.probes.items()},
+            "offered": {str(k): v for k, v in self.offered.items()},
+            "done": self.done.to_text(),
+            "stats": self.stats,
+            "extra": self.extra,
+            "updated_at": int(time.time()),
+        }
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        tmp.replace(self.path)
+        # всё из журнала теперь в файле; при обрыве до удаления повторное применение безвредно
+        self._drop_journal()
+        self._unsaved = 0
+
+    def _drop_journal(self) -> None:
+        try:
+            self._journal_path().unlink()
+        except FileNotFoundError:
+            pass
+
+    def restore_stats(self, stats: Dict[str, int]) -> None:
+        for k, v in self.stats.items():
+            stats[k] = v
+
+    def reserved(self) -> Iterable[int]:
+        for ids in self.offered.values():
+            yield from ids
+
+    def handled(self, owner_id: int) -> bool:
+        """Владельцу уже отправлялось предложение (успешно или нет) — повторно не трогаем."""
+        return owner_id in self.offered or owner_id in self.done
+
+    def probe(self, owner_id: int) -> Tuple[bool, Any]:
+        if owner_id in self.probes:
+            return True, self.probes[owner_id]
+        return False, None
+
+    def record_probe(self, owner_id: int, value: Any) -> None:
+        self.probes[owner_id] = value
+        self.save(force=False)
+
+    def record_offer(self, owner_id: int, my_ids: List[int], stats: Dict[str, int]) -> None:
+        if my_ids:
+            self.offered[owner_id] = [int(i) for i in my_ids]
+        else:
+            self.done.add(owner_id)
+        self.stats = dict(stats)
+        if not self.path:
+            return
+        if not self.path.exists():
+            # журнал без файла не восстановить (нет key) — первый раз пишем целиком
+            self.save()
+            return
+        entry = {"owner": int(owner_id), "ids": [int(i) for i in my_ids], "stats": self.stats}
+        with self._journal_path().open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def page_done(self, page: int, stats: Dict[str, int]) -> None:
+        # проверки прошлых страниц больше не понадобятся
+        self.page = page
+        self.probes.clear()
+        self.stats = dict(stats)
+        self.save()
+
+    def finish(self) -> None:
+        if self.path:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            self._drop_journal()
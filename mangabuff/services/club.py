@@ -8,26 +8,55 @@ from bs4 import BeautifulSoup
 
 from mangabuff.config import BASE_URL
 from mangabuff.http.http_utils import build_session_from_profile, get
-from mangabuff.services.inventory import fetch_all_cards_by_id
+from mangabuff.services.cardfile import CardFile
+from mangabuff.services.holdings import active_holdings
+from mangabuff.services.inventory import fetch_all_cards_by_id, snapshot_delta_syncable
 from mangabuff.services.counters import count_by_last_page
+from mangabuff.services.owners import WANTERS_SELECTORS
 
-def find_boost_card_info(profile_data: Dict, profiles_dir: pathlib.Path, club_boost_url: str, debug: bool=False) -> Optional[Tuple[int, pathlib.Path]]:
-    session = build_session_from_profile(profile_data)
+def fetch_boost_card_href(session: requests.Session, club_boost_url: str, debug: bool=False) -> Optional[str]:
     club_boost_url = club_boost_url if club_boost_url.startswith("http") else f"{BASE_URL}{club_boost_url}"
     try:
         resp = get(session, club_boost_url)
     except requests.RequestException:
         return None
     if resp.status_code != 200:
+        if debug:
+            print(f"[BOOST] status {resp.status_code} for {club_boost_url}")
         return None
 
     soup = BeautifulSoup(resp.text, "html.parser")
     card_link_el = soup.select_one('a.button.button--block[href*="/cards/"]')
     if not card_link_el or not card_link_el.get("href"):
         return None
-    card_href = card_link_el["href"]
+    return card_link_el["href"]
+
+def find_boost_card_info(profile_data: Dict, profiles_dir: pathlib.Path, club_boost_url: str, debug: bool=False, session: Optional[requests.Session] = None) -> Optional[Tuple[int, pathlib.Path]]:
+    session = session or build_session_from_profile(profile_data)
+    card_href = fetch_boost_card_href(session, club_boost_url, debug=debug)
+    if not card_href:
+        return None
     card_users_url = card_href if card_href.startswith("http") else f"{BASE_URL}{card_href}"
 
+    m = re.search(r"/cards/(\d+)", card_href)
+    if not m:
+        return None
+    card_id = int(m.group(1))
+
+    # известный по индексу владелец со свежим снимком инвентаря: снимок только
+    # досинхронизируется дельтой (подтверждение), страница владельцев не нужна;
+    # владельцы с устаревшим снимком потребовали бы полной выгрузки — их пропускаем
+    index = active_holdings()
+    if index is not None:
+        for holder_id, _inst, _rank, _seen in index.holders(card_id, limit=5):
+            if not snapshot_delta_syncable(profiles_dir, str(holder_id)):
+                continue
+            if debug:
+                print(f"[BOOST] card {card_id}: known holder {holder_id}")
+            res = _save_card_from_inventory(profile_data, profiles_dir, str(holder_id), card_id, session, incremental=True, debug=debug)
+            if res:
+                return res
+
     try:
         resp = get(session, card_users_url)
     except requests.RequestException:
@@ -42,22 +71,21 @@ def find_boost_card_info(profile_data: Dict, profiles_dir: pathlib.Path, club_bo
 
     last_user_link = user_links[-1]
     user_id = last_user_link["href"].rstrip("/").split("/")[-1]
-    cards_path, got_cards = fetch_all_cards_by_id(profile_data, profiles_dir, user_id, debug=debug)
+    return _save_card_from_inventory(profile_data, profiles_dir, user_id, card_id, session, debug=debug)
+
+def _save_card_from_inventory(profile_data: Dict, profiles_dir: pathlib.Path, user_id: str, card_id: int, session: requests.Session, incremental: bool = False, debug: bool = False) -> Optional[Tuple[int, pathlib.Path]]:
+    cards_path, got_cards = fetch_all_cards_by_id(profile_data, profiles_dir, user_id, debug=debug, incremental=incremental, session=session)
     if not got_cards:
         return None
 
+    # поиск по индексу NDJSON — разбирается только строка с нужной картой
     try:
-        with cards_path.open("r", encoding="utf-8") as f:
-            all_cards = json.load(f)
-    except Exception:
+        with CardFile(cards_path) as cf:
+            found = cf.find_card(card_id)
+    except (OSError, ValueError):
         return None
 
-    m = re.search(r"/cards/(\d+)", card_href)
-    if not m:
-        return None
-    card_id = int(m.group(1))
-
-    for card in all_cards:
+    for card in found:
         if int(card.get("card_id") or 0) == card_id:
             out_path = profiles_dir / f"card_{card_id}_from_{user_id}.json"
             with out_path.open("w", encoding="utf-8") as f:
@@ -72,16 +100,10 @@ def owners_and_wanters_counts(profile_data: Dict, card_id: int, debug: bool=Fals
         "a.card-show_owner",
         'a[class*="card-show_owner"]',
     ]
-    wanters_selectors = [
-        "a.profile__friends-item",
-        'a[class*="profile__friends-item"]',
-        "a.profile_friends-item",
-        'a[class*="profile_friends-item"]',
-    ]
 
     owners_url = f"{BASE_URL}/cards/{card_id}/users"
     owners_count = count_by_last_page(profile_data, owners_url, owners_selectors, per_page=36, debug=debug)
 
     want_url = f"{BASE_URL}/cards/{card_id}/offers/want"
-    wanters_count = count_by_last_page(profile_data, want_url, wanters_selectors, per_page=60, debug=debug)
+    wanters_count = count_by_last_page(profile_data, want_url, WANTERS_SELECTORS, per_page=60, debug=debug)
     return owners_count, wanters_count
\ No newline at end of file
@@ -0,0 +1,204 @@
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mangabuff.config import HOLDINGS_FLUSH_ROWS, HOLDINGS_FLUSH_SECONDS, HOLDINGS_MAX_AGE
+from mangabuff.parsing.cards import entry_card_id, entry_instance_id
+
+HOLDINGS_FILE = "holdings.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS holdings (
+    user_id INTEGER NOT NULL,
+    inst INTEGER NOT NULL,
+    card_id INTEGER NOT NULL,
+    rank TEXT NOT NULL DEFAULT '',
+    seen_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, inst)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS holdings_card ON holdings (card_id, seen_at);
+CREATE TABLE IF NOT EXISTS synced (user_id INTEGER PRIMARY KEY, synced_at INTEGER NOT NULL);
+"""
+
+Holding = Tuple[int, int, str, int]
+
+
+def _entry_rank(c: Dict[str, Any]) -> str:
+    inner = c.get("card") if isinstance(c.get("card"), dict) else {}
+    return str(c.get("rank") or c.get("grade") or inner.get("rank") or "").strip()
+
+
+class HoldingsIndex:
+    """
+    Обратный индекс card_id -> [(user_id, instance_id, rank, seen_at)] по всем
+    инвентарям, которые уже скачивали (свой, партнёров, участников клуба).
+    Пополняется из каждого разобранного ответа availableCardsLoad; полная
+    выгрузка инвентаря заменяет записи пользователя целиком (проданные карты
+    уходят). Хранится в SQLite (WAL) рядом с профилями, поэтому общий для
+    процессов шардированной кампании. Ответ индекса — подсказка: сеть нужна
+    только чтобы подтвердить экземпляр. Наблюдения из ответов копятся в памяти
+    и пишутся одной транзакцией (HOLDINGS_FLUSH_ROWS строк или раз в
+    HOLDINGS_FLUSH_SECONDS); чтение и прочие записи сначала сбрасывают буфер.
+    """
+
+    _UPSERT = (
+        "INSERT INTO holdings (user_id, inst, card_id, rank, seen_at) VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT(user_id, inst) DO UPDATE SET card_id = excluded.card_id,"
+        " rank = CASE WHEN excluded.rank != '' THEN excluded.rank ELSE rank END, seen_at = excluded.seen_at"
+    )
+
+    def __init__(self, path: Optional[pathlib.Path] = None) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(str(path) if path else ":memory:", timeout=30, isolation_level=None, check_same_thread=False)
+        if path:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[int, int, int, str, int]] = []
+        self._flushed_at = time.monotonic()
+
+    @classmethod
+    def open(cls, profiles_dir: pathlib.Path) -> "HoldingsIndex":
+        return cls(profiles_dir / HOLDINGS_FILE)
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            self.conn.close()
+
+    def _write(self, statements: Iterable[Tuple[str, Any]]) -> None:
+        with self._lock:
+            self._write_locked(list(statements))
+
+    def _write_locked(self, statements: List[Tuple[str, Any]]) -> None:
+        if self._pending:
+            statements.insert(0, (self._UPSERT, self._pending))
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    self.conn.executemany(sql, params)
+                else:
+                    self.conn.execute(sql, params)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def _flush_locked(self) -> None:
+        if self._pending:
+            self._write_locked([])
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    @staticmethod
+    def _rows(user_id: int, entries: Iterable[Dict[str, Any]], now: int) -> List[Tuple[int, int, int, str, int]]:
+        rows = []
+        for c in entries:
+            if not isinstance(c, dict):
+                continue
+            cid, inst = entry_card_id(c), entry_instance_id(c)
+            if cid and inst:
+                rows.append((int(user_id), int(inst), int(cid), _entry_rank(c), now))
+        return rows
+
+    def observe(self, user_id: int, entries: Iterable[Dict[str, Any]]) -> int:
+        """Карты из ответа (страница, поиск) — добавляются/освежаются, остальные записи не трогаются."""
+        rows = self._rows(user_id, entries, int(time.time()))
+        if rows:
+            with self._lock:
+                self._pending.extend(rows)
+                if len(self._pending) >= HOLDINGS_FLUSH_ROWS or time.monotonic() - self._flushed_at >= HOLDINGS_FLUSH_SECONDS:
+                    self._write_locked([])
+        return len(rows)
+
+    def replace_user(self, user_id: int, holdings: Iterable[Tuple[int, int, str]]) -> int:
+        """Полный снимок инвентаря (card_id, instance_id, rank): всё, чего в нём нет, удаляется."""
+        now = int(time.time())
+        rows = [(int(user_id), int(inst), int(cid), rank or "", now) for cid, inst, rank in holdings if cid and inst]
+        self._write([
+            ("DELETE FROM holdings WHERE user_id = ?", (int(user_id),)),
+            ("INSERT OR REPLACE INTO holdings (user_id, inst, card_id, rank, seen_at) VALUES (?, ?, ?, ?, ?)", rows),
+            ("INSERT OR REPLACE INTO synced (user_id, synced_at) VALUES (?, ?)", (int(user_id), now)),
+        ])
+        return len(rows)
+
+    def forget(self, user_id: int, inst: int) -> None:
+        """Экземпляр не подтвердился — больше его не предлагаем."""
+        self._write([("DELETE FROM holdings WHERE user_id = ? AND inst = ?", (int(user_id), int(inst)))])
+
+    def holders(self, card_id: int, max_age: Optional[float] = HOLDINGS_MAX_AGE, limit: int = 100) -> List[Holding]:
+        """Известные владельцы карты, свежие первыми: (user_id, instance_id, rank, seen_at)."""
+        since = int(time.time() - max_age) if max_age else 0
+        with self._lock:
+            self._flush_locked()
+            return [tuple(r) for r in self.conn.execute(
+                "SELECT user_id, inst, rank, seen_at FROM holdings WHERE card_id = ? AND seen_at >= ?"
+                " ORDER BY seen_at DESC LIMIT ?",
+                (int(card_id), since, int(limit)),
+            )]
+
+    def instances(self, user_id: int, card_ids: Iterable[int], max_age: Optional[float] = HOLDINGS_MAX_AGE) -> Dict[int, int]:
+        """card_id -> instance_id для карт, которые пользователь держал по последним данным."""
+        ids = [int(c) for c in card_ids]
+        if not ids:
+            return {}
+        since = int(time.time() - max_age) if max_age else 0
+        out: Dict[int, int] = {}
+        with self._lock:
+            self._flush_locked()
+            for cid, inst in self.conn.execute(
+                f"SELECT card_id, inst FROM holdings WHERE user_id = ? AND seen_at >= ? AND card_id IN ({','.join('?' for _ in ids)})"
+                " ORDER BY seen_at DESC",
+                [int(user_id), since, *ids],
+            ):
+                out.setdefault(cid, inst)
+        return out
+
+    def synced_at(self, user_id: int) -> int:
+        """Когда инвентарь пользователя последний раз выгружался целиком (replace_user); 0 — никогда."""
+        with self._lock:
+            row = self.conn.execute("SELECT synced_at FROM synced WHERE user_id = ?", (int(user_id),)).fetchone()
+        return int(row[0]) if row else 0
+
+
+_active: Optional[HoldingsIndex] = None
+
+
+def set_active_holdings(index: Optional[HoldingsIndex]) -> None:
+    global _active
+    _active = index
+
+
+def active_holdings() -> Optional[HoldingsIndex]:
+    return _active
+
+
+def observe_holdings(user_id: Any, entries: Iterable[Dict[str, Any]]) -> None:
+    if _active is None or not entries:
+        return
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return
+    try:
+        _active.observe(uid, entries)
+    except sqlite3.Error:
+        # индекс — только подсказка, рассылку из-за него не роняем
+        pass
+
+
+def forget_holding(user_id: Any, inst: Any) -> None:
+    if _active is None:
+        return
+    try:
+        _active.forget(int(user_id), int(inst))
+    except (TypeError, ValueError, sqlite3.Error):
+        pass
@@ -1,90 +1,322 @@
+import concurrent.futures
 import json
 import pathlib
+import sqlite3
 import time
-from typing import Dict, Tuple
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Generator, List, Optional, Tuple
 
 import requests
 
-from mangabuff.config import BASE_URL, CONNECT_TIMEOUT, READ_TIMEOUT, HUGE_LIST_THRESHOLD
+from mangabuff.config import BASE_URL, CONNECT_TIMEOUT, READ_TIMEOUT, HUGE_LIST_THRESHOLD, INVENTORY_KNOWN_RUN, INVENTORY_FULL_SYNC_MAX_AGE, INVENTORY_FETCH_WINDOW
 from mangabuff.http.http_utils import build_session_from_profile, post
-from mangabuff.parsing.cards import parse_trade_cards_html, normalize_card_entry
+from mangabuff.http.pagesize import page_tuner
+from mangabuff.parsing.cards import normalize_card_entry, entry_instance_id
+from mangabuff.parsing.pool import active_parse_executor, parse_cards
+from mangabuff.services.cardfile import CardFile, CardFileWriter, inventory_path
+from mangabuff.services.catalog import active_catalog, observe_cards
+from mangabuff.services.holdings import active_holdings
 
-def fetch_all_cards_by_id(profile_data: Dict, profiles_dir: pathlib.Path, user_id: str, page_size_hint: int = 60, max_pages: int = 500, debug: bool = False) -> Tuple[pathlib.Path, bool]:
-    session = build_session_from_profile(profile_data)
+class InventoryIncomplete(RuntimeError):
+    """Обход инвентаря оборвался на ошибке (сеть, статус, неразборчивый ответ), а не на последней странице."""
 
-    all_cards = []
+def _request_page(session: requests.Session, url: str, user_id: str, offset: int, limit: int) -> requests.Response:
+    return post(
+        session,
+        url,
+        headers={
+            "Referer": f"{BASE_URL}/trades/{user_id}",
+            "Origin": BASE_URL,
+            "X-Requested-With": "XMLHttpRequest",
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "Accept": "application/json, text/javascript, */*; q=0.01",
+        },
+        data={"offset": offset, "limit": limit},
+        hedge=True,
+    )
+
+def _page_cards(resp: requests.Response, user_id: str, debug: bool = False, parse: Callable[..., List[Dict[str, Any]]] = parse_cards) -> Optional[List[Dict[str, Any]]]:
+    """
+    Карты страницы ([] — пустая страница); None — ответ не разобрать, дальше не читаем.
+    parse — разбор HTML (в окне — через пул процессов).
+    """
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {"cards": parse(resp.content, resp.encoding)}
+    if not isinstance(data, dict):
+        return None
+
+    cards = data.get("cards", [])
+    if not cards:
+        return []
+    if isinstance(cards, list) and len(cards) > HUGE_LIST_THRESHOLD:
+        if debug:
+            print(f"[INV] too big list {len(cards)} for {user_id}")
+        return None
+    if isinstance(cards, str):
+        return parse(cards) or None
+    if isinstance(cards, list):
+        return [normalize_card_entry(c) for c in cards]
+    return None
+
+def _iter_window(session: requests.Session, url: str, user_id: str, offset: int, limit: int, max_pages: int, debug: bool = False) -> Generator[List[Dict[str, Any]], None, Tuple[int, int, bool]]:
+    """
+    Размер страницы известен — держим INVENTORY_FETCH_WINDOW запросов со смещениями
+    offset, offset+limit, ... одновременно и отдаём страницы по порядку до первой
+    короткой. Поток загрузки сам и разбирает свою страницу (HTML — в пуле
+    процессов, если он есть), так что разбор идёт внахлёст с остальными запросами.
+    Темп задаёт общий RateLimiter. Возвращает (offset, страниц, готово);
+    при ошибке готово=False — дальше читаем последовательно с offset.
+    """
+    tuner = page_tuner()
+    executor = active_parse_executor()
+    parse = executor.parse_cards if executor is not None else parse_cards
+
+    def fetch(at: int) -> Tuple[requests.Response, Optional[List[Dict[str, Any]]]]:
+        resp = _request_page(session, url, user_id, at, limit)
+        cards = _page_cards(resp, user_id, debug=debug, parse=parse) if resp.status_code == 200 else None
+        return resp, cards
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=INVENTORY_FETCH_WINDOW, thread_name_prefix="mangabuff-inv")
+    inflight: Deque[Tuple[int, concurrent.futures.Future]] = deque()
+    ahead = offset
+    pages = 0
+    try:
+        while True:
+            while len(inflight) < INVENTORY_FETCH_WINDOW and pages + len(inflight) < max_pages:
+                inflight.append((ahead, pool.submit(fetch, ahead)))
+                ahead += limit
+            if not inflight:
+                return offset, pages, True
+            at, fut = inflight.popleft()
+            try:
+                resp, cards = fut.result()
+            except requests.RequestException as e:
+                if debug:
+                    print(f"[INV] request error offset={at}: {e}")
+                return at, pages, False
+            if resp.status_code != 200:
+                if debug:
+                    print(f"[INV] status {resp.status_code} offset={at} limit={limit}")
+                return at, pages, False
+            if cards is None:
+                return at, pages, False
+            got = len(cards)
+            if got:
+                observe_cards(cards)
+                yield cards
+                pages += 1
+            offset = at + got
+            more = tuner.record("POST", url, limit, got, len(resp.content))
+            if debug:
+                print(f"[INV] offset={offset} limit={limit} got={got} in flight={len(inflight)}")
+            if not more or got < limit:
+                return offset, pages, True
+    finally:
+        # страницы за последней короткой никому не нужны
+        for _, fut in inflight:
+            fut.cancel()
+        pool.shutdown(wait=False)
+
+def _iter_inventory_pages(session: requests.Session, user_id: str, max_pages: int = 500, debug: bool = False) -> Generator[List[Dict[str, Any]], None, None]:
+    """Страницы инвентаря до последней; обрыв на ошибке — InventoryIncomplete."""
     offset = 0
     pages = 0
+    url = f"{BASE_URL}/trades/{user_id}/availableCardsLoad"
+    tuner = page_tuner()
+    windowed = INVENTORY_FETCH_WINDOW > 1
 
     while True:
-        url = f"{BASE_URL}/trades/{user_id}/availableCardsLoad"
-        payload = {"offset": offset}
+        settled = tuner.settled_limit("POST", url) if windowed else 0
+        if settled:
+            offset, got_pages, done = yield from _iter_window(session, url, user_id, offset, settled, max_pages - pages, debug=debug)
+            pages += got_pages
+            if done or pages >= max_pages:
+                break
+            # ошибка в окне — дальше последовательно, с уменьшением limit при необходимости
+            windowed = False
+
+        limit = tuner.next_limit("POST", url)
         try:
-            resp = post(
-                session,
-                url,
-                headers={
-                    "Referer": f"{BASE_URL}/trades/{user_id}",
-                    "Origin": BASE_URL,
-                    "X-Requested-With": "XMLHttpRequest",
-                    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-                    "Accept": "application/json, text/javascript, */*; q=0.01",
-                },
-                data=payload,
-            )
+            resp = _request_page(session, url, user_id, offset, limit)
         except requests.RequestException as e:
-            if debug:
-                print(f"[INV] request error offset={offset}: {e}")
-            break
+            raise InventoryIncomplete(f"request error offset={offset}: {e}") from e
 
         if resp.status_code != 200:
             if debug:
-                print(f"[INV] status {resp.status_code} offset={offset}")
-            break
-
-        try:
-            data = resp.json()
-        except ValueError:
-            data = {"cards": parse_trade_cards_html(resp.text)}
+                print(f"[INV] status {resp.status_code} offset={offset} limit={limit}")
+            if limit > tuner.default and resp.status_code != 429:
+                if resp.status_code == 413 or tuner.failed("POST", url, limit):
+                    # сервер не принимает такой limit (413 или ошибка повторилась) — повторяем с меньшим
+                    tuner.shrink("POST", url, limit)
+                # разовая 5xx — повтор с тем же limit
+                continue
+            raise InventoryIncomplete(f"status {resp.status_code} offset={offset}")
 
-        cards = data.get("cards", [])
+        cards = _page_cards(resp, user_id, debug=debug)
+        if cards is None:
+            raise InventoryIncomplete(f"unreadable page offset={offset}")
         if not cards:
+            tuner.record("POST", url, limit, 0)
             break
+        observe_cards(cards)
+        yield cards
+        got = len(cards)
 
-        if isinstance(cards, list) and len(cards) > HUGE_LIST_THRESHOLD:
-            if debug:
-                print(f"[INV] too big list {len(cards)} for {user_id}")
+        offset += got
+        pages += 1
+        more = tuner.record("POST", url, limit, got, len(resp.content))
+        if debug:
+            print(f"[INV] offset={offset} limit={limit} got={got}")
+        if not more or pages >= max_pages:
             break
 
-        if isinstance(cards, str):
-            parsed = parse_trade_cards_html(cards)
-            if parsed:
-                all_cards.extend(parsed)
-            else:
+        time.sleep(0.25)
+
+def _meta_path(cards_path: pathlib.Path) -> pathlib.Path:
+    return cards_path.with_suffix(".meta.json")
+
+def _load_snapshot(cards_path: pathlib.Path) -> Tuple[Optional[CardFile], Dict[str, Any]]:
+    try:
+        previous = CardFile(cards_path)
+    except OSError:
+        return None, {}
+    try:
+        with _meta_path(cards_path).open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except Exception:
+        meta = {}
+    return previous, meta if isinstance(meta, dict) else {}
+
+def snapshot_delta_syncable(profiles_dir: pathlib.Path, user_id: str) -> bool:
+    """Снимок инвентаря есть и досинхронизируется дельтой (без полной выгрузки)."""
+    cards_path = inventory_path(profiles_dir, user_id)
+    previous, meta = _load_snapshot(cards_path)
+    if previous is None:
+        return False
+    try:
+        return bool(len(previous)) and time.time() - float(meta.get("full_sync_at") or 0) < INVENTORY_FULL_SYNC_MAX_AGE
+    finally:
+        previous.close()
+
+def _delta_sync(pages: Generator[List[Dict[str, Any]], None, None], previous: CardFile, known_run: int, writer: CardFileWriter, debug: bool = False) -> None:
+    """
+    Инвентарь отдаётся от новых карт к старым: читаем с offset=0, пока не встретим
+    known_run подряд уже известных экземпляров, и пришиваем хвост прошлого снимка
+    (строки копируются из файла как есть, по индексу). Удаления сверяются только
+    в перекрытом окне; остальное — при полной синхронизации. Обход оборвался на
+    ошибке — хвост пришивается так же, с места, до которого дочитали.
+    """
+    prev_pos: Dict[int, int] = {}
+    for i, inst in enumerate(previous.inst_ids):
+        if inst and inst not in prev_pos:
+            prev_pos[inst] = i
+
+    window_ids = set()
+    run = 0
+    last_known = -1
+    try:
+        for cards in pages:
+            for c in cards:
+                writer.write(c)
+                inst = entry_instance_id(c) or 0
+                window_ids.add(inst)
+                pos = prev_pos.get(inst)
+                if pos is None:
+                    run = 0
+                    continue
+                run += 1
+                last_known = max(last_known, pos)
+            writer.flush()
+            if run >= known_run:
+                pages.close()
                 break
-        elif isinstance(cards, list):
-            norm = [normalize_card_entry(c) for c in cards]
-            all_cards.extend(norm)
         else:
-            break
+            # дошли до конца инвентаря — окно и есть полный снимок
+            return
+    except InventoryIncomplete as e:
+        if debug:
+            print(f"[INV] delta interrupted ({e}), keeping snapshot tail")
 
-        offset += len(cards) if isinstance(cards, list) else page_size_hint
-        pages += 1
-        if (isinstance(cards, list) and len(cards) < page_size_hint) or pages >= max_pages:
-            break
+    fresh = sum(1 for inst in window_ids if inst not in prev_pos)
+    removed = sum(1 for inst in previous.inst_ids[:last_known + 1] if inst not in window_ids)
+    kept = 0
+    for i in range(last_known + 1, len(previous)):
+        if previous.inst_ids[i] not in window_ids:
+            writer.write_raw(previous.raw(i), previous.card_ids[i], previous.inst_ids[i])
+            kept += 1
+    if debug:
+        print(f"[INV] delta: {fresh} new, {removed} removed, {kept} kept from snapshot")
 
-        time.sleep(0.25)
+def _index_holdings(user_id: str, cards_path: pathlib.Path) -> None:
+    """Готовый снимок инвентаря заменяет записи пользователя в индексе владельцев."""
+    index = active_holdings()
+    if index is None:
+        return
+    catalog = active_catalog()
+    try:
+        with CardFile(cards_path) as cf:
+            rows = [(cid, inst, catalog.rank_for(cid) if catalog is not None else "") for cid, inst in zip(cf.card_ids, cf.inst_ids)]
+        index.replace_user(int(user_id), rows)
+    except (OSError, ValueError, sqlite3.Error):
+        pass
+
+def fetch_all_cards_by_id(profile_data: Dict, profiles_dir: pathlib.Path, user_id: str, max_pages: int = 500, debug: bool = False, incremental: bool = False, session: Optional[requests.Session] = None) -> Tuple[pathlib.Path, bool]:
+    """
+    Инвентарь пишется в NDJSON по мере прихода страниц (см. services/cardfile.py);
+    файл и индекс подменяются после последней страницы.
+    """
+    session = session or build_session_from_profile(profile_data)
+    cards_path = inventory_path(profiles_dir, user_id)
+    pages = _iter_inventory_pages(session, user_id, max_pages=max_pages, debug=debug)
+
+    previous, meta = _load_snapshot(cards_path) if incremental else (None, {})
+    full_sync_at = float(meta.get("full_sync_at") or 0)
+    writer = CardFileWriter(cards_path)
+    complete = True
+    try:
+        if previous is not None and len(previous) and time.time() - full_sync_at < INVENTORY_FULL_SYNC_MAX_AGE:
+            _delta_sync(pages, previous, INVENTORY_KNOWN_RUN, writer, debug=debug)
+        else:
+            try:
+                for cards in pages:
+                    for c in cards:
+                        writer.write(c)
+                    writer.flush()
+                full_sync_at = time.time()
+            except InventoryIncomplete as e:
+                if debug:
+                    print(f"[INV] full sync interrupted: {e}")
+                complete = False
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if previous is not None:
+            previous.close()
+
+    if not complete and cards_path.exists():
+        # оборванная полная выгрузка не заменяет прошлый снимок
+        writer.abort()
+        try:
+            with CardFile(cards_path) as cf:
+                return cards_path, bool(len(cf))
+        except (OSError, ValueError):
+            return cards_path, False
 
-    cards_path = profiles_dir / f"{user_id}.json"
-    with cards_path.open("w", encoding="utf-8") as f:
-        json.dump(all_cards, f, ensure_ascii=False, indent=4)
-    return cards_path, bool(all_cards)
+    writer.finish()
+    if complete:
+        _index_holdings(user_id, cards_path)
+    with _meta_path(cards_path).open("w", encoding="utf-8") as f:
+        json.dump({"full_sync_at": full_sync_at, "count": len(writer)}, f)
+    return cards_path, bool(len(writer))
 
-def ensure_own_inventory(profile_path: pathlib.Path, profile_data: Dict, debug: bool = False) -> pathlib.Path:
+def ensure_own_inventory(profile_path: pathlib.Path, profile_data: Dict, debug: bool = False, incremental: bool = True) -> pathlib.Path:
     my_id = profile_data.get("id") or profile_data.get("ID") or profile_data.get("user_id")
     if not my_id:
         raise RuntimeError("no user id in profile")
-    cards_path, got = fetch_all_cards_by_id(profile_data, profile_path.parent, str(my_id), debug=debug)
+    cards_path, got = fetch_all_cards_by_id(profile_data, profile_path.parent, str(my_id), debug=debug, incremental=incremental)
     if not got:
         raise RuntimeError("inventory empty")
-    return cards_path
\ No newline at end of file
+    return cards_path
@@ -0,0 +1,173 @@
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from mangabuff.config import TRADE_KEEP_COPIES
+from mangabuff.parsing.cards import entry_card_id, entry_instance_id
+
+
+def _card_rank(c: Dict[str, Any]) -> str:
+    rank = c.get("rank") or c.get("grade") or ""
+    inner = c.get("card")
+    if not rank and isinstance(inner, dict):
+        rank = inner.get("rank") or ""
+    return str(rank).strip()
+
+
+class InstancePool:
+    """
+    Мои экземпляры, сгруппированные по рангу и card_id.
+    Резерв держится на всё время кампании: один экземпляр не уходит двум партнёрам.
+    Первыми отдаются настоящие дубликаты — card_id, которых осталось больше всего копий,
+    единственные экземпляры — последними. keep копий каждой карты не отдаются никогда
+    (по умолчанию 0; MANGABUFF_TRADE_KEEP_COPIES=1 — отдавать только дубликаты).
+    """
+    def __init__(self, my_cards: List[Dict[str, Any]], keep: int = TRADE_KEEP_COPIES) -> None:
+        self.keep = max(0, keep)
+        self._free: Dict[str, Dict[int, List[int]]] = {}
+        self._owner: Dict[int, Tuple[str, int]] = {}
+        self.reserved: Dict[int, Tuple[str, int]] = {}
+        seen = set()
+        for c in my_cards:
+            inst = entry_instance_id(c)
+            if not inst or inst in seen:
+                continue
+            seen.add(inst)
+            rank = _card_rank(c)
+            cid = entry_card_id(c) or 0
+            self._free.setdefault(rank, {}).setdefault(cid, []).append(inst)
+            self._owner[inst] = (rank, cid)
+
+    def __len__(self) -> int:
+        return sum(self.available(r) for r in self._free)
+
+    def ranks(self) -> List[str]:
+        return list(self._free)
+
+    def has_rank(self, rank: str) -> bool:
+        return rank in self._free
+
+    def available(self, rank: str) -> int:
+        return sum(max(0, len(v) - self.keep) for v in self._free.get(rank, {}).values())
+
+    def reserve(self, rank: str) -> Optional[int]:
+        by_card = self._free.get(rank) or {}
+        best_cid = None
+        best_cnt = self.keep
+        for cid, insts in by_card.items():
+            if len(insts) > best_cnt:
+                best_cid, best_cnt = cid, len(insts)
+        if best_cid is None:
+            return None
+        inst = by_card[best_cid].pop()
+        if not by_card[best_cid]:
+            del by_card[best_cid]
+        self.reserved[inst] = (rank, best_cid)
+        return inst
+
+    def take(self, inst: int) -> bool:
+        """
+        Резервирует конкретный экземпляр (восстановление резерва из чекпоинта).
+        Как и reserve, не трогает keep последних копий: такой экземпляр остаётся
+        в пуле, но available() его всё равно не отдаст.
+        """
+        key = self._owner.get(inst)
+        if key is None or inst in self.reserved:
+            return False
+        rank, cid = key
+        insts = self._free.get(rank, {}).get(cid) or []
+        if inst not in insts or len(insts) <= self.keep:
+            return False
+        insts.remove(inst)
+        if not insts:
+            del self._free[rank][cid]
+        self.reserved[inst] = key
+        return True
+
+    def release(self, inst: int) -> None:
+        key = self.reserved.pop(inst, None)
+        if key is None:
+            return
+        rank, cid = key
+        self._free.setdefault(rank, {}).setdefault(cid, []).append(inst)
+
+
+def _max_flow(graph: Dict[Any, Dict[Any, int]], source: Any, sink: Any) -> Dict[Any, Dict[Any, int]]:
+    residual: Dict[Any, Dict[Any, int]] = {}
+    for u, edges in graph.items():
+        for v, cap in edges.items():
+            residual.setdefault(u, {})[v] = residual.get(u, {}).get(v, 0) + cap
+            residual.setdefault(v, {}).setdefault(u, 0)
+
+    while True:
+        parent: Dict[Any, Any] = {source: None}
+        q = deque([source])
+        while q and sink not in parent:
+            u = q.popleft()
+            for v, cap in residual.get(u, {}).items():
+                if cap > 0 and v not in parent:
+                    parent[v] = u
+                    q.append(v)
+        if sink not in parent:
+            break
+        bottleneck = None
+        v = sink
+        while parent[v] is not None:
+            u = parent[v]
+            bottleneck = residual[u][v] if bottleneck is None else min(bottleneck, residual[u][v])
+            v = u
+        v = sink
+        while parent[v] is not None:
+            u = parent[v]
+            residual[u][v] -= bottleneck
+            residual[v][u] += bottleneck
+            v = u
+
+    flow: Dict[Any, Dict[Any, int]] = {}
+    for u, edges in graph.items():
+        for v, cap in edges.items():
+            used = cap - residual[u][v]
+            if used > 0:
+                flow.setdefault(u, {})[v] = used
+    return flow
+
+
+def assign_offers(
+    candidates: Dict[int, List[Dict[str, Any]]],
+    pool: InstancePool,
+    per_partner: int = 1,
+) -> Dict[int, List[Tuple[Dict[str, Any], int]]]:
+    """
+    Назначает мои экземпляры слотам партнёров (slot = {"card_id", "rank", "his_inst"}),
+    максимизируя число назначений при не более per_partner слотов на партнёра.
+    Двудольное сопоставление сводится к потоку partner -> slot -> rank -> sink,
+    где пропускная способность ранга — число свободных экземпляров в пуле.
+    Ранг без единого моего экземпляра допускает любой ранг, как и раньше.
+    """
+    source, sink = ("src",), ("sink",)
+    graph: Dict[Any, Dict[Any, int]] = {source: {}}
+    for pid, slots in candidates.items():
+        if not slots:
+            continue
+        pnode = ("p", pid)
+        graph[source][pnode] = max(1, per_partner)
+        graph[pnode] = {}
+        for i, slot in enumerate(slots):
+            snode = ("s", pid, i)
+            graph[pnode][snode] = 1
+            rank = (slot.get("rank") or "").strip()
+            ranks = [rank] if pool.has_rank(rank) else pool.ranks()
+            graph[snode] = {("r", r): 1 for r in ranks if pool.available(r)}
+    for r in pool.ranks():
+        if pool.available(r):
+            graph[("r", r)] = {sink: pool.available(r)}
+
+    flow = _max_flow(graph, source, sink)
+    out: Dict[int, List[Tuple[Dict[str, Any], int]]] = {}
+    for pid, slots in candidates.items():
+        for snode in flow.get(("p", pid), {}):
+            slot = slots[snode[2]]
+            rnode = next(iter(flow.get(snode, {})))
+            inst = pool.reserve(rnode[1])
+            if inst:
+                out.setdefault(pid, []).append((slot, inst))
+    return out
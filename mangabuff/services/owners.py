@@ -1,14 +1,16 @@
 import re
 import time
-from typing import List, Generator, Tuple, Dict
+from typing import Any, Callable, List, Generator, Tuple, Dict, Optional
 
 import requests
 from bs4 import BeautifulSoup
 
 from mangabuff.config import BASE_URL
-from mangabuff.http.http_utils import build_session_from_profile, get
+from mangabuff.http.http_utils import build_session_from_profile, coalesce, get
+from mangabuff.parsing.pool import ParseExecutor, active_parse_executor
+from mangabuff.utils.idset import IdSet
 from mangabuff.utils.text import safe_int
-from mangabuff.utils.html import with_page, extract_last_page_number
+from mangabuff.utils.html import with_page, extract_last_page_number, select_any
 
 
 def parse_online_unlocked_owners(html: str) -> List[int]:
@@ -19,7 +21,7 @@ def parse_online_unlocked_owners(html: str) -> List[int]:
     """
     soup = BeautifulSoup(html or "", "html.parser")
     user_ids: List[int] = []
-    seen = set()
+    seen = IdSet()
 
     def cls_list(n):
         try:
@@ -114,45 +116,223 @@ def parse_online_unlocked_owners(html: str) -> List[int]:
     return user_ids
 
 
-def iter_online_owners_by_pages(
-    profile_data: Dict,
-    card_id: int,
+WANTERS_SELECTORS = [
+    "a.profile__friends-item",
+    'a[class*="profile__friends-item"]',
+    "a.profile_friends-item",
+    'a[class*="profile_friends-item"]',
+]
+
+
+def parse_wanters(html: str) -> List[int]:
+    """
+    Возвращает список user_id из страницы /cards/{id}/offers/want (кто хочет карту).
+    """
+    soup = BeautifulSoup(html or "", "html.parser")
+    user_ids: List[int] = []
+    seen = IdSet()
+    for a in select_any(soup, WANTERS_SELECTORS):
+        m = re.search(r"/users/(\d+)", a.get("href") or "")
+        uid = safe_int(m.group(1)) if m else None
+        if uid and uid not in seen:
+            seen.add(uid)
+            user_ids.append(uid)
+    return user_ids
+
+
+class OwnersWalkIncomplete(RuntimeError):
+    """Обход страниц пользователей оборвался на ошибке, не дойдя до последней страницы."""
+
+
+def _walk_stopped(strict: bool, tag: str, page: int, reason: str) -> None:
+    if strict:
+        raise OwnersWalkIncomplete(f"{tag} page {page}: {reason}")
+
+
+def _iter_user_pages(
+    session: requests.Session,
+    url: str,
+    parse: Callable[[str], List[int]],
     max_pages: int = 0,
-    debug: bool = False
+    debug: bool = False,
+    tag: str = "OWNERS",
+    start_page: int = 1,
+    strict: bool = False,
 ) -> Generator[Tuple[int, List[int]], None, None]:
     """
-    Итератор по страницам владельцев: на каждой странице отдаёт список user_id,
-    которые онлайн и без замка.
+    Страницы списка пользователей по порядку. strict=True — обрыв на ошибке
+    (сеть, не 200) поднимает OwnersWalkIncomplete, иначе обход просто заканчивается.
     """
-    session = build_session_from_profile(profile_data)
-    owners_url = f"{BASE_URL}/cards/{card_id}/users"
+    executor = active_parse_executor()
+    if executor is not None:
+        yield from _iter_user_pages_pooled(executor, session, url, parse, max_pages=max_pages, debug=debug, tag=tag, start_page=start_page, strict=strict)
+        return
 
+    # номер последней страницы есть в пагинации любой страницы — при продолжении с start_page первая не нужна
+    first = max(1, start_page)
+    if max_pages and first > max_pages:
+        return
     try:
-        r1 = get(session, with_page(owners_url, 1))
-    except requests.RequestException:
+        res1 = fetch_user_page(session, url, first, parse)
+    except requests.RequestException as e:
+        _walk_stopped(strict, tag, first, str(e))
         return
-    if r1.status_code != 200:
+    if res1 is None:
+        _walk_stopped(strict, tag, first, "bad status")
         return
 
-    soup1 = BeautifulSoup(r1.text or "", "html.parser")
-    last_page = extract_last_page_number(soup1)
+    users1, last_page = res1
     if max_pages and max_pages > 0:
         last_page = min(last_page, max_pages)
+    if debug:
+        print(f"[{tag}] page {first}: {len(users1)} users, last_page={last_page}")
+    yield first, users1
+
+    for p in range(first + 1, last_page + 1):
+        try:
+            res = fetch_user_page(session, url, p, parse, with_last_page=False)
+        except requests.RequestException as e:
+            _walk_stopped(strict, tag, p, str(e))
+            break
+        if res is None:
+            _walk_stopped(strict, tag, p, "bad status")
+            break
+        users_p = res[0]
+        if debug:
+            print(f"[{tag}] page {p}: {len(users_p)} users")
+        yield p, users_p
+        time.sleep(0.2)
 
-    owners1 = parse_online_unlocked_owners(r1.text)
+
+def _iter_user_pages_pooled(
+    executor: ParseExecutor,
+    session: requests.Session,
+    url: str,
+    parse: Callable[[str], List[int]],
+    max_pages: int = 0,
+    debug: bool = False,
+    tag: str = "OWNERS",
+    start_page: int = 1,
+    strict: bool = False,
+) -> Generator[Tuple[int, List[int]], None, None]:
+    """
+    То же, что _iter_user_pages, но страница p парсится в пуле, пока качается p+1:
+    сеть и парсинг идут внахлёст, порядок страниц сохраняется.
+    """
+    first = max(1, start_page)
+    if max_pages and first > max_pages:
+        return
+    try:
+        r1 = get(session, with_page(url, first))
+    except requests.RequestException as e:
+        _walk_stopped(strict, tag, first, str(e))
+        return
+    if r1.status_code != 200:
+        _walk_stopped(strict, tag, first, f"status {r1.status_code}")
+        return
+
+    users1, last_page = executor.submit_user_page(parse, r1.content, r1.encoding, with_last_page=True).result()
+    if max_pages and max_pages > 0:
+        last_page = min(last_page, max_pages)
     if debug:
-        print(f"[OWNERS] page 1: {len(owners1)} online unlocked, last_page={last_page}")
-    yield 1, owners1
+        print(f"[{tag}] page {first}: {len(users1)} users, last_page={last_page}")
+    yield first, users1
 
-    for p in range(2, last_page + 1):
+    pending: Optional[Tuple[int, Any]] = None
+    stopped: Optional[Tuple[int, str]] = None
+    for p in range(first + 1, last_page + 1):
         try:
-            rp = get(session, with_page(owners_url, p))
-        except requests.RequestException:
+            rp = get(session, with_page(url, p))
+        except requests.RequestException as e:
+            stopped = (p, str(e))
             break
         if rp.status_code != 200:
+            stopped = (p, f"status {rp.status_code}")
             break
-        owners_p = parse_online_unlocked_owners(rp.text)
-        if debug:
-            print(f"[OWNERS] page {p}: {len(owners_p)} online unlocked")
-        yield p, owners_p
-        time.sleep(0.2)
\ No newline at end of file
+        fut = executor.submit_user_page(parse, rp.content, rp.encoding)
+        if pending is not None:
+            yield _pending_result(pending, debug, tag)
+        pending = (p, fut)
+        time.sleep(0.2)
+    if pending is not None:
+        yield _pending_result(pending, debug, tag)
+    if stopped is not None:
+        # уже скачанная страница отдана выше — обрыв сообщается после неё
+        _walk_stopped(strict, tag, *stopped)
+
+
+def _pending_result(pending: Tuple[int, Any], debug: bool, tag: str) -> Tuple[int, List[int]]:
+    page, fut = pending
+    users = fut.result()[0]
+    if debug:
+        print(f"[{tag}] page {page}: {len(users)} users")
+    return page, users
+
+
+def fetch_user_page(
+    session: requests.Session,
+    url: str,
+    page: int,
+    parse: Callable[[str], List[int]],
+    with_last_page: bool = True,
+) -> Optional[Tuple[List[int], int]]:
+    """
+    Одна страница списка пользователей: (user_id, номер последней страницы) или None.
+    Одновременные запросы одной и той же страницы (разные цели/воркеры) сливаются
+    в один через single-flight. with_last_page=False — пагинация не разбирается (0).
+    """
+    page_url = with_page(url, page)
+    return coalesce(session, "GET", page_url, (parse.__name__, with_last_page), lambda: _load_user_page(session, page_url, parse, with_last_page))
+
+
+def _load_user_page(session: requests.Session, page_url: str, parse: Callable[[str], List[int]], with_last_page: bool) -> Optional[Tuple[List[int], int]]:
+    r = get(session, page_url)
+    if r.status_code != 200:
+        return None
+    executor = active_parse_executor()
+    if executor is not None:
+        users, last_page = executor.submit_user_page(parse, r.content, r.encoding, with_last_page=with_last_page).result()
+        return users, last_page or 0
+    last_page = extract_last_page_number(BeautifulSoup(r.text or "", "html.parser")) if with_last_page else 0
+    return parse(r.text), last_page
+
+
+def fetch_owners_page(session: requests.Session, card_id: int, page: int) -> Optional[Tuple[List[int], int]]:
+    return fetch_user_page(session, f"{BASE_URL}/cards/{card_id}/users", page, parse_online_unlocked_owners)
+
+
+def iter_online_owners_by_pages(
+    profile_data: Dict,
+    card_id: int,
+    max_pages: int = 0,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+    start_page: int = 1,
+    strict: bool = False,
+) -> Generator[Tuple[int, List[int]], None, None]:
+    """
+    Итератор по страницам владельцев: на каждой странице отдаёт список user_id,
+    которые онлайн и без замка.
+    Если передана session — используется она (долгоживущая сессия демона).
+    start_page > 1 — продолжение прерванной рассылки без повторного обхода начала.
+    strict=True — обрыв на ошибке поднимает OwnersWalkIncomplete (для чекпоинта
+    важно отличать его от последней страницы).
+    """
+    session = session or build_session_from_profile(profile_data)
+    owners_url = f"{BASE_URL}/cards/{card_id}/users"
+    yield from _iter_user_pages(session, owners_url, parse_online_unlocked_owners, max_pages=max_pages, debug=debug, tag="OWNERS", start_page=start_page, strict=strict)
+
+
+def iter_wanters_by_pages(
+    profile_data: Dict,
+    card_id: int,
+    max_pages: int = 0,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+) -> Generator[Tuple[int, List[int]], None, None]:
+    """
+    Итератор по страницам желающих получить карту (/cards/{id}/offers/want).
+    """
+    session = session or build_session_from_profile(profile_data)
+    want_url = f"{BASE_URL}/cards/{card_id}/offers/want"
+    yield from _iter_user_pages(session, want_url, parse_wanters, max_pages=max_pages, debug=debug, tag="WANTERS")
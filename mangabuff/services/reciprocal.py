@@ -0,0 +1,114 @@
+from collections import deque
+from typing import Any, Deque, Dict, Generator, List, Optional, Tuple
+
+import requests
+
+from mangabuff.config import RECIPROCAL_LOOKAHEAD, RECIPROCAL_MAX_CARDS, RECIPROCAL_WANTER_PAGES
+from mangabuff.http.http_utils import build_session_from_profile
+from mangabuff.parsing.cards import entry_card_id
+from mangabuff.services.owners import OwnersWalkIncomplete, iter_online_owners_by_pages, iter_wanters_by_pages
+from mangabuff.utils.idset import IdSet
+
+
+def duplicate_card_ids(my_cards: List[Dict[str, Any]], limit: int = RECIPROCAL_MAX_CARDS) -> List[int]:
+    counts: Dict[int, int] = {}
+    for c in my_cards:
+        cid = entry_card_id(c)
+        if cid:
+            counts[cid] = counts.get(cid, 0) + 1
+    dups = [cid for cid, n in sorted(counts.items(), key=lambda kv: kv[1], reverse=True) if n > 1]
+    return dups[:limit] if limit else dups
+
+
+def wanters_of_duplicates(
+    profile_data: Dict,
+    my_cards: List[Dict[str, Any]],
+    max_cards: int = RECIPROCAL_MAX_CARDS,
+    wanter_pages: int = RECIPROCAL_WANTER_PAGES,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+) -> Dict[int, List[int]]:
+    """
+    user_id -> [card_id наших дубликатов, которые он хочет]. Обходит только
+    страницы желающих (не больше max_cards x wanter_pages), владельцев не трогает.
+    """
+    session = session or build_session_from_profile(profile_data)
+    wants: Dict[int, List[int]] = {}
+    for dup_id in duplicate_card_ids(my_cards, limit=max_cards):
+        for _page, wanters in iter_wanters_by_pages(profile_data, dup_id, max_pages=wanter_pages, debug=debug, session=session):
+            for uid in wanters:
+                wants.setdefault(uid, []).append(dup_id)
+    if debug:
+        print(f"[RECIPROCAL] {len(wants)} users want our duplicates")
+    return wants
+
+
+def find_reciprocal_partners(
+    profile_data: Dict,
+    owners: List[int],
+    my_cards: List[Dict[str, Any]],
+    max_cards: int = RECIPROCAL_MAX_CARDS,
+    wanter_pages: int = RECIPROCAL_WANTER_PAGES,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+) -> List[Tuple[int, List[int]]]:
+    """
+    Пересекает владельцев целевой карты с желающими наших дубликатов.
+    Возвращает [(owner_id, [card_id наших дубликатов, которые он хочет])],
+    сначала те, кто хочет больше наших карт.
+    """
+    wants = wanters_of_duplicates(profile_data, my_cards, max_cards=max_cards, wanter_pages=wanter_pages, debug=debug, session=session)
+    owner_set = IdSet(owners)
+    return sorted(((uid, cards) for uid, cards in wants.items() if uid in owner_set), key=lambda kv: len(kv[1]), reverse=True)
+
+
+def iter_reciprocal_first(
+    profile_data: Dict,
+    card_id: int,
+    my_cards: List[Dict[str, Any]],
+    max_pages: int = 0,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+    start_page: int = 1,
+    lookahead: int = RECIPROCAL_LOOKAHEAD,
+    strict: bool = False,
+) -> Generator[Tuple[int, List[int]], None, None]:
+    """
+    Замена iter_online_owners_by_pages для рассылки. Желающие наших дубликатов
+    собираются заранее, владельцы читаются потоком: страница отдаётся, когда
+    прочитаны ещё lookahead страниц за ней, и в её начало подтягиваются
+    взаимные партнёры со всего окна (с последующих страниц они уже не отдаются).
+    Номера страниц — настоящие, поэтому чекпоинт и start_page работают как обычно.
+    strict — как у iter_online_owners_by_pages; прочитанное окно отдаётся до ошибки.
+    """
+    session = session or build_session_from_profile(profile_data)
+    wants = wanters_of_duplicates(profile_data, my_cards, debug=debug, session=session)
+    pages = iter_online_owners_by_pages(profile_data, card_id, max_pages=max_pages, debug=debug, session=session, start_page=start_page, strict=strict)
+    window: Deque[Tuple[int, List[int]]] = deque()
+    pulled = IdSet()
+
+    def emit() -> Tuple[int, List[int]]:
+        page_num, owners = window.popleft()
+        first: List[int] = []
+        for _p, ows in [(page_num, owners), *window]:
+            for uid in ows:
+                if uid in wants and uid not in pulled:
+                    pulled.add(uid)
+                    first.append(uid)
+        first.sort(key=lambda uid: len(wants[uid]), reverse=True)
+        rest = [uid for uid in owners if uid not in wants]
+        if debug and first:
+            print(f"[RECIPROCAL] page {page_num}: {len(first)} reciprocal owners first")
+        return page_num, first + rest
+
+    try:
+        for page in pages:
+            window.append(page)
+            if len(window) > max(0, lookahead):
+                yield emit()
+    except OwnersWalkIncomplete:
+        while window:
+            yield emit()
+        raise
+    while window:
+        yield emit()
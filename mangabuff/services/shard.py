@@ -0,0 +1,252 @@
+import json
+import multiprocessing
+import pathlib
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from mangabuff.config import BASE_URL, BREAKER_MAX_WAIT, RATE_LIMIT_BURST, RATE_LIMIT_RPS, SHARD_POLL_INTERVAL
+from mangabuff.http.http_utils import build_session_from_profile, wait_for_endpoint
+from mangabuff.http.ratelimit import RateLimiter, set_rate_limiter
+from mangabuff.profiles.store import ProfileStore
+from mangabuff.services.matching import InstancePool
+from mangabuff.services.owners import fetch_owners_page
+from mangabuff.services.trade import TradeSubmitter, find_partner_card_instance, send_offer
+from mangabuff.services.workqueue import WorkQueue
+
+
+def queue_path_for(profiles_dir: pathlib.Path, card_id: int) -> pathlib.Path:
+    return profiles_dir / f"campaign_{card_id}.queue.sqlite"
+
+
+def _account_id(profile: Dict) -> str:
+    return str(profile.get("id") or profile.get("ID") or profile.get("user_id") or "")
+
+
+def _load_cards(profile_path: pathlib.Path, profile: Dict, debug: bool = False) -> List[Dict[str, Any]]:
+    from mangabuff.services.cardfile import inventory_path, load_cards
+    from mangabuff.services.inventory import ensure_own_inventory
+    cards_path = inventory_path(profile_path.parent, _account_id(profile))
+    if not cards_path.exists():
+        cards_path = ensure_own_inventory(profile_path, profile, debug=debug)
+    return load_cards(cards_path)
+
+
+def _claim_instance(pool: InstancePool, queue: WorkQueue, account: str, rank: str, partner: int, worker: str) -> Optional[int]:
+    """Экземпляр под партнёра: резерв в локальном пуле + атомарная заявка в общей очереди."""
+    ranks = [rank] if pool.has_rank(rank) else pool.ranks()
+    for r in ranks:
+        while pool.available(r):
+            inst = pool.reserve(r)
+            if inst is None:
+                break
+            if queue.claim_instance(account, inst, partner, worker):
+                return inst
+            # экземпляр уже занял другой воркер того же аккаунта — остаётся вне пула
+    return None
+
+
+def run_worker(
+    queue_path: str,
+    profile_path: str,
+    target_card: Dict[str, Any],
+    worker: str,
+    dry_run: bool = True,
+    use_api: bool = True,
+    debug: bool = False,
+    credentials: Optional[Tuple[str, str]] = None,
+) -> Dict[str, int]:
+    """
+    Воркер шардированной кампании: берёт из очереди страницы владельцев и партнёров,
+    пока в очереди есть незавершённые задачи. Можно запускать отдельным процессом
+    на другом аккаунте (профиль должен быть уже авторизован). С credentials
+    (email, password) истёкшая сессия обновляется на лету. Лимит запросов
+    MANGABUFF_RATE_LIMIT_RPS делится поровну между воркерами кампании (число — в очереди).
+    """
+    path = pathlib.Path(profile_path)
+    store = ProfileStore(str(path.parent))
+    profile = store.read_by_path(path) or {}
+    if credentials:
+        from mangabuff.auth.refresh import SessionRefresher
+        SessionRefresher(profile, *credentials, on_refresh=lambda: store.write_by_path(path, profile), debug=debug).install()
+    account = _account_id(profile)
+    session = build_session_from_profile(profile)
+    # индекс владельцев в SQLite — общий для всех воркеров на этой машине
+    from mangabuff.services.holdings import HoldingsIndex, active_holdings, set_active_holdings
+    if active_holdings() is None:
+        set_active_holdings(HoldingsIndex.open(path.parent))
+    queue = WorkQueue(pathlib.Path(queue_path))
+    stats = {"pages": 0, "probed": 0, "sent": 0}
+    shares = max(1, int(queue.get_meta("workers", "1") or 1))
+    if RATE_LIMIT_RPS > 0 and shares > 1:
+        # сайт видит сумму всех воркеров, а не каждый процесс отдельно
+        set_rate_limiter(RateLimiter(RATE_LIMIT_RPS / shares, max(1.0, RATE_LIMIT_BURST / shares)))
+
+    accounts = set(json.loads(queue.get_meta("accounts", "[]") or "[]")) | {account}
+    pool = InstancePool(_load_cards(path, profile, debug=debug))
+    for inst in queue.reserved_instances(account):
+        pool.take(inst)
+
+    card_id = int(target_card.get("card_id") or target_card.get("cardId") or 0)
+    rank = (target_card.get("rank") or "").strip()
+    name = target_card.get("name") or ""
+    submitter = TradeSubmitter(session, use_api=use_api, debug=debug)
+
+    try:
+        while True:
+            task = queue.lease_next(worker)
+            if task is None:
+                if not queue.active():
+                    break
+                time.sleep(SHARD_POLL_INTERVAL)
+                continue
+
+            if task["kind"] == "page":
+                try:
+                    res = fetch_owners_page(session, card_id, int(task["key"]))
+                except requests.RequestException:
+                    res = None
+                if res is None:
+                    queue.retry(task["id"], worker)
+                    continue
+                owners = [uid for uid in res[0] if str(uid) not in accounts]
+                added = queue.add("partner", owners)
+                queue.complete(task["id"], worker, {"owners": len(owners)})
+                stats["pages"] += 1
+                if debug:
+                    print(f"[SHARD {worker}] page {task['key']}: {len(owners)} owners, {added} new")
+                time.sleep(0.2)
+                continue
+
+            owner_id = int(task["key"])
+            if not wait_for_endpoint("POST", f"{BASE_URL}/trades/{owner_id}/availableCardsLoad", max_wait=BREAKER_MAX_WAIT):
+                print(f"❌ [{worker}] availableCardsLoad недоступен, воркер остановлен")
+                queue.retry(task["id"], worker)
+                break
+            try:
+                his_inst = find_partner_card_instance(session, owner_id, "receiver", card_id, rank, name, debug=debug)
+            except requests.RequestException:
+                # в т.ч. CircuitOpenError посреди проверки: партнёр не проверен, задача возвращается в очередь
+                queue.retry(task["id"], worker)
+                continue
+            stats["probed"] += 1
+            if not his_inst:
+                queue.complete(task["id"], worker, {"probed": 1})
+                continue
+
+            my_inst = _claim_instance(pool, queue, account, rank, owner_id, worker)
+            if my_inst is None:
+                queue.complete(task["id"], worker, {"probed": 1, "found": 1, "skipped_no_free_instance": 1})
+                continue
+            if not queue.begin_send(task["id"], worker):
+                # аренда истекла и задачу уже взял другой воркер
+                queue.release_instance(account, my_inst)
+                pool.release(my_inst)
+                continue
+
+            ok = send_offer(session, owner_id, int(my_inst), int(his_inst), dry_run=dry_run, use_api=use_api, debug=debug, submitter=submitter)
+            if not ok and not dry_run:
+                queue.release_instance(account, my_inst)
+                pool.release(my_inst)
+            queue.complete(task["id"], worker, {"probed": 1, "found": 1, "trades_attempted": 1, "trades_succeeded": int(ok)})
+            stats["sent"] += int(ok)
+    finally:
+        queue.close()
+        # процесс воркера завершается без atexit — буфер индекса сбрасываем сами
+        index = active_holdings()
+        if index is not None:
+            index.flush()
+    return stats
+
+
+def seed_campaign(queue: WorkQueue, session: requests.Session, card_id: int, accounts: List[str], max_pages: int = 0) -> bool:
+    """
+    Заполняет очередь: первая страница владельцев разбирается сразу,
+    остальные страницы ставятся задачами. Повторный вызов для той же карты —
+    продолжение: уже существующие задачи не дублируются.
+    """
+    known = queue.get_meta("card_id")
+    if known is not None:
+        return known == str(card_id)
+    try:
+        res = fetch_owners_page(session, card_id, 1)
+    except requests.RequestException:
+        # таймаут или открытый автомат — как у воркера: очередь не заполнена, координатор сообщит
+        res = None
+    if res is None:
+        return False
+    owners, last_page = res
+    if max_pages and max_pages > 0:
+        last_page = min(last_page, max_pages)
+    queue.set_meta("accounts", json.dumps(accounts))
+    queue.add("partner", [uid for uid in owners if str(uid) not in accounts])
+    queue.add("page", range(2, last_page + 1))
+    queue.set_meta("card_id", str(card_id))
+    return True
+
+
+def run_sharded_campaign(
+    profile_data: Dict,
+    profile_paths: List[pathlib.Path],
+    target_card: Dict[str, Any],
+    queue_path: pathlib.Path,
+    workers: int = 0,
+    max_pages: int = 0,
+    dry_run: bool = True,
+    use_api: bool = True,
+    debug: bool = False,
+    credentials: Optional[Dict[str, Tuple[str, str]]] = None,
+) -> Dict[str, int]:
+    """
+    Координатор: заполняет очередь и запускает workers процессов (по умолчанию —
+    по одному на профиль). Воркеры распределяются по профилям по кругу; воркеры
+    одного аккаунта делят его инвентарь через таблицу резервов очереди.
+    credentials: путь профиля -> (email, password) для обновления сессии в воркерах.
+    """
+    card_id = int(target_card.get("card_id") or target_card.get("cardId") or 0)
+    store_accounts = []
+    for p in profile_paths:
+        prof = ProfileStore(str(p.parent)).read_by_path(p) or {}
+        store_accounts.append(_account_id(prof))
+
+    queue = WorkQueue(queue_path)
+    try:
+        if not seed_campaign(queue, build_session_from_profile(profile_data), card_id, store_accounts, max_pages=max_pages):
+            print(f"❌ Очередь {queue_path} не подходит для карты {card_id} или не удалось получить владельцев")
+            return {"seed_failed": 1}
+        count = max(1, workers or len(profile_paths))
+        queue.set_meta("workers", str(count))
+    finally:
+        queue.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = []
+    for i in range(count):
+        path = profile_paths[i % len(profile_paths)]
+        proc = ctx.Process(
+            target=run_worker,
+            kwargs={
+                "queue_path": str(queue_path),
+                "profile_path": str(path),
+                "target_card": target_card,
+                "worker": f"w{i}-{path.stem}",
+                "dry_run": dry_run,
+                "use_api": use_api,
+                "debug": debug,
+                "credentials": (credentials or {}).get(str(path)),
+            },
+            daemon=False,
+        )
+        proc.start()
+        procs.append(proc)
+    for proc in procs:
+        proc.join()
+
+    queue = WorkQueue(queue_path)
+    try:
+        stats = queue.summary()
+    finally:
+        queue.close()
+    stats["workers"] = len(procs)
+    return stats
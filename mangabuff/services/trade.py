@@ -1,46 +1,67 @@
 import json
 import random
+import re
+import sqlite3
+import threading
 import time
-from typing import Dict, List, Optional, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import requests
 
-from mangabuff.config import BASE_URL, CONNECT_TIMEOUT, READ_TIMEOUT, HUGE_LIST_THRESHOLD, MAX_CONTENT_BYTES, PARTNER_TIMEOUT_LIMIT
-from mangabuff.http.http_utils import build_session_from_profile, get, post, read_capped, decode_body_and_maybe_json
-from mangabuff.parsing.cards import parse_trade_cards_html, normalize_card_entry, entry_card_id, entry_instance_id
+from mangabuff.config import BASE_URL, CONNECT_TIMEOUT, READ_TIMEOUT, HUGE_LIST_THRESHOLD, HOLDINGS_MAX_AGE, MAX_CONTENT_BYTES, PARTNER_TIMEOUT_LIMIT, BREAKER_MAX_WAIT
+from mangabuff.http.http_utils import build_session_from_profile, coalesce, get, post, read_capped, decode_body_and_maybe_json, body_charset, CircuitOpenError, wait_for_endpoint
+from mangabuff.http.pagesize import page_tuner
+from mangabuff.parsing.cards import normalize_card_entry, entry_card_id, entry_instance_id
+from mangabuff.parsing.pool import parse_cards
+from mangabuff.utils.idset import IdSet
 from mangabuff.utils.text import norm_text
+from mangabuff.services.matching import InstancePool, assign_offers
+from mangabuff.services.catalog import active_catalog, observe_cards
+from mangabuff.services.checkpoint import CampaignCheckpoint
+from mangabuff.services.holdings import active_holdings, forget_holding, observe_holdings
+from mangabuff.services.owners import OwnersWalkIncomplete
 
 class PartnerState:
+    """Блокировки и счётчики таймаутов партнёров; общий для потоков клиента, поэтому под замком."""
     def __init__(self) -> None:
-        self.blocked = set()
+        self.blocked = IdSet()
         self.timeouts: Dict[int, int] = {}
+        self._lock = threading.Lock()
 
     def is_blocked(self, pid: int) -> bool:
-        return pid in self.blocked
+        with self._lock:
+            return pid in self.blocked
 
-    def mark_timeout(self, pid: int) -> None:
-        self.timeouts[pid] = self.timeouts.get(pid, 0) + 1
-        if self.timeouts[pid] >= PARTNER_TIMEOUT_LIMIT:
+    def block(self, pid: int) -> None:
+        with self._lock:
             self.blocked.add(pid)
             self.timeouts.pop(pid, None)
 
+    def mark_timeout(self, pid: int) -> None:
+        with self._lock:
+            self.timeouts[pid] = self.timeouts.get(pid, 0) + 1
+            if self.timeouts[pid] >= PARTNER_TIMEOUT_LIMIT:
+                self.blocked.add(pid)
+                self.timeouts.pop(pid, None)
+
     def clear_timeout(self, pid: int) -> None:
-        self.timeouts.pop(pid, None)
+        with self._lock:
+            self.timeouts.pop(pid, None)
 
 def _build_search_url(partner_id: int, offset: int, q: str) -> str:
     from urllib.parse import quote_plus
     return f"{BASE_URL}/search/cards?user_id={partner_id}&offset={offset}&q={quote_plus(q)}"
 
-def _parse_cards_from_text_or_json(text: str, j: Any) -> List[Dict[str, Any]]:
+def _parse_cards_from_body_or_json(body: Union[bytes, bytearray], encoding: str, j: Any) -> List[Dict[str, Any]]:
     if isinstance(j, dict):
         html_content = j.get("content") or j.get("html") or j.get("view")
         if isinstance(html_content, str):
-            return parse_trade_cards_html(html_content)
+            return parse_cards(html_content)
         cards = j.get("cards")
         if isinstance(cards, list):
             return [normalize_card_entry(c) for c in cards]
-    if text:
-        return parse_trade_cards_html(text)
+    if body and j is None:
+        return parse_cards(body, encoding)
     return []
 
 def _attempt_search(session: requests.Session, partner_state: PartnerState, partner_id: int, offset: int, q: str, debug: bool=False) -> List[Dict[str, Any]]:
@@ -48,7 +69,10 @@ def _attempt_search(session: requests.Session, partner_state: PartnerState, part
         return []
     url = _build_search_url(partner_id, offset, q)
     try:
-        r = get(session, url, stream=True)
+        r = get(session, url, hedge=True, stream=True)
+    except CircuitOpenError:
+        # «эндпоинт лежит» — не то же самое, что «у партнёра нет карты»: решает вызывающий
+        raise
     except requests.exceptions.ReadTimeout:
         partner_state.mark_timeout(partner_id)
         return []
@@ -64,21 +88,27 @@ def _attempt_search(session: requests.Session, partner_state: PartnerState, part
 
     content, too_big = read_capped(r)
     if too_big:
-        partner_state.blocked.add(partner_id)
-        partner_state.timeouts.pop(partner_id, None)
+        partner_state.block(partner_id)
         return []
 
-    text, j = decode_body_and_maybe_json(content or b"", r.headers)
-    cards = _parse_cards_from_text_or_json(text, j)
+    _text, j = decode_body_and_maybe_json(content or b"", r.headers, want_text=False)
+    cards = _parse_cards_from_body_or_json(content or b"", body_charset(r.headers), j)
     if isinstance(j, dict) and isinstance(j.get("cards"), list):
         if len(j["cards"]) > HUGE_LIST_THRESHOLD:
-            partner_state.blocked.add(partner_id)
+            partner_state.block(partner_id)
             return []
     return cards
 
 def _attempt_ajax(session: requests.Session, partner_state: PartnerState, partner_id: int, side: str, rank: Optional[str], search: Optional[str], offset: int, debug: bool=False) -> List[Dict[str, Any]]:
     if partner_state.is_blocked(partner_id):
         return []
+    # одинаковый запрос карт партнёра из разных целей/потоков уходит один раз
+    return coalesce(
+        session, "POST", f"{BASE_URL}/trades/{partner_id}/availableCardsLoad", (side, rank, search, offset),
+        lambda: _load_ajax(session, partner_state, partner_id, side, rank, search, offset, debug=debug),
+    )
+
+def _load_ajax(session: requests.Session, partner_state: PartnerState, partner_id: int, side: str, rank: Optional[str], search: Optional[str], offset: int, debug: bool=False) -> List[Dict[str, Any]]:
 
     url = f"{BASE_URL}/trades/{partner_id}/availableCardsLoad"
     headers = {
@@ -91,7 +121,10 @@ def _attempt_ajax(session: requests.Session, partner_state: PartnerState, partne
     if "X-CSRF-TOKEN" in session.headers:
         headers["X-CSRF-TOKEN"] = session.headers["X-CSRF-TOKEN"]
 
-    small_limit = 60
+    tuner = page_tuner()
+    # с фильтром сервер отдаёт короткие страницы — это не повод менять limit полного обхода
+    kind = "filtered" if rank or search else ""
+    small_limit = tuner.next_limit("POST", url, kind=kind)
     attempts: List[Dict[str, Any]] = []
 
     if rank and search:
@@ -121,7 +154,11 @@ def _attempt_ajax(session: requests.Session, partner_state: PartnerState, partne
 
     for payload in attempts:
         try:
-            resp = post(session, url, headers=headers, data=payload, stream=True)
+            resp = post(session, url, hedge=True, headers=headers, data=payload, stream=True)
+        except CircuitOpenError:
+            # эндпоинт лежит целиком — не перебираем варианты payload и не виним партнёра;
+            # пустой ответ записался бы как «карты нет», поэтому ошибка уходит наверх
+            raise
         except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout):
             partner_state.mark_timeout(partner_id)
             continue
@@ -136,34 +173,38 @@ def _attempt_ajax(session: requests.Session, partner_state: PartnerState, partne
             continue
 
         content, too_big = read_capped(resp)
+        if too_big and small_limit > tuner.default:
+            # не влезла увеличенная страница — это не повод блокировать партнёра
+            tuner.shrink("POST", url, small_limit, kind=kind)
+            return _load_ajax(session, partner_state, partner_id, side, rank, search, offset, debug=debug)
         if too_big:
-            partner_state.blocked.add(partner_id)
-            partner_state.timeouts.pop(partner_id, None)
+            partner_state.block(partner_id)
             return []
 
-        text, j = decode_body_and_maybe_json(content or b"", resp.headers)
+        _text, j = decode_body_and_maybe_json(content or b"", resp.headers, want_text=False)
         partner_state.clear_timeout(partner_id)
 
         if isinstance(j, dict):
             cards = j.get("cards")
             if isinstance(cards, list):
                 if len(cards) > HUGE_LIST_THRESHOLD:
-                    partner_state.blocked.add(partner_id)
+                    partner_state.block(partner_id)
                     return []
                 return [normalize_card_entry(c) for c in cards]
             if isinstance(cards, str):
-                parsed = parse_trade_cards_html(cards)
+                parsed = parse_cards(cards)
                 if parsed:
                     return parsed
             for key in ("html", "view", "content"):
                 if isinstance(j.get(key), str):
-                    parsed = parse_trade_cards_html(j[key])
+                    parsed = parse_cards(j[key])
                     if parsed:
                         return parsed
 
-        parsed = parse_trade_cards_html(text or "")
-        if parsed:
-            return parsed
+        if j is None:
+            parsed = parse_cards(content or b"", body_charset(resp.headers))
+            if parsed:
+                return parsed
 
     return []
 
@@ -171,43 +212,108 @@ def load_trade_cards(session: requests.Session, partner_state: PartnerState, par
     if search:
         found = _attempt_search(session, partner_state, partner_id, offset, search, debug=debug)
         if found:
+            observe_cards(found)
+            if side == "receiver":
+                observe_holdings(partner_id, found)
             return found
-    return _attempt_ajax(session, partner_state, partner_id, side, rank, search, offset, debug=debug)
-
-def find_partner_card_instance(session: requests.Session, partner_id: int, side: str, card_id: int, rank: str, name: str, debug: bool=False) -> Optional[int]:
-    target_id = int(card_id)
-    state = PartnerState()
-
-    if len(norm_text(name)) > 2:
-        cards = load_trade_cards(session, state, partner_id, side, rank=rank, search=name, offset=0, debug=debug)
-        for c in cards:
-            if entry_card_id(c) == target_id:
-                inst = entry_instance_id(c)
-                if inst:
-                    return inst
-
-    if len(norm_text(name)) > 2:
-        cards2 = load_trade_cards(session, state, partner_id, side, rank=None, search=name, offset=0, debug=debug)
-        for c in cards2:
-            if entry_card_id(c) == target_id:
-                inst = entry_instance_id(c)
-                if inst:
-                    return inst
+    cards = _attempt_ajax(session, partner_state, partner_id, side, rank, search, offset, debug=debug)
+    observe_cards(cards)
+    if side == "receiver":
+        observe_holdings(partner_id, cards)
+    return cards
 
+def _match_wanted(cards: List[Dict[str, Any]], wanted: Dict[int, Dict[str, Any]], found: Dict[int, int]) -> None:
+    for c in cards:
+        cid = entry_card_id(c)
+        if cid in wanted and cid not in found:
+            inst = entry_instance_id(c)
+            if inst:
+                found[cid] = inst
+
+def find_partner_card_instances(session: requests.Session, partner_id: int, side: str, targets: List[Dict[str, Any]], debug: bool=False, partner_state: Optional[PartnerState] = None) -> Dict[int, int]:
+    """
+    Один проход по инвентарю партнёра сразу для нескольких целевых карт.
+    Возвращает card_id -> instance_id для найденных. CircuitOpenError не
+    глотается: открытый автомат не значит, что карты у партнёра нет.
+    Индекс владельцев решает, что спрашивать у сети: карта, которую партнёр
+    по индексу держит, подтверждается одним запросом (поиск с рангом или
+    фильтр по рангу); не подтвердилась — экземпляр удаляется из индекса и
+    карта ищется как обычно. Если свежий полный снимок инвентаря партнёра
+    (replace_user) карты не содержит, полный обход ради неё не делается.
+    partner_state — общее состояние партнёров (блокировки, таймауты) между вызовами.
+    """
+    state = partner_state if partner_state is not None else PartnerState()
+    wanted: Dict[int, Dict[str, Any]] = {}
+    for t in targets:
+        cid = int(t.get("card_id") or t.get("cardId") or 0)
+        if cid:
+            wanted.setdefault(cid, t)
+    found: Dict[int, int] = {}
+    catalog = active_catalog()
+    index = active_holdings() if side == "receiver" else None
+    known: Dict[int, int] = {}
+    synced = False
+    if index is not None:
+        try:
+            known = index.instances(partner_id, wanted)
+            synced_at = index.synced_at(partner_id)
+            synced = bool(synced_at) and time.time() - synced_at < HOLDINGS_MAX_AGE
+        except sqlite3.Error:
+            known, synced = {}, False
+
+    for cid, t in wanted.items():
+        name = t.get("name") or ""
+        rank = (t.get("rank") or "").strip()
+        if catalog is not None:
+            name = catalog.search_query_for(cid, name)
+            rank = rank or catalog.rank_for(cid)
+        if cid in found:
+            continue
+        searchable = len(norm_text(name)) > 2
+        if cid in known:
+            cards = load_trade_cards(session, state, partner_id, side, rank=rank or None, search=name if searchable else None, offset=0, debug=debug)
+            _match_wanted(cards, wanted, found)
+            if cid in found:
+                continue
+            if debug:
+                print(f"[HOLDINGS] partner {partner_id}: card {cid} inst {known[cid]} not confirmed, dropped from index")
+            forget_holding(partner_id, known[cid])
+        elif not searchable:
+            continue
+        else:
+            cards = load_trade_cards(session, state, partner_id, side, rank=rank, search=name, offset=0, debug=debug)
+            _match_wanted(cards, wanted, found)
+            if cid in found:
+                continue
+        if searchable:
+            cards2 = load_trade_cards(session, state, partner_id, side, rank=None, search=name, offset=0, debug=debug)
+            _match_wanted(cards2, wanted, found)
+
+    # полный обход — только за картами, которых свежий снимок не исключает
+    missing = [cid for cid in wanted if cid not in found and (cid in known or not synced)]
+    if not missing:
+        if debug and len(found) < len(wanted):
+            print(f"[HOLDINGS] partner {partner_id}: {len(wanted) - len(found)} cards absent from fresh snapshot, scan skipped")
+        return found
+
+    ranks = {(wanted[cid].get("rank") or "").strip() for cid in missing}
+    scan_rank = ranks.pop() if len(ranks) == 1 else None
     offset = 0
-    page_size = 60
     scanned = 0
+    tuner = page_tuner()
+    load_url = f"{BASE_URL}/trades/{partner_id}/availableCardsLoad"
+    scan_kind = "filtered" if scan_rank else ""
     for _page in range(0, 1000):
-        cards = load_trade_cards(session, state, partner_id, side, rank=rank, search=None, offset=offset, debug=debug)
+        page_size = tuner.next_limit("POST", load_url, kind=scan_kind)
+        cards = load_trade_cards(session, state, partner_id, side, rank=scan_rank, search=None, offset=offset, debug=debug)
+        more = tuner.record("POST", load_url, page_size, len(cards), kind=scan_kind)
         if not cards:
             break
-        for c in cards:
-            if entry_card_id(c) == target_id:
-                inst = entry_instance_id(c)
-                if inst:
-                    return inst
+        _match_wanted(cards, wanted, found)
+        if all(cid in found for cid in missing):
+            return found
         scanned += len(cards)
-        if len(cards) < page_size:
+        if not more:
             break
         offset += len(cards)
         time.sleep(0.18)
@@ -218,17 +324,75 @@ def find_partner_card_instance(session: requests.Session, partner_id: int, side:
         url = f"{BASE_URL}/trades/offers/{partner_id}"
         r = session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
         if r.status_code == 200:
-            parsed = parse_trade_cards_html(r.text)
-            for c in parsed:
-                if entry_card_id(c) == target_id:
-                    inst = entry_instance_id(c)
-                    if inst:
-                        return inst
+            parsed = parse_cards(r.content, r.encoding)
+            observe_cards(parsed)
+            _match_wanted(parsed, wanted, found)
     except Exception:
         pass
-    return None
+    return found
+
+def probe_when_available(owner_id: int, probe: Callable[[], Any], attempts: int = 3) -> Tuple[bool, Any]:
+    """
+    Проверка партнёра, которая переживает открытие автомата availableCardsLoad:
+    ждёт эндпоинт и повторяет probe. (False, None) — эндпоинт так и не поднялся,
+    партнёр остаётся непроверенным.
+    """
+    url = f"{BASE_URL}/trades/{owner_id}/availableCardsLoad"
+    for _ in range(max(1, attempts)):
+        if not wait_for_endpoint("POST", url, max_wait=BREAKER_MAX_WAIT):
+            return False, None
+        try:
+            return True, probe()
+        except CircuitOpenError:
+            continue
+    return False, None
 
-def create_trade_via_api(session: requests.Session, receiver_id: int, my_instance_id: int, his_instance_id: int, debug: bool=False) -> bool:
+def find_partner_card_instance(session: requests.Session, partner_id: int, side: str, card_id: int, rank: str, name: str, debug: bool=False, partner_state: Optional[PartnerState] = None) -> Optional[int]:
+    target = {"card_id": int(card_id), "rank": rank, "name": name}
+    return find_partner_card_instances(session, partner_id, side, [target], debug=debug, partner_state=partner_state).get(int(card_id))
+
+_SUCCESS_WORDS = ("успеш", "отправ", "создан")
+
+def _body_says_success(r: requests.Response, j: Any) -> bool:
+    if isinstance(j, dict):
+        body = json.dumps(j).lower()
+        if any(w in body for w in _SUCCESS_WORDS):
+            return True
+    body = (r.text or "").lower()
+    return any(w in body for w in _SUCCESS_WORDS)
+
+def _response_json(r: requests.Response) -> Any:
+    try:
+        return r.json()
+    except ValueError:
+        return None
+
+def _api_response_ok(r: requests.Response) -> bool:
+    if r.status_code in (301, 302) and "/trades/" in (r.headers.get("Location") or ""):
+        return True
+    j = _response_json(r)
+    if isinstance(j, dict):
+        if j.get("success") or j.get("ok") or (isinstance(j.get("trade"), dict) and j["trade"].get("id")):
+            return True
+    return _body_says_success(r, j)
+
+def _form_response_ok(r: requests.Response) -> bool:
+    if r.status_code in (301, 302):
+        loc = r.headers.get("Location", "")
+        if any(x in (loc or "") for x in ("/trades", "/messages", "/notifications", "/offers")):
+            return True
+    j = _response_json(r)
+    if isinstance(j, dict):
+        if j.get("success") or j.get("ok") or j.get("status") in ("ok", "success"):
+            return True
+    return _body_says_success(r, j)
+
+def _csrf_rejected(r: requests.Response) -> bool:
+    if r.status_code == 419:
+        return True
+    return r.status_code >= 400 and "csrf" in (r.text or "")[:4000].lower()
+
+def _api_post(session: requests.Session, receiver_id: int, my_ids: List[int], his_ids: List[int], as_json: bool=False) -> Optional[requests.Response]:
     url = f"{BASE_URL}/trades/create"
     headers = {
         "Referer": f"{BASE_URL}/trades/offers/{receiver_id}",
@@ -239,61 +403,40 @@ def create_trade_via_api(session: requests.Session, receiver_id: int, my_instanc
     }
     if "X-CSRF-TOKEN" in session.headers:
         headers["X-CSRF-TOKEN"] = session.headers["X-CSRF-TOKEN"]
-    data_pairs = [
-        ("receiver_id", int(receiver_id)),
-        ("creator_card_ids[]", int(my_instance_id)),
-        ("receiver_card_ids[]", int(his_instance_id)),
-    ]
     try:
-        r = post(session, url, data=data_pairs, headers=headers, allow_redirects=False)
+        if as_json:
+            json_payload = {
+                "receiver_id": receiver_id,
+                "creator_card_ids": [int(x) for x in my_ids],
+                "receiver_card_ids": [int(x) for x in his_ids],
+            }
+            return post(session, url, json=json_payload, headers={**headers, "Content-Type": "application/json"}, allow_redirects=False)
+        data_pairs = [("receiver_id", int(receiver_id))]
+        data_pairs += [("creator_card_ids[]", int(x)) for x in my_ids]
+        data_pairs += [("receiver_card_ids[]", int(x)) for x in his_ids]
+        return post(session, url, data=data_pairs, headers=headers, allow_redirects=False)
     except requests.RequestException:
-        return False
+        return None
 
-    if r.status_code in (301, 302) and "/trades/" in (r.headers.get("Location") or ""):
+def create_bundle_via_api(session: requests.Session, receiver_id: int, my_instance_ids: List[int], his_instance_ids: List[int], debug: bool=False) -> bool:
+    r = _api_post(session, receiver_id, my_instance_ids, his_instance_ids)
+    if r is None:
+        return False
+    if _api_response_ok(r):
         return True
+    r2 = _api_post(session, receiver_id, my_instance_ids, his_instance_ids, as_json=True)
+    return r2 is not None and _api_response_ok(r2)
 
-    try:
-        j = r.json()
-        if isinstance(j, dict):
-            if j.get("success") or j.get("ok") or (isinstance(j.get("trade"), dict) and j["trade"].get("id")):
-                return True
-            body = json.dumps(j).lower()
-            if "успеш" in body or "отправ" in body or "создан" in body:
-                return True
-    except ValueError:
-        pass
-    body = (r.text or "").lower()
-    if "успеш" in body or "отправ" in body or "создан" in body:
-        return True
+def create_trade_via_api(session: requests.Session, receiver_id: int, my_instance_id: int, his_instance_id: int, debug: bool=False) -> bool:
+    return create_bundle_via_api(session, receiver_id, [my_instance_id], [his_instance_id], debug=debug)
 
-    json_payload = {
-        "receiver_id": receiver_id,
-        "creator_card_ids": [my_instance_id],
-        "receiver_card_ids": [his_instance_id],
-    }
-    try:
-        r2 = post(session, url, json=json_payload, headers={**headers, "Content-Type": "application/json"}, allow_redirects=False)
-        if r2.status_code in (301, 302) and "/trades/" in (r2.headers.get("Location") or ""):
-            return True
-        try:
-            j2 = r2.json()
-            if isinstance(j2, dict):
-                if j2.get("success") or j2.get("ok") or (isinstance(j2.get("trade"), dict) and j2["trade"].get("id")):
-                    return True
-                body2 = json.dumps(j2).lower()
-                if "успеш" in body2 or "отправ" in body2 or "создан" in body2:
-                    return True
-        except ValueError:
-            pass
-        if "успеш" in (r2.text or "").lower():
-            return True
-    except requests.RequestException:
-        pass
-    return False
+def trade_form_info(session: requests.Session, partner_id: int, debug: bool=False, fresh: bool=False) -> Optional[Dict[str, Any]]:
+    """Форма предложения обмена: action, CSRF и hidden-поля. fresh=True — не из памяти single-flight."""
+    url = f"{BASE_URL}/trades/offers/{partner_id}"
+    return coalesce(session, "GET", url, None, lambda: _load_form_info(session, url), fresh=fresh)
 
-def trade_form_info(session: requests.Session, partner_id: int, debug: bool=False) -> Optional[Dict[str, Any]]:
+def _load_form_info(session: requests.Session, url: str) -> Optional[Dict[str, Any]]:
     from bs4 import BeautifulSoup
-    url = f"{BASE_URL}/trades/offers/{partner_id}"
     try:
         r = get(session, url)
     except requests.RequestException:
@@ -344,7 +487,7 @@ def trade_form_info(session: requests.Session, partner_id: int, debug: bool=Fals
 
     return {"action": action, "token": token, "hidden": hidden}
 
-def submit_trade_form(session: requests.Session, action_url: str, csrf: str, base_form: Dict[str, Any], my_instance_id: int, partner_instance_id: int, debug: bool=False) -> bool:
+def _form_post(session: requests.Session, action_url: str, csrf: str, base_form: Dict[str, Any], my_ids: List[int], his_ids: List[int]) -> Optional[requests.Response]:
     headers = {
         "Referer": action_url,
         "Origin": BASE_URL,
@@ -371,8 +514,8 @@ def submit_trade_form(session: requests.Session, action_url: str, csrf: str, bas
     ensure_list(data, "creator[]")
     ensure_list(data, "receiver[]")
 
-    data["creator[]"].append(str(my_instance_id))
-    data["receiver[]"].append(str(partner_instance_id))
+    data["creator[]"].extend(str(x) for x in my_ids)
+    data["receiver[]"].extend(str(x) for x in his_ids)
 
     form_payload = []
     for k, v in data.items():
@@ -383,86 +526,184 @@ def submit_trade_form(session: requests.Session, action_url: str, csrf: str, bas
             form_payload.append((k, str(v)))
 
     try:
-        r = post(session, action_url, data=form_payload, headers=headers, allow_redirects=False)
+        return post(session, action_url, data=form_payload, headers=headers, allow_redirects=False)
     except requests.RequestException:
-        return False
+        return None
 
-    if r.status_code in (301, 302):
-        loc = r.headers.get("Location", "")
-        if any(x in (loc or "") for x in ("/trades", "/messages", "/notifications", "/offers")):
-            return True
+def submit_trade_form(session: requests.Session, action_url: str, csrf: str, base_form: Dict[str, Any], my_instance_id: int, partner_instance_id: int, debug: bool=False) -> bool:
+    r = _form_post(session, action_url, csrf, base_form, [my_instance_id], [partner_instance_id])
+    return r is not None and _form_response_ok(r)
+
+class TradeSubmitter:
+    """
+    Отправка предложений в рамках одной сессии. Шаблон формы /trades/offers/{id}
+    выучивается один раз (id партнёра подставляется), CSRF-токен переиспользуется
+    до первого отказа, рабочий способ отправки запоминается — дальше одно
+    предложение стоит ровно один POST. После MAX_MISSES неудач подряд способ
+    забывается и снова подбирается каскадом.
+    """
+    MAX_MISSES = 3
+
+    def __init__(self, session: requests.Session, use_api: bool=True, debug: bool=False) -> None:
+        self.session = session
+        self.use_api = use_api
+        self.debug = debug
+        self.method: Optional[str] = None
+        self.misses = 0
+        self.template: Optional[Dict[str, Any]] = None
+        self.csrf = session.headers.get("X-CSRF-TOKEN", "")
+
+    def _methods(self) -> List[str]:
+        if self.method:
+            return [self.method]
+        return (["api_form", "api_json"] if self.use_api else []) + ["form"]
+
+    def _learn_form(self, partner_id: int, fresh: bool = False) -> bool:
+        info = trade_form_info(self.session, partner_id, debug=self.debug, fresh=fresh)
+        if not info:
+            return False
+        pid = str(partner_id)
+        hidden: Dict[str, Any] = {}
+        for k, v in (info.get("hidden") or {}).items():
+            if k == "_token":
+                continue
+            if isinstance(v, list):
+                hidden[k] = ["{partner_id}" if x == pid else x for x in v]
+            else:
+                hidden[k] = "{partner_id}" if v == pid else v
+        action = re.sub(rf"(?<!\d){pid}(?!\d)", "{partner_id}", info["action"])
+        self.template = {"action": action, "hidden": hidden}
+        if info.get("token"):
+            self.csrf = info["token"]
+            self.session.headers["X-CSRF-TOKEN"] = self.csrf
+        if self.debug:
+            print(f"[TRADE] form template learned: {action}")
+        return True
 
-    try:
-        j = r.json()
-        if isinstance(j, dict):
-            if j.get("success") or j.get("ok") or j.get("status") in ("ok", "success"):
-                return True
-            body = json.dumps(j).lower()
-            if "успеш" in body or "отправ" in body or "создан" in body:
+    def _form_for(self, partner_id: int) -> Tuple[str, Dict[str, Any]]:
+        pid = str(partner_id)
+        hidden: Dict[str, Any] = {}
+        for k, v in self.template["hidden"].items():
+            if isinstance(v, list):
+                hidden[k] = [pid if x == "{partner_id}" else x for x in v]
+            else:
+                hidden[k] = pid if v == "{partner_id}" else v
+        return self.template["action"].replace("{partner_id}", pid), hidden
+
+    def _post(self, method: str, partner_id: int, my_ids: List[int], his_ids: List[int]) -> Optional[requests.Response]:
+        if method == "form":
+            if self.template is None and not self._learn_form(partner_id):
+                return None
+            action, hidden = self._form_for(partner_id)
+            return _form_post(self.session, action, self.csrf, hidden, my_ids, his_ids)
+        if not wait_for_endpoint("POST", f"{BASE_URL}/trades/create", max_wait=BREAKER_MAX_WAIT):
+            return None
+        return _api_post(self.session, partner_id, my_ids, his_ids, as_json=(method == "api_json"))
+
+    def _ok(self, method: str, r: Optional[requests.Response]) -> bool:
+        if r is None:
+            return False
+        return _form_response_ok(r) if method == "form" else _api_response_ok(r)
+
+    def submit(self, partner_id: int, my_ids: List[int], his_ids: List[int]) -> bool:
+        for method in self._methods():
+            r = self._post(method, partner_id, my_ids, his_ids)
+            ok = self._ok(method, r)
+            if not ok and r is not None and _csrf_rejected(r):
+                if self.debug:
+                    print(f"[TRADE] CSRF rejected on {method}, refreshing token")
+                self.template = None
+                if self._learn_form(partner_id, fresh=True):
+                    r = self._post(method, partner_id, my_ids, his_ids)
+                    ok = self._ok(method, r)
+            if ok:
+                if self.debug and self.method != method:
+                    print(f"[TRADE] submission method: {method}")
+                self.method = method
+                self.misses = 0
                 return True
-    except ValueError:
-        pass
-    body = (r.text or "").lower()
-    if "успеш" in body or "отправ" in body or "создан" in body:
-        return True
-    return False
+        if self.method:
+            self.misses += 1
+            if self.misses >= self.MAX_MISSES:
+                self.method = None
+                self.misses = 0
+        return False
 
-def send_trades_to_online_owners(profile_data: Dict, target_card: Dict[str, Any], owners_iter, my_cards: List[Dict[str, Any]], dry_run: bool=True, use_api: bool=True, debug: bool=False) -> Dict[str, int]:
-    session = build_session_from_profile(profile_data)
-    stats = {"checked_pages": 0, "owners_seen": 0, "trades_attempted": 0, "trades_succeeded": 0, "skipped_no_my_cards": 0}
+def send_bundle(session: requests.Session, owner_id: int, my_ids: List[int], his_ids: List[int], dry_run: bool=True, use_api: bool=True, debug: bool=False, submitter: Optional[TradeSubmitter] = None) -> bool:
+    """Одно предложение с несколькими картами с каждой стороны: один POST и одна пауза на партнёра."""
+    if dry_run:
+        print(f"[DRY] {', '.join(map(str, my_ids))} -> {', '.join(map(str, his_ids))} для {owner_id}")
+        return False
+
+    submitter = submitter or TradeSubmitter(session, use_api=use_api, debug=debug)
+    success = submitter.submit(int(owner_id), [int(x) for x in my_ids], [int(x) for x in his_ids])
+    time.sleep(0.4 + random.random() * 0.6)
+    return success
+
+def send_offer(session: requests.Session, owner_id: int, my_inst: int, his_inst: int, dry_run: bool=True, use_api: bool=True, debug: bool=False, submitter: Optional[TradeSubmitter] = None) -> bool:
+    return send_bundle(session, owner_id, [my_inst], [his_inst], dry_run=dry_run, use_api=use_api, debug=debug, submitter=submitter)
+
+def send_trades_to_online_owners(profile_data: Dict, target_card: Dict[str, Any], owners_iter, my_cards: List[Dict[str, Any]], dry_run: bool=True, use_api: bool=True, debug: bool=False, session: Optional[requests.Session] = None, checkpoint: Optional[CampaignCheckpoint] = None) -> Dict[str, int]:
+    session = session or build_session_from_profile(profile_data)
+    stats = {"checked_pages": 0, "owners_seen": 0, "trades_attempted": 0, "trades_succeeded": 0, "skipped_no_my_cards": 0, "skipped_no_free_instance": 0}
+    checkpoint = checkpoint or CampaignCheckpoint()
+    checkpoint.restore_stats(stats)
 
     rank = (target_card.get("rank") or "").strip()
-    def instances_any(cards: List[Dict[str, Any]]) -> List[int]:
-        out = []
-        for c in cards:
-            inst = entry_instance_id(c)
-            if inst:
-                out.append(inst)
-        return out
+    pool = InstancePool(my_cards)
+    for inst in checkpoint.reserved():
+        pool.take(inst)
 
-    my_instances: List[int] = []
-    if rank:
-        for c in my_cards:
-            r = (c.get("rank") or c.get("grade") or "").strip()
-            if r == rank:
-                inst = entry_instance_id(c)
-                if inst:
-                    my_instances.append(inst)
-    if not my_instances:
-        my_instances = instances_any(my_cards)
-
-    if not my_instances:
+    if not len(pool):
         stats["skipped_no_my_cards"] = 1
         return stats
 
     card_id = int(target_card.get("card_id") or target_card.get("cardId") or 0)
     name = target_card.get("name") or ""
+    submitter = TradeSubmitter(session, use_api=use_api, debug=debug)
 
-    for page_num, owners in owners_iter:
-        stats["checked_pages"] += 1
-        if not owners:
-            continue
-        for owner_id in owners:
-            stats["owners_seen"] += 1
-            if str(owner_id) == str(profile_data.get("id")):
-                continue
-            his_inst = find_partner_card_instance(session, int(owner_id), "receiver", card_id, rank, name, debug=debug)
-            if not his_inst:
+    try:
+        for page_num, owners in owners_iter:
+            if 0 < page_num <= checkpoint.page:
                 continue
-            my_inst = random.choice(my_instances)
-            stats["trades_attempted"] += 1
-            if dry_run:
-                print(f"[DRY] {my_inst} -> {his_inst} для {owner_id}")
+            stats["checked_pages"] += 1
+            if not owners:
+                checkpoint.page_done(page_num, stats)
                 continue
-
-            success = False
-            if use_api:
-                success = create_trade_via_api(session, int(owner_id), int(my_inst), int(his_inst), debug=debug)
-            if not success:
-                form = trade_form_info(session, int(owner_id), debug=debug)
-                if form:
-                    success = submit_trade_form(session, form["action"], form.get("token", ""), form.get("hidden", {}), int(my_inst), int(his_inst), debug=debug)
-            if success:
-                stats["trades_succeeded"] += 1
-            time.sleep(0.4 + random.random() * 0.6)
-    return stats
\ No newline at end of file
+            candidates: Dict[int, List[Dict[str, Any]]] = {}
+            for owner_id in owners:
+                if str(owner_id) == str(profile_data.get("id")) or checkpoint.handled(int(owner_id)):
+                    continue
+                known, his_inst = checkpoint.probe(int(owner_id))
+                if not known:
+                    stats["owners_seen"] += 1
+                    ok, his_inst = probe_when_available(int(owner_id), lambda: find_partner_card_instance(session, int(owner_id), "receiver", card_id, rank, name, debug=debug))
+                    if not ok:
+                        print("❌ availableCardsLoad недоступен, рассылка остановлена")
+                        stats["aborted_circuit_open"] = 1
+                        checkpoint.save()
+                        return stats
+                    checkpoint.record_probe(int(owner_id), his_inst or 0)
+                if his_inst:
+                    candidates[int(owner_id)] = [{"card_id": card_id, "rank": rank, "his_inst": his_inst}]
+
+            assigned = assign_offers(candidates, pool)
+            stats["skipped_no_free_instance"] += len(candidates) - len(assigned)
+            for owner_id, pairs in assigned.items():
+                for slot, my_inst in pairs:
+                    stats["trades_attempted"] += 1
+                    ok = send_offer(session, owner_id, int(my_inst), int(slot["his_inst"]), dry_run=dry_run, use_api=use_api, debug=debug, submitter=submitter)
+                    if ok:
+                        stats["trades_succeeded"] += 1
+                    elif not dry_run:
+                        pool.release(my_inst)
+                    checkpoint.record_offer(owner_id, [int(my_inst)] if ok or dry_run else [], stats)
+            checkpoint.page_done(page_num, stats)
+    except OwnersWalkIncomplete as e:
+        # обход оборвался на ошибке — чекпоинт остаётся, --resume продолжит с этой страницы
+        print(f"❌ Обход владельцев прерван: {e}")
+        stats["aborted_incomplete"] = 1
+        checkpoint.save()
+        return stats
+    checkpoint.finish()
+    return stats
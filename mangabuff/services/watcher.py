@@ -0,0 +1,148 @@
+import pathlib
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from mangabuff.config import WATCH_BOOST_BACKOFF_MAX, WATCH_INTERVAL
+from mangabuff.http.http_utils import build_session_from_profile
+from mangabuff.services.club import fetch_boost_card_href, find_boost_card_info
+from mangabuff.services.checkpoint import CampaignCheckpoint
+from mangabuff.services.owners import OwnersWalkIncomplete, iter_online_owners_by_pages
+from mangabuff.services.trade import send_trades_to_online_owners
+from mangabuff.utils.idset import IdSet
+
+
+class OwnersSnapshot:
+    """
+    Снимок владельцев карты между циклами демона: отдаёт только тех,
+    кого не было в списке онлайн на прошлом цикле (новые или снова онлайн).
+    Кому уже ушло предложение, отсекает чекпоинт демона, а не снимок.
+    """
+    def __init__(self) -> None:
+        self.online = IdSet()
+
+    def reset(self) -> None:
+        self.online = IdSet()
+
+    def diff(self, current: Iterable[int]) -> List[int]:
+        fresh: List[int] = []
+        now = IdSet()
+        for uid in current:
+            if uid in now:
+                continue
+            now.add(uid)
+            if uid not in self.online:
+                fresh.append(uid)
+        self.online = now
+        return fresh
+
+
+def _card_id_from_href(href: Optional[str]) -> Optional[int]:
+    m = re.search(r"/cards/(\d+)", href or "")
+    return int(m.group(1)) if m else None
+
+
+def _merge_stats(total: Dict[str, int], part: Dict[str, int]) -> None:
+    for k, v in part.items():
+        total[k] = total.get(k, 0) + v
+
+
+def run_watcher(
+    profile_data: Dict,
+    profiles_dir: pathlib.Path,
+    my_cards: List[Dict[str, Any]],
+    target_card: Optional[Dict[str, Any]] = None,
+    boost_url: Optional[str] = None,
+    target_loader: Optional[Callable[[pathlib.Path], Optional[Dict[str, Any]]]] = None,
+    interval: int = WATCH_INTERVAL,
+    max_pages: int = 0,
+    max_cycles: int = 0,
+    dry_run: bool = True,
+    use_api: bool = True,
+    debug: bool = False,
+    session: Optional[requests.Session] = None,
+) -> Dict[str, int]:
+    """
+    Демон: держит одну сессию, каждые interval секунд опрашивает boost-страницу
+    клуба и страницы владельцев целевой карты, обмены шлёт только новым онлайн-владельцам.
+    При смене клубной карты цель пересобирается через find_boost_card_info + target_loader;
+    неудачная пересборка повторяется не чаще, чем с удвоением паузы до WATCH_BOOST_BACKOFF_MAX.
+    Один чекпоинт в памяти на всю цель: кому уже ушло предложение, повторно
+    не трогаем, а отданный экземпляр не уходит второй раз.
+    Неполный обход владельцев (ошибка на странице) цикл пропускает, снимок не меняется.
+    max_cycles = 0 — работать бесконечно.
+    """
+    session = session or build_session_from_profile(profile_data)
+    snapshot = OwnersSnapshot()
+    checkpoint = CampaignCheckpoint()
+    totals: Dict[str, int] = {"cycles": 0, "owners_new": 0}
+    boost_card_id: Optional[int] = None
+    # карта, которую не удалось загрузить: (card_id, число неудач, когда пробовать снова)
+    boost_failed: Optional[Tuple[int, int, float]] = None
+
+    cycle = 0
+    while not max_cycles or cycle < max_cycles:
+        cycle += 1
+        started = time.monotonic()
+
+        if boost_url:
+            href = fetch_boost_card_href(session, boost_url, debug=debug)
+            new_id = _card_id_from_href(href)
+            retry_later = boost_failed is not None and boost_failed[0] == new_id and time.monotonic() < boost_failed[2]
+            if new_id and new_id != boost_card_id and not retry_later:
+                res = find_boost_card_info(profile_data, profiles_dir, boost_url, debug=debug, session=session)
+                loaded = target_loader(res[1]) if (res and target_loader) else None
+                if loaded:
+                    target_card = loaded
+                    boost_card_id = new_id
+                    boost_failed = None
+                    snapshot.reset()
+                    checkpoint = CampaignCheckpoint()
+                    print(f"🔄 Клубная карта сменилась: {new_id}")
+                else:
+                    fails = boost_failed[1] + 1 if boost_failed is not None and boost_failed[0] == new_id else 1
+                    delay = min(WATCH_BOOST_BACKOFF_MAX, max(1, interval) * 2 ** (fails - 1))
+                    boost_failed = (new_id, fails, time.monotonic() + delay)
+                    print(f"❌ Не удалось загрузить клубную карту {new_id}, повтор через {delay} с")
+
+        if target_card:
+            card_id = int(target_card["card_id"])
+            current: List[int] = []
+            try:
+                for _page, owners in iter_online_owners_by_pages(profile_data, card_id, max_pages=max_pages, debug=debug, session=session, strict=True):
+                    current.extend(owners)
+            except OwnersWalkIncomplete as e:
+                # без хвоста списка все владельцы с этой страницы на следующем цикле выглядели бы новыми
+                print(f"❌ [WATCH] cycle {cycle}: обход владельцев прерван ({e}), цикл пропущен")
+                totals["cycles_incomplete"] = totals.get("cycles_incomplete", 0) + 1
+                fresh = None
+            else:
+                fresh = snapshot.diff(current)
+                if debug:
+                    print(f"[WATCH] cycle {cycle}: {len(snapshot.online)} online, {len(fresh)} new")
+            if fresh:
+                totals["owners_new"] += len(fresh)
+                # статистика чекпоинта накопительная — в итог идёт только прирост цикла
+                before = dict(checkpoint.stats)
+                stats = send_trades_to_online_owners(
+                    profile_data=profile_data,
+                    target_card=target_card,
+                    owners_iter=iter([(0, fresh)]),
+                    my_cards=my_cards,
+                    dry_run=dry_run,
+                    use_api=use_api,
+                    debug=debug,
+                    session=session,
+                    checkpoint=checkpoint,
+                )
+                _merge_stats(totals, {k: v - before.get(k, 0) for k, v in stats.items()})
+        elif debug:
+            print(f"[WATCH] cycle {cycle}: no target card")
+
+        totals["cycles"] += 1
+        if max_cycles and cycle >= max_cycles:
+            break
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return totals
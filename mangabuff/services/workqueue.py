@@ -0,0 +1,177 @@
+import json
+import pathlib
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from mangabuff.config import SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS
+
+PENDING = "pending"
+LEASED = "leased"
+SENDING = "sending"
+DONE = "done"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, kind, id);
+CREATE TABLE IF NOT EXISTS reserved (
+    account TEXT NOT NULL,
+    inst INTEGER NOT NULL,
+    partner INTEGER NOT NULL,
+    worker TEXT,
+    PRIMARY KEY (account, inst)
+);
+"""
+
+
+class WorkQueue:
+    """
+    Локальная очередь задач одной кампании в SQLite (WAL), общая для процессов.
+    Задачи: "page" — страница владельцев, "partner" — проверка и предложение партнёру.
+    (kind, key) уникальны, поэтому партнёр попадает в очередь один раз.
+    Задача берётся в аренду на lease секунд; аренда умершего воркера истекает,
+    и задачу забирает другой. Перед отправкой предложения задача переводится
+    в "sending": такие задачи после истечения аренды не переотправляются.
+    """
+    def __init__(self, path: pathlib.Path, lease: float = SHARD_LEASE_SECONDS, max_attempts: int = SHARD_MAX_ATTEMPTS) -> None:
+        self.path = pathlib.Path(path)
+        self.lease = lease
+        self.max_attempts = max(1, max_attempts)
+        self.conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _tx(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def get_meta(self, k: str, default: Optional[str] = None) -> Optional[str]:
+        row = self.conn.execute("SELECT v FROM meta WHERE k = ?", (k,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, k: str, v: str) -> None:
+        self.conn.execute("INSERT INTO meta (k, v) VALUES (?, ?) ON CONFLICT(k) DO UPDATE SET v = excluded.v", (k, v))
+
+    def add(self, kind: str, keys: Iterable[Any], payload: Optional[Dict[str, Any]] = None) -> int:
+        data = json.dumps(payload or {})
+        conn = self._tx()
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, key, payload) VALUES (?, ?, ?)",
+                [(kind, str(k), data) for k in keys],
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def lease_next(self, worker: str, kinds: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Берёт следующую задачу: сначала партнёры (они онлайн сейчас), затем страницы."""
+        now = time.time()
+        conn = self._tx()
+        try:
+            # аренда истекла посреди отправки — исход неизвестен, повторять нельзя
+            conn.execute("UPDATE tasks SET state = ? WHERE state = ? AND lease_until < ?", (UNKNOWN, SENDING, now))
+            conn.execute(
+                "UPDATE tasks SET state = ? WHERE state IN (?, ?) AND attempts >= ? AND (state = ? OR lease_until < ?)",
+                (FAILED, PENDING, LEASED, self.max_attempts, PENDING, now),
+            )
+            kind_filter = ""
+            params: List[Any] = [PENDING, LEASED, now]
+            if kinds:
+                kind_filter = f" AND kind IN ({','.join('?' for _ in kinds)})"
+                params.extend(kinds)
+            row = conn.execute(
+                "SELECT id, kind, key, payload, attempts FROM tasks"
+                " WHERE (state = ? OR (state = ? AND lease_until < ?))" + kind_filter +
+                " ORDER BY kind = 'page', id LIMIT 1",
+                params,
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE tasks SET state = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (LEASED, worker, now + self.lease, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"id": row[0], "kind": row[1], "key": row[2], "payload": json.loads(row[3] or "{}"), "attempts": row[4] + 1}
+
+    def _update_owned(self, task_id: int, worker: str, state: str, result: Optional[Dict[str, Any]] = None, extend: bool = False) -> bool:
+        lease_until = time.time() + self.lease if extend else 0
+        cur = self.conn.execute(
+            "UPDATE tasks SET state = ?, result = COALESCE(?, result), lease_until = CASE WHEN ? > 0 THEN ? ELSE lease_until END"
+            " WHERE id = ? AND lease_owner = ? AND state IN (?, ?)",
+            (state, json.dumps(result) if result is not None else None, lease_until, lease_until, task_id, worker, LEASED, SENDING),
+        )
+        return cur.rowcount == 1
+
+    def begin_send(self, task_id: int, worker: str) -> bool:
+        """False — аренду уже забрал другой воркер, отправлять нельзя."""
+        return self._update_owned(task_id, worker, SENDING, extend=True)
+
+    def complete(self, task_id: int, worker: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        return self._update_owned(task_id, worker, DONE, result)
+
+    def retry(self, task_id: int, worker: str) -> bool:
+        return self._update_owned(task_id, worker, PENDING)
+
+    def claim_instance(self, account: str, inst: int, partner: int, worker: str) -> bool:
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO reserved (account, inst, partner, worker) VALUES (?, ?, ?, ?)",
+            (account, int(inst), int(partner), worker),
+        )
+        return cur.rowcount == 1
+
+    def release_instance(self, account: str, inst: int) -> None:
+        self.conn.execute("DELETE FROM reserved WHERE account = ? AND inst = ?", (account, int(inst)))
+
+    def reserved_instances(self, account: str) -> List[int]:
+        return [r[0] for r in self.conn.execute("SELECT inst FROM reserved WHERE account = ?", (account,))]
+
+    def active(self) -> int:
+        """Сколько задач ещё может быть выполнено (pending или в аренде)."""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE state IN (?, ?, ?)", (PENDING, LEASED, SENDING)
+        ).fetchone()
+        return int(row[0])
+
+    def summary(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for kind, state, cnt in self.conn.execute("SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state"):
+            out[f"{kind}_{state}"] = cnt
+        for (result,) in self.conn.execute("SELECT result FROM tasks WHERE kind = 'partner' AND result IS NOT NULL"):
+            try:
+                res = json.loads(result)
+            except ValueError:
+                continue
+            for k, v in res.items():
+                if isinstance(v, bool):
+                    v = int(v)
+                if isinstance(v, int):
+                    out[k] = out.get(k, 0) + v
+        return out
@@ -0,0 +1,160 @@
+"""
+Компактное множество неотрицательных целых id (пользователи, партнёры).
+
+Хранится отсортированным array('q') — 8 байт на id против ~60 у set[int] —
+плюс небольшой буфер недавних добавлений, который периодически вливается в
+массив. Проверка членства — bisect; объединение/разность/пересечение дают
+новый IdSet. Сериализация — дельты отсортированных id в varint (to_bytes),
+для JSON — base64 (to_text).
+"""
+import array
+import base64
+from bisect import bisect_left
+from typing import Iterable, Iterator, Set
+
+
+def _sorted_unique(ids: Iterable[int]) -> "array.array[int]":
+    return array.array("q", sorted(set(ids)))
+
+
+class IdSet:
+    __slots__ = ("_arr", "_buf")
+
+    MIN_BUFFER = 256
+
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        self._arr = _sorted_unique(int(i) for i in ids)
+        if self._arr and self._arr[0] < 0:
+            raise ValueError("IdSet: id must be non-negative")
+        self._buf: Set[int] = set()
+
+    @classmethod
+    def _wrap(cls, arr: "array.array[int]") -> "IdSet":
+        out = cls.__new__(cls)
+        out._arr = arr
+        out._buf = set()
+        return out
+
+    def _in_arr(self, x: int) -> bool:
+        arr = self._arr
+        i = bisect_left(arr, x)
+        return i < len(arr) and arr[i] == x
+
+    def _compact(self) -> "array.array[int]":
+        if self._buf:
+            self._arr = _sorted_unique(self._arr.tolist() + list(self._buf))
+            self._buf = set()
+        return self._arr
+
+    def add(self, x: int) -> None:
+        x = int(x)
+        if x < 0:
+            raise ValueError("IdSet: id must be non-negative")
+        if x in self._buf or self._in_arr(x):
+            return
+        self._buf.add(x)
+        if len(self._buf) >= max(self.MIN_BUFFER, len(self._arr) // 4):
+            self._compact()
+
+    def update(self, ids: Iterable[int]) -> None:
+        for x in ids:
+            self.add(x)
+
+    def discard(self, x: int) -> None:
+        x = int(x)
+        if x in self._buf:
+            self._buf.discard(x)
+            return
+        arr = self._arr
+        i = bisect_left(arr, x)
+        if i < len(arr) and arr[i] == x:
+            del arr[i]
+
+    def __contains__(self, x: object) -> bool:
+        if not isinstance(x, int):
+            return False
+        return x in self._buf or self._in_arr(x)
+
+    def __len__(self) -> int:
+        return len(self._arr) + len(self._buf)
+
+    def __bool__(self) -> bool:
+        return bool(self._arr) or bool(self._buf)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._compact())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, IdSet):
+            return self._compact() == other._compact()
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and all(x in self for x in other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"IdSet({len(self)} ids)"
+
+    def copy(self) -> "IdSet":
+        return IdSet._wrap(array.array("q", self._compact()))
+
+    @staticmethod
+    def _values(other: Iterable[int]) -> Set[int]:
+        return set(other._compact()) if isinstance(other, IdSet) else {int(x) for x in other}
+
+    def __or__(self, other: Iterable[int]) -> "IdSet":
+        return IdSet._wrap(_sorted_unique(set(self._compact()) | self._values(other)))
+
+    def __and__(self, other: Iterable[int]) -> "IdSet":
+        if isinstance(other, IdSet) and len(other) < len(self):
+            return other & self
+        return IdSet._wrap(array.array("q", [x for x in self._compact() if x in other]))
+
+    def __sub__(self, other: Iterable[int]) -> "IdSet":
+        drop = other if isinstance(other, (IdSet, set, frozenset)) else self._values(other)
+        return IdSet._wrap(array.array("q", [x for x in self._compact() if x not in drop]))
+
+    def __ior__(self, other: Iterable[int]) -> "IdSet":
+        self._arr = (self | other)._arr
+        self._buf = set()
+        return self
+
+    union = __or__
+    intersection = __and__
+    difference = __sub__
+
+    def to_bytes(self) -> bytes:
+        """Дельты отсортированных id в varint (LEB128): плотные id — 1–3 байта на id."""
+        out = bytearray()
+        prev = 0
+        for x in self._compact():
+            delta = x - prev
+            prev = x
+            while delta >= 0x80:
+                out.append((delta & 0x7F) | 0x80)
+                delta >>= 7
+            out.append(delta)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "IdSet":
+        arr = array.array("q")
+        prev = 0
+        delta = 0
+        shift = 0
+        for b in data:
+            delta |= (b & 0x7F) << shift
+            if b & 0x80:
+                shift += 7
+                continue
+            prev += delta
+            arr.append(prev)
+            delta = 0
+            shift = 0
+        return cls._wrap(arr)
+
+    def to_text(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_text(cls, text: str) -> "IdSet":
+        return cls.from_bytes(base64.b64decode(text or ""))
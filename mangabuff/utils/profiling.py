@@ -0,0 +1,178 @@
+import contextlib
+import io
+import pathlib
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Функции, время которых выносится в отчёт отдельной строкой в каждой фазе
+HOT_FUNCTIONS = (
+    "parse_trade_cards_html",
+    "parse_online_unlocked_owners",
+    "parse_wanters",
+    "decode_body_and_maybe_json",
+    "read_capped",
+    "normalize_card_entry",
+)
+
+
+class NullProfiler:
+    """Заглушка для запуска без --profile: фазы ничего не делают, итераторы не оборачиваются."""
+    enabled = False
+
+    def phase(self, name: str):
+        return contextlib.nullcontext()
+
+    def wrap_iter(self, name: str, iterable: Iterable) -> Iterable:
+        return iterable
+
+    def report(self) -> Optional[pathlib.Path]:
+        return None
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, profiler: "PhaseProfiler", interval: float) -> None:
+        super().__init__(name="mangabuff-stack-sampler", daemon=True)
+        self.profiler = profiler
+        self.interval = interval
+        self.target_ident = threading.main_thread().ident
+        self.counts: Dict[str, int] = {}
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.target_ident)
+            if frame is None:
+                continue
+            names: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{pathlib.Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            phase = self.profiler.current_phase() or "other"
+            key = ";".join([phase] + names[::-1])
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self) -> None:
+        self._halt.set()
+        self.join(timeout=1.0)
+
+
+class PhaseProfiler:
+    """
+    --profile: каждая фаза (login, inventory, owners, trades, ...) получает свой cProfile
+    и свои метрики tracemalloc. Вложенная фаза ставит внешнюю на паузу, поэтому время
+    cProfile не задваивается. Отчёт: топ функций по cumulative, пиковая память,
+    места аллокаций; с stacks=True — collapsed stacks для flamegraph.pl/speedscope.
+    """
+    enabled = True
+
+    def __init__(self, out_dir: pathlib.Path, stacks: bool = False, top: int = 25, sample_interval: float = 0.005) -> None:
+        import cProfile
+        import tracemalloc
+        self._cprofile = cProfile
+        self._tracemalloc = tracemalloc
+        self.out_dir = pathlib.Path(out_dir)
+        self.top = top
+        self.profiles: Dict[str, Any] = {}
+        self.wall: Dict[str, float] = {}
+        self.peak: Dict[str, int] = {}
+        self.alloc_diffs: Dict[str, List[Any]] = {}
+        self._stack: List[str] = []
+        # пик каждой открытой фазы до reset_peak во вложенной фазе
+        self._held_peaks: List[int] = []
+        # время снимков tracemalloc вычитается из wall внешних фаз
+        self._overhead = 0.0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self._sampler: Optional[_StackSampler] = None
+        if stacks:
+            self._sampler = _StackSampler(self, sample_interval)
+            self._sampler.start()
+
+    def current_phase(self) -> Optional[str]:
+        return self._stack[-1] if self._stack else None
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        outer = self.current_phase()
+        if outer:
+            self.profiles[outer].disable()
+        prof = self.profiles.get(name)
+        if prof is None:
+            prof = self.profiles[name] = self._cprofile.Profile()
+        tm = self._tracemalloc
+        t0 = time.perf_counter()
+        before = tm.take_snapshot()
+        if self._held_peaks:
+            self._held_peaks[-1] = max(self._held_peaks[-1], tm.get_traced_memory()[1])
+        tm.reset_peak()
+        self._stack.append(name)
+        self._held_peaks.append(0)
+        started = time.perf_counter()
+        self._overhead += started - t0
+        overhead_at_start = self._overhead
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            finished = time.perf_counter()
+            self.wall[name] = self.wall.get(name, 0.0) + (finished - started) - (self._overhead - overhead_at_start)
+            self._stack.pop()
+            peak = max(self._held_peaks.pop(), tm.get_traced_memory()[1])
+            self.peak[name] = max(self.peak.get(name, 0), peak)
+            if self._held_peaks:
+                self._held_peaks[-1] = max(self._held_peaks[-1], peak)
+            after = tm.take_snapshot()
+            self.alloc_diffs.setdefault(name, []).extend(after.compare_to(before, "lineno")[: self.top])
+            self._overhead += time.perf_counter() - finished
+            if outer:
+                self.profiles[outer].enable()
+
+    def wrap_iter(self, name: str, iterable: Iterable) -> Iterator:
+        it = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def _phase_report(self, name: str) -> str:
+        import pstats
+        out = io.StringIO()
+        out.write(f"== {name}: wall {self.wall.get(name, 0.0):.3f}s, peak {self.peak.get(name, 0) / 1024:.0f} KiB\n")
+        stats = pstats.Stats(self.profiles[name], stream=out)
+        hot = []
+        for (filename, _line, func), row in stats.stats.items():
+            if func in HOT_FUNCTIONS:
+                hot.append((func, row[1], row[3]))
+        for func, calls, cum in sorted(hot, key=lambda x: x[2], reverse=True):
+            out.write(f"   {func}: {calls} calls, {cum:.3f}s cumulative\n")
+        stats.sort_stats("cumulative").print_stats(self.top)
+        diffs = sorted(self.alloc_diffs.get(name, []), key=lambda d: d.size_diff, reverse=True)[: self.top]
+        if diffs:
+            out.write("  top allocation sites:\n")
+            for d in diffs:
+                frame = d.traceback[0]
+                out.write(f"   {frame.filename}:{frame.lineno}: {d.size_diff / 1024:+.1f} KiB ({d.count_diff:+d} blocks)\n")
+        return out.getvalue()
+
+    def report(self) -> Optional[pathlib.Path]:
+        if self._sampler:
+            self._sampler.stop()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        path = self.out_dir / f"profile_{stamp}.txt"
+        with path.open("w", encoding="utf-8") as f:
+            for name in self.profiles:
+                f.write(self._phase_report(name))
+                f.write("\n")
+        if self._sampler and self._sampler.counts:
+            with (self.out_dir / f"profile_{stamp}.collapsed").open("w", encoding="utf-8") as f:
+                for key, cnt in sorted(self._sampler.counts.items()):
+                    f.write(f"{key} {cnt}\n")
+        return path